@@ -4,46 +4,126 @@ This file handles the logic for generating a report using an LLM.
 
 import re
 import os
+import json
 import time
+import asyncio
 from openai import OpenAI
-
-try:
-    with open("LLM/api_key.txt", "r") as f: # filepath adjusted because we are running this code from a different folder. Ideally everyone renames to openai_api_key.txt and puts it in parent folder but its fine
-        api_key = f.read().strip()
-    os.environ['OPENAI_API_KEY'] = api_key
-except FileNotFoundError:
-    print("Error: API key file not found. Create 'api_key.txt' with your API key.")
-    exit(1)
-except Exception as e:
-    print(f"Error loading API key: {e}")
-    exit(1)
+from LLM.transport import AsyncLLMTransport, LLMCallError, LLMUnavailableError, is_retryable, backoff_delay
+from LLM.result_cache import LLMResultCache, cache_key
+from tracing import tracer
+
+# an OPENAI_API_KEY that's already set wins over the file (e.g. harness.py's fake key)
+if not os.environ.get('OPENAI_API_KEY'):
+    try:
+        with open("LLM/api_key.txt", "r") as f: # filepath adjusted because we are running this code from a different folder. Ideally everyone renames to openai_api_key.txt and puts it in parent folder but its fine
+            api_key = f.read().strip()
+        os.environ['OPENAI_API_KEY'] = api_key
+    except FileNotFoundError:
+        print("Error: API key file not found. Create 'api_key.txt' with your API key, or set OPENAI_API_KEY.")
+        exit(1)
+    except Exception as e:
+        print(f"Error loading API key: {e}")
+        exit(1)
 
 client = OpenAI()
+# used by the async paths: backoff with jitter and a circuit breaker instead of sleeping the event loop
+transport = AsyncLLMTransport()
+
+# what reports get instead of a recommendation while the LLM provider is unhealthy
+RECOMMENDATION_PENDING = "recommendation pending"
+# and what they get when a call failed in a way retrying won't fix (bad request, auth, unknown model)
+LLM_FAILED = "LLM call failed"
+
+# bump this whenever a prompt or the labels change, so results from the old prompts aren't reused
+PROMPT_VERSION = 1
+# same message content -> same LLM results, cached in memory and in a local SQLite file.
+# memory only until bot.py calls open_result_cache(), so importing this module doesn't create the file
+RESULT_CACHE_PATH = "LLM/llm_cache.sqlite3"
+result_cache = LLMResultCache(None)
+
+def open_result_cache(path=RESULT_CACHE_PATH):
+    global result_cache
+    result_cache = LLMResultCache(path)
+    return result_cache
+REPORT_FIELDS = ['report_type', 'misinfo_type', 'misinfo_subtype', 'imminent', 'LLM_recommendation', 'llm_status', 'llm_error']
+
+# shared by every prompt that asks for a moderation recommendation
+MODERATION_POLICY = """    Defining political misinformation is contentious, fraught with conflicting values and subjective interpretations, and a constantly evolving task. We do not expect, nor do we want, to eliminate all such misinformation from our platform. We want our approach to balance our values of free expression, safety, and authenticity. We define a few categories of misinformation that will be removed, and outline where there is room for human moderators to evaluate content case-by-case in the best interests of our users and our values.
+
+    Physical harm. We will remove political misinformation that poses imminent risk of death, serious injury, or other physical harm. This includes content that an authoritative third party expert has determined is false or unverifiable claims for which there are no authoritative third parties. This includes, for example, real footage of violence or human rights violations from past events that are misattributed to different events or groups. We will also prioritize removal of misinformation that poses imminent risk of serious mental distress or financial harm.
+
+    Census/election interference. We will remove misleading or deceptive content about dates, locations, times, eligibility, and other essential public information regarding census and election operations. This includes, for example, unverified claims that immigration enforcement is at a voting location, or unverified claims about widespread voter fraud.
+
+    Health misinformation. Healthcare and medicine have become increasingly politicized. We will remove health misinformation when public health authorities conclude it is false, especially during public health emergencies. This includes vaccine misinformation and promotion of unsupported cures and treatments.
 
-def call_gpt(sys_instruction, content, retries=3, wait_time=60):
-    attempt = 0
-    while attempt < retries:
+    Other common considerations. For violative misinformation presented in educational and artistic settings, if there is additional context, we will evaluate on a case-by-case basis. We believe that satire and counterspeech are vital to productive dialogue. Misinformation occurs frequently in conjunction with other abuses such as fraud and coordinated inauthentic behavior. We reserve the right to take coordinated action, including removal, across accounts and content when appropriate."""
+
+# when True, LLM_report fills out the whole report with one structured-output call and only
+# falls back to the step-by-step calls below if that output doesn't validate
+SINGLE_CALL_REPORTS = True
+
+# the labels the report flow uses for each answer, so both modes fill out report_details the same way
+MISINFO_SUBTYPES = {
+    "Political Misinformation": ["Election/Campaign Misinformation", "Government/Civic Services", "Manipulated Photos/Video", "Other"],
+    "Health Misinformation": ["Vaccines", "Cures and Treatments", "Mental Health", "Other"],
+    "Other Misinformation": ["Other"],
+}
+IMMINENT_LABELS = ["Non-imminent", "physical", "mental", "financial or property"]
+RECOMMENDATIONS = ["Allow Content", "Remove Content"]
+
+REPORT_SCHEMA = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "misinformation_report",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "misinfo_type": {"type": "string", "enum": list(MISINFO_SUBTYPES)},
+                "misinfo_subtype": {"type": "string", "enum": list(dict.fromkeys(sub for subs in MISINFO_SUBTYPES.values() for sub in subs))},
+                "imminent": {"type": "string", "enum": IMMINENT_LABELS},
+                "recommendation": {"type": "string", "enum": RECOMMENDATIONS},
+                "justification": {"type": "string"},
+            },
+            "required": ["misinfo_type", "misinfo_subtype", "imminent", "recommendation", "justification"],
+            "additionalProperties": False,
+        },
+    },
+}
+
+def call_gpt(sys_instruction, content, retries=3, response_format=None):
+    for attempt in range(retries):
         try:
+            kwargs = {}
+            if response_format is not None:
+                kwargs["response_format"] = response_format
             completion = client.chat.completions.create(
                 model="gpt-4o-mini",
                 messages=[
                     {"role": "system", "content": sys_instruction},
                     {"role": "user", "content": content}
-                ]
+                ],
+                **kwargs
             )
             return completion.choices[0].message.content
         except Exception as e:
-            attempt += 1
-            print(f"Error occurred: {e}. Attempt {attempt} of {retries}. Waiting for {wait_time} seconds before retrying.")
-            time.sleep(wait_time)
-            if attempt == retries:
-                print("Max retries reached. Skipping this request.")
+            if not is_retryable(e) or attempt == retries - 1:
+                print(f"Error occurred: {e}. Skipping this request.")
                 return None
+            wait_time = backoff_delay(attempt)
+            print(f"Error occurred: {e}. Attempt {attempt + 1} of {retries}. Waiting for {wait_time:.2f} seconds before retrying.")
+            time.sleep(wait_time)
+
+# async version of call_gpt, raises LLMCallError (see LLM/transport.py) instead of returning None
+async def acall_gpt(sys_instruction, content, response_format=None):
+    return await transport.complete(sys_instruction, content, response_format=response_format)
 
 #  entry point
-def LLM_report(report_details):
+def LLM_report(report_details, single_call=None):
     """
     Populate report info as if from a user's perspective, and also make a recommendation for moderator.
+    With single_call (defaults to SINGLE_CALL_REPORTS) everything is filled out by one structured-output
+    call; if that fails or doesn't validate we fall back to the step-by-step calls.
 
     Parameters
     ----------
@@ -75,94 +155,320 @@ def LLM_report(report_details):
     # we don't need to do filter since that is only for users who want to block the author
     report_details['LLM_recommendation'] = None
 
-    misinfo_type_response = call_misinfo_type(report_details)
-    misinfo_type_response = misinfo_type_response[0]
+    if single_call is None:
+        single_call = SINGLE_CALL_REPORTS
+    if single_call:
+        structured = parse_structured_report(call_structured_report(report_details))
+        if structured is not None:
+            report_details.update(structured)
+            return report_details
+        print("Structured report output was invalid, falling back to step-by-step calls")
 
-        #================== Decision logic for Misinformation Type Response ==================
-    
-    # Political Misinfo
-    if misinfo_type_response ==  "1" :
-        report_details ['misinfo_type'] = "Political Misinformation"
+    apply_misinfo_type_response(report_details, call_misinfo_type(report_details))
 
-        # Call to classify political misinfo subtype
-        pol_misinfo_subtype_response  =  call_pol_misinfo_subtype(report_details)
-        pol_misinfo_subtype_response = pol_misinfo_subtype_response[0]
+    # Call to classify the political or health misinfo subtype
+    subtype_step = get_subtype_step(report_details)
+    if subtype_step is not None:
+        apply_subtype_response(report_details, subtype_step(report_details))
 
-        #=============== Decision logic for Political misinfo subtye response ===============
-        if pol_misinfo_subtype_response == "1":
-            report_details['misinfo_subtype'] = 'Election/Campaign Misinformation'
-        
-        elif pol_misinfo_subtype_response == "2":
-            report_details['misinfo_subtype'] = 'Government/Civic Services'
+    # Initiate userflow for Harmful content
+    apply_imminent_response(report_details, call_imminent(report_details))
+
+    """
+    Discussion : Not sure if to factor in the filter flag since this is detected automatically and  
+    not specific to a particular user's feed
+    """
         
-        elif pol_misinfo_subtype_response == "3":
-            report_details['misinfo_subtype'] = 'Manipulated Photos/Video'
+    # Initiate userflow for LLM Recommendation 
+    recommendation_response = call_recommedation(report_details)
+    report_details['LLM_recommendation'] = recommendation_response
 
-        elif pol_misinfo_subtype_response == "4":
-            report_details['misinfo_subtype'] = 'Other'
-    
-    # Health Misinfo
-    elif misinfo_type_response == "2" :
-        report_details ['misinfo_type'] = "Health Misinformation"
+    # TODO: exception for when LLM  returns invalid format or empty response!
 
-            # Call to classify health misinfo subtype
-        health_misinfo_subtype_response = call_health_misinfo_subtype(report_details)
-        health_misinfo_subtype_response = health_misinfo_subtype_response[0]
+    return report_details
 
-        #=============== Decision logic for Health misinfo subtye response ===============
-        if health_misinfo_subtype_response == "1":
-            report_details['misinfo_subtype'] = 'Vaccines'
-        
-        elif health_misinfo_subtype_response == "2":
-            report_details['misinfo_subtype'] = 'Cures and Treatments'
-            
-        elif health_misinfo_subtype_response == "3":
-            report_details['misinfo_subtype'] = 'Mental Health'
 
-        elif health_misinfo_subtype_response == "4":
-            report_details['misinfo_subtype'] = 'Oher'
+async def LLM_report_async(report_details, single_call=None):
+    """
+    Same as LLM_report, but runs the step-by-step calls as a small dependency graph so that
+    independent steps run concurrently:
 
-    
-    elif misinfo_type_response == "3" :
-        report_details ['misinfo_type'] = "Other Misinformation"
-        report_details['misinfo_subtype'] = 'Other'
+        misinfo_type -> misinfo_subtype --+
+                                          +--> recommendation
+        imminent -------------------------+
 
+    The returned report_details has the same fields as LLM_report's, plus report_details['step_timings']
+    with the seconds spent in each step and in total. LLM calls go through the async transport; if the
+    provider is unavailable, whatever was filled out so far is kept, LLM_recommendation stays None and
+    report_details['llm_status'] is set to RECOMMENDATION_PENDING. If a call failed for good (bad
+    request, auth, unknown model) it's set to LLM_FAILED instead, with the error in report_details['llm_error'].
 
-    # Initiate userflow for Harmful content
-    imminent_response = call_imminent(report_details)
-    imminent_response = imminent_response[0]
+    Results are cached by normalized message content (see LLM/result_cache.py), and concurrent calls for
+    the same content share one pipeline run. On a cache hit step_timings only has 'cache' and 'total'.
+    """
+    start = time.perf_counter()
+    computed = {}
+
+    async def compute():
+        details = await run_report_graph(dict(report_details), single_call)
+        computed['step_timings'] = details['step_timings']
+        return {field: details[field] for field in REPORT_FIELDS if field in details}
+
+    key = cache_key("report", PROMPT_VERSION, report_details['message_content'], report_details.get('classifier_label'))
+    # don't cache a report that's still missing its recommendation
+    result = await result_cache.get_or_compute(key, compute, cacheable=lambda r: r.get('llm_status') is None)
+
+    report_details.update(result)
+    if 'step_timings' in computed:
+        report_details['step_timings'] = computed['step_timings']
+    else:
+        report_details['step_timings'] = {'cache': round(time.perf_counter() - start, 3), 'total': round(time.perf_counter() - start, 3)}
+    return report_details
 
-    #================== Decision logic for Imminent Harm Response ==================
 
-    if imminent_response == "1":
-        report_details['imminent'] = "Non-imminent"
+# for when a report is missing a recommendation, cached like LLM_report_async
+async def LLM_recommendation_async(report_details):
+    async def compute():
+        return {'LLM_recommendation': await call_recommendation_separate(report_details, gpt=acall_gpt)}
 
-    elif imminent_response == "2":
-        report_details['imminent'] = 'physical'
+    key = cache_key("recommendation", PROMPT_VERSION, report_details['message_content'], report_details['report_type'],
+                    report_details['misinfo_type'], report_details['misinfo_subtype'], report_details['imminent'])
+    result = await result_cache.get_or_compute(key, compute, cacheable=lambda r: r['LLM_recommendation'] is not None)
+    return result['LLM_recommendation']
 
-    elif imminent_response == "3":
-        report_details['imminent'] = 'mental'
-    
-    elif imminent_response == "4":
-        report_details['imminent'] = 'financial or property'
 
+async def run_report_graph(report_details, single_call=None):
+    report_details['report_type'] = None
+    report_details['misinfo_type'] = None
+    report_details['misinfo_subtype'] = None
+    report_details['imminent'] = None
+    report_details['LLM_recommendation'] = None
+
+    timings = {}
+    start = time.perf_counter()
+
+    if single_call is None:
+        single_call = SINGLE_CALL_REPORTS
+    if single_call:
+        try:
+            structured = parse_structured_report(await timed_step(timings, 'structured_report', call_structured_report, report_details))
+        except LLMUnavailableError as e:
+            return recommendation_pending(report_details, timings, start, e)
+        except LLMCallError as e:
+            # e.g. the model or endpoint doesn't support structured outputs
+            print(e)
+            structured = None
+        if structured is not None:
+            report_details.update(structured)
+            timings['total'] = round(time.perf_counter() - start, 3)
+            report_details['step_timings'] = timings
+            return report_details
+        print("Structured report output was invalid, falling back to step-by-step calls")
+
+    async def misinfo_type():
+        apply_misinfo_type_response(report_details, await timed_step(timings, 'misinfo_type', call_misinfo_type, report_details))
+
+    async def misinfo_subtype(_):
+        subtype_step = get_subtype_step(report_details)
+        if subtype_step is not None:
+            apply_subtype_response(report_details, await timed_step(timings, 'misinfo_subtype', subtype_step, report_details))
+
+    async def imminent():
+        # only needs the message content. the answer is applied once the subtype step is done,
+        # so every prompt sees report_details exactly as it would in LLM_report
+        return await timed_step(timings, 'imminent', call_imminent, report_details)
+
+    async def recommendation(_, imminent_response):
+        apply_imminent_response(report_details, imminent_response)
+        report_details['LLM_recommendation'] = await timed_step(timings, 'recommendation', call_recommedation, report_details)
+
+    try:
+        await run_step_graph({
+            'misinfo_type': ([], misinfo_type),
+            'misinfo_subtype': (['misinfo_type'], misinfo_subtype),
+            'imminent': ([], imminent),
+            'recommendation': (['misinfo_subtype', 'imminent'], recommendation),
+        })
+    except LLMUnavailableError as e:
+        return recommendation_pending(report_details, timings, start, e)
+    except LLMCallError as e:
+        return llm_failed(report_details, timings, start, e)
+
+    timings['total'] = round(time.perf_counter() - start, 3)
+    report_details['step_timings'] = timings
+    return report_details
+
+
+async def run_step_graph(steps):
     """
-    Discussion : Not sure if to factor in the filter flag since this is detected automatically and  
-    not specific to a particular user's feed
+    steps maps a step name to (names of the steps it depends on, coroutine function). Each step
+    starts as soon as its dependencies are done and is called with their results, in order.
+    Returns a dict of each step's result.
     """
-        
-    # Initiate userflow for LLM Recommendation 
-    recommendation_response = call_recommedation(report_details)
-    report_details['LLM_recommendation'] = recommendation_response
+    tasks = {}
+
+    def start(name):
+        if name not in tasks:
+            deps, step = steps[name]
+            dep_tasks = [start(dep) for dep in deps]
+
+            async def run():
+                if dep_tasks:
+                    await asyncio.gather(*dep_tasks)
+                return await step(*[t.result() for t in dep_tasks])
+
+            tasks[name] = asyncio.ensure_future(run())
+        return tasks[name]
+
+    for name in steps:
+        start(name)
+    try:
+        await asyncio.gather(*tasks.values())
+    except BaseException:
+        for task in tasks.values():
+            task.cancel()
+        raise
+    return {name: task.result() for name, task in tasks.items()}
+
+
+async def timed_step(timings, name, step, report_details):
+    start = time.perf_counter()
+    try:
+        # also a span, so it shows up in `report perf` and the trace export next to the bot's stages
+        with tracer.span("llm." + name):
+            return await step(report_details, gpt=acall_gpt)
+    finally:
+        timings[name] = round(time.perf_counter() - start, 3)
+
+
+def recommendation_pending(report_details, timings, start, error):
+    print(f"LLM unavailable, report will have no recommendation for now: {error}")
+    return without_recommendation(report_details, timings, start, RECOMMENDATION_PENDING)
+
+def llm_failed(report_details, timings, start, error):
+    # not an outage, so it won't go away by itself: most likely the model name, the API key or a prompt
+    print(f"LLM call failed and retrying won't help, check the LLM configuration: {error}")
+    report_details['llm_error'] = str(error)
+    return without_recommendation(report_details, timings, start, LLM_FAILED)
+
+def without_recommendation(report_details, timings, start, status):
+    report_details['LLM_recommendation'] = None
+    report_details['llm_status'] = status
+    timings['total'] = round(time.perf_counter() - start, 3)
+    report_details['step_timings'] = timings
+    return report_details
 
-    # TODO: exception for when LLM  returns invalid format or empty response!
 
-    return report_details
+#================== Decision logic for each step's response ==================
+
+MISINFO_TYPE_ANSWERS = {"1": "Political Misinformation", "2": "Health Misinformation", "3": "Other Misinformation"}
+POL_SUBTYPE_ANSWERS = {"1": 'Election/Campaign Misinformation', "2": 'Government/Civic Services', "3": 'Manipulated Photos/Video', "4": 'Other'}
+HEALTH_SUBTYPE_ANSWERS = {"1": 'Vaccines', "2": 'Cures and Treatments', "3": 'Mental Health', "4": 'Other'}
+IMMINENT_ANSWERS = {"1": "Non-imminent", "2": 'physical', "3": 'mental', "4": 'financial or property'}
+
+# the answer is the reply's first character. a refusal or a filtered reply can come back empty or
+# None, which leaves the field as it was instead of raising out of auto_review
+
+def apply_misinfo_type_response(report_details, response):
+    misinfo_type = MISINFO_TYPE_ANSWERS.get((response or "")[:1])
+    if misinfo_type is not None:
+        report_details['misinfo_type'] = misinfo_type
+    if misinfo_type == "Other Misinformation":
+        report_details['misinfo_subtype'] = 'Other'
+
+def get_subtype_step(report_details):
+    if report_details['misinfo_type'] == "Political Misinformation":
+        return call_pol_misinfo_subtype
+    if report_details['misinfo_type'] == "Health Misinformation":
+        return call_health_misinfo_subtype
+    return None
+
+def apply_subtype_response(report_details, response):
+    if report_details['misinfo_type'] == "Political Misinformation":
+        answers = POL_SUBTYPE_ANSWERS
+    else:
+        answers = HEALTH_SUBTYPE_ANSWERS
+    subtype = answers.get((response or "")[:1])
+    if subtype is not None:
+        report_details['misinfo_subtype'] = subtype
+
+def apply_imminent_response(report_details, response):
+    imminent = IMMINENT_ANSWERS.get((response or "")[:1])
+    if imminent is not None:
+        report_details['imminent'] = imminent
+
+
+# single call that fills out the whole report (steps 2-5 below) at once
+def call_structured_report(report_details, gpt=None):
+    print("====Steps 2-5: Structured report===")
+
+    system_instruction = f"""
+    You are a misinformation trust & safety expert content moderator for a social media platform. You have been assigned to analyze content
+    flagged as misinformation, fill out a report about it, and assist a human moderator in making a decision about it. Here is the policy you should follow:
+
+{MODERATION_POLICY}
+                         """
+
+    content = f"""
+    Message Content: {report_details['message_content']}
+    Classification : {report_details['classifier_label']}
+    Confidence Score : {report_details['confidence_score']}
+
+    Fill out the report:
+    - misinfo_type: the type of misinformation (Political, Health or Other Misinformation).
+    - misinfo_subtype: for Political Misinformation one of Election/Campaign Misinformation, Government/Civic Services,
+      Manipulated Photos/Video, Other. For Health Misinformation one of Vaccines, Cures and Treatments, Mental Health, Other.
+      For Other Misinformation, Other.
+    - imminent: could this content likely cause imminent harm to people or public safety? Non-imminent if not,
+      otherwise physical, mental, or financial or property harm.
+    - recommendation: Allow Content if it is not harmful or inappropriate and should remain on the platform (you believe
+      the classifier's decision is incorrect), or Remove Content if it should not be allowed to remain on the platform.
+    - justification: in less than 80 words, justify your recommendation. Adhere strictly to the word limit of 80.
+              """
+
+    return (gpt or call_gpt)(system_instruction, content, response_format=REPORT_SCHEMA)
+
+
+def parse_structured_report(response):
+    """
+    Validates the structured report output. Returns the report_details fields it fills out, or None
+    if the output is missing, isn't JSON, or has values outside the report flow's options.
+    """
+    if not response:
+        return None
+    try:
+        output = json.loads(response)
+    except ValueError:
+        return None
+    if not isinstance(output, dict):
+        return None
+
+    misinfo_type = output.get('misinfo_type')
+    misinfo_subtype = output.get('misinfo_subtype')
+    imminent = output.get('imminent')
+    recommendation = output.get('recommendation')
+    justification = output.get('justification')
+
+    if misinfo_type not in MISINFO_SUBTYPES or misinfo_subtype not in MISINFO_SUBTYPES[misinfo_type]:
+        return None
+    if imminent not in IMMINENT_LABELS or recommendation not in RECOMMENDATIONS:
+        return None
+    if not isinstance(justification, str) or not justification.strip():
+        return None
+
+    return {
+        'misinfo_type': misinfo_type,
+        'misinfo_subtype': misinfo_subtype,
+        'imminent': imminent,
+        # same shape as the free-text answer from call_recommedation
+        'LLM_recommendation': f"{recommendation}. {justification.strip()}",
+    }
 
 
 # functions below except LLM_recommendation are emulating the user report
+# each takes the gpt function to use: call_gpt by default, or acall_gpt to get back a coroutine
 
-def call_misinfo_type (report_details):
+def call_misinfo_type(report_details, gpt=None):
     # Step 2: Type of Misinformation
     print("====Step 2: Misinformation type ===")
     
@@ -181,10 +487,10 @@ def call_misinfo_type (report_details):
     Respond with ONLY the number (1-3).
                 """
     
-    return call_gpt(system_instruction, content)
+    return (gpt or call_gpt)(system_instruction, content)
 
 
-def call_pol_misinfo_subtype(report_details):
+def call_pol_misinfo_subtype(report_details, gpt=None):
     # Step 3a. Type of Political Misinformation
     print("====Step 3a. Type of Political Misinformation ===")
 
@@ -204,10 +510,10 @@ def call_pol_misinfo_subtype(report_details):
     Respond with ONLY the number (1-4).
               """
 
-    return call_gpt(system_instruction, content)
+    return (gpt or call_gpt)(system_instruction, content)
 
 
-def call_health_misinfo_subtype(report_details):
+def call_health_misinfo_subtype(report_details, gpt=None):
     # Step 3b. Type of Health Misinformation
     print("====Step 3b. Type of Health Misinformation ===")
 
@@ -227,10 +533,10 @@ def call_health_misinfo_subtype(report_details):
     Respond with ONLY the number (1-4).
                """
     
-    return call_gpt(system_instruction,content)
+    return (gpt or call_gpt)(system_instruction,content)
 
 
-def call_imminent(report_details):
+def call_imminent(report_details, gpt=None):
     # Step 4: Imminent Harm 
     print("====Step 4: Imminent Harm===")
 
@@ -250,11 +556,11 @@ def call_imminent(report_details):
     Respond with ONLY the number (1-4).
               """
     
-    return call_gpt(system_instruction, content)
+    return (gpt or call_gpt)(system_instruction, content)
 
 
 # this function is from the moderator POV, where the LLM now sees the whole report and recommends an action
-def call_recommedation(report_details):
+def call_recommedation(report_details, gpt=None):
     # Step 5: Recommendation
     print("====Step 5: Recommendation===")
 
@@ -262,15 +568,7 @@ def call_recommedation(report_details):
     You are a trust & safety expert content moderator for a social media platform. You have been assigned to assist a human moderator in making a decision
     about reported content. Here is the policy you should follow:
     
-    Defining political misinformation is contentious, fraught with conflicting values and subjective interpretations, and a constantly evolving task. We do not expect, nor do we want, to eliminate all such misinformation from our platform. We want our approach to balance our values of free expression, safety, and authenticity. We define a few categories of misinformation that will be removed, and outline where there is room for human moderators to evaluate content case-by-case in the best interests of our users and our values.
-
-    Physical harm. We will remove political misinformation that poses imminent risk of death, serious injury, or other physical harm. This includes content that an authoritative third party expert has determined is false or unverifiable claims for which there are no authoritative third parties. This includes, for example, real footage of violence or human rights violations from past events that are misattributed to different events or groups. We will also prioritize removal of misinformation that poses imminent risk of serious mental distress or financial harm.
-
-    Census/election interference. We will remove misleading or deceptive content about dates, locations, times, eligibility, and other essential public information regarding census and election operations. This includes, for example, unverified claims that immigration enforcement is at a voting location, or unverified claims about widespread voter fraud.
-
-    Health misinformation. Healthcare and medicine have become increasingly politicized. We will remove health misinformation when public health authorities conclude it is false, especially during public health emergencies. This includes vaccine misinformation and promotion of unsupported cures and treatments.
-
-    Other common considerations. For violative misinformation presented in educational and artistic settings, if there is additional context, we will evaluate on a case-by-case basis. We believe that satire and counterspeech are vital to productive dialogue. Misinformation occurs frequently in conjunction with other abuses such as fraud and coordinated inauthentic behavior. We reserve the right to take coordinated action, including removal, across accounts and content when appropriate.
+{MODERATION_POLICY}
 
     Here is the information you have about the report:
                          """
@@ -294,10 +592,10 @@ def call_recommedation(report_details):
         justify your recommendation. Adhere strictly to the word limit of 80. 
               """
 
-    return call_gpt(system_instruction,content)
+    return (gpt or call_gpt)(system_instruction,content)
 
 # for when a report is missing a recommendation
-def call_recommendation_separate(report_details):
+def call_recommendation_separate(report_details, gpt=None):
     # Step 5: Recommendation
     print("====Step 5: Recommendation===")
 
@@ -305,15 +603,7 @@ def call_recommendation_separate(report_details):
     You are a trust & safety expert content moderator for a social media platform. You have been assigned to assist a human moderator in making a decision
     about reported content. Here is the policy you should follow:
     
-    Defining political misinformation is contentious, fraught with conflicting values and subjective interpretations, and a constantly evolving task. We do not expect, nor do we want, to eliminate all such misinformation from our platform. We want our approach to balance our values of free expression, safety, and authenticity. We define a few categories of misinformation that will be removed, and outline where there is room for human moderators to evaluate content case-by-case in the best interests of our users and our values.
-
-    Physical harm. We will remove political misinformation that poses imminent risk of death, serious injury, or other physical harm. This includes content that an authoritative third party expert has determined is false or unverifiable claims for which there are no authoritative third parties. This includes, for example, real footage of violence or human rights violations from past events that are misattributed to different events or groups. We will also prioritize removal of misinformation that poses imminent risk of serious mental distress or financial harm.
-
-    Census/election interference. We will remove misleading or deceptive content about dates, locations, times, eligibility, and other essential public information regarding census and election operations. This includes, for example, unverified claims that immigration enforcement is at a voting location, or unverified claims about widespread voter fraud.
-
-    Health misinformation. Healthcare and medicine have become increasingly politicized. We will remove health misinformation when public health authorities conclude it is false, especially during public health emergencies. This includes vaccine misinformation and promotion of unsupported cures and treatments.
-
-    Other common considerations. For violative misinformation presented in educational and artistic settings, if there is additional context, we will evaluate on a case-by-case basis. We believe that satire and counterspeech are vital to productive dialogue. Misinformation occurs frequently in conjunction with other abuses such as fraud and coordinated inauthentic behavior. We reserve the right to take coordinated action, including removal, across accounts and content when appropriate.
+{MODERATION_POLICY}
 
     Here is the information you have about the report:
                          """
@@ -335,7 +625,7 @@ def call_recommendation_separate(report_details):
         justify your recommendation. Adhere strictly to the word limit of 80. 
               """
 
-    return call_gpt(system_instruction,content)
+    return (gpt or call_gpt)(system_instruction,content)
 
 
 
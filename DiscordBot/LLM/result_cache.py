@@ -0,0 +1,176 @@
+"""
+This file implements a content-addressed cache for LLM results, so the same (viral) message
+only goes through the LLM pipeline once. It has an in-memory LRU tier in front of a SQLite
+tier that survives restarts, both with TTL and size-based eviction, and it deduplicates
+concurrent requests for the same key (single-flight).
+"""
+import asyncio
+import hashlib
+import json
+import sqlite3
+import time
+import unicodedata
+from collections import OrderedDict
+
+
+def normalize_content(text):
+    # copies of the same message often differ only in case, spacing or unicode look-alikes
+    text = unicodedata.normalize("NFKC", text or "")
+    return " ".join(text.lower().split())
+
+def cache_key(kind, prompt_version, content, *extra):
+    '''
+    kind says which LLM result this is (e.g. "report"), prompt_version invalidates old entries
+    whenever the prompts change, and extra holds any other inputs the result depends on.
+    '''
+    parts = [kind, str(prompt_version), normalize_content(content)] + [str(x) for x in extra]
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+
+class LLMResultCache:
+    def __init__(self, path=None, max_memory_entries=2048, max_disk_entries=100000, ttl=7 * 24 * 3600):
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+        self.ttl = ttl
+        self.memory = OrderedDict() # key -> (stored_at, value), least recently used first
+        self.inflight = {}
+        self.puts_since_prune = 0
+        # key -> last time it was read. written to the db with the next put or prune instead of on
+        # every hit, so a hit never waits for a commit (an fsync) on the event loop
+        self.last_used = {}
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+        # these are single-row lookups on a local file, cheap enough to do on the event loop
+        self.db = None
+        if path:
+            self.db = sqlite3.connect(path)
+            self.db.execute("CREATE TABLE IF NOT EXISTS llm_cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, stored_at REAL NOT NULL, last_used REAL NOT NULL)")
+            self.db.execute("CREATE INDEX IF NOT EXISTS llm_cache_last_used ON llm_cache (last_used)")
+            self.db.commit()
+            self.prune()
+
+    def get(self, key, count_miss=True):
+        now = time.time()
+        entry = self.memory.get(key)
+        if entry is not None:
+            stored_at, value = entry
+            if now - stored_at < self.ttl:
+                self.memory.move_to_end(key)
+                self.memory_hits += 1
+                self.last_used[key] = now
+                return dict(value)
+            del self.memory[key]
+
+        if self.db is not None:
+            row = self.db.execute("SELECT value, stored_at FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if row is not None and now - row[1] < self.ttl:
+                self.last_used[key] = now
+                value = json.loads(row[0])
+                self._remember(key, row[1], value)
+                self.disk_hits += 1
+                return dict(value)
+
+        if count_miss:
+            self.misses += 1
+        return None
+
+    def put(self, key, value):
+        now = time.time()
+        self._remember(key, now, dict(value))
+        if self.db is not None:
+            self.last_used.pop(key, None)
+            self._write_last_used()
+            self.db.execute("INSERT OR REPLACE INTO llm_cache (key, value, stored_at, last_used) VALUES (?, ?, ?, ?)", (key, json.dumps(value), now, now))
+            self.db.commit()
+            self.puts_since_prune += 1
+            if self.puts_since_prune >= 100:
+                self.prune()
+
+    def _remember(self, key, stored_at, value):
+        self.memory[key] = (stored_at, value)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_memory_entries:
+            self.memory.popitem(last=False)
+            self.evictions += 1
+
+    def _write_last_used(self):
+        # part of the caller's transaction, committed with it
+        if self.last_used:
+            self.db.executemany("UPDATE llm_cache SET last_used = ? WHERE key = ?", [(t, k) for k, t in self.last_used.items()])
+            self.last_used = {}
+
+    def prune(self):
+        # drop expired rows, then the least recently used ones past the size limit
+        self.puts_since_prune = 0
+        if self.db is None:
+            self.last_used = {}
+            return
+        self._write_last_used()
+        cursor = self.db.execute("DELETE FROM llm_cache WHERE stored_at < ?", (time.time() - self.ttl,))
+        self.evictions += cursor.rowcount
+        cursor = self.db.execute(
+            "DELETE FROM llm_cache WHERE key IN (SELECT key FROM llm_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+            (self.max_disk_entries,))
+        self.evictions += cursor.rowcount
+        self.db.commit()
+
+    async def get_or_compute(self, key, compute, cacheable=None):
+        '''
+        Returns the cached value for key, or awaits compute() to make it. Concurrent calls for the
+        same key share one compute(). The value is only stored if cacheable(value) is true.
+        '''
+        # requests that join an in-flight computation are counted as coalesced, not as misses
+        value = self.get(key, count_miss=key not in self.inflight)
+        if value is not None:
+            return value
+
+        if key in self.inflight:
+            self.coalesced += 1
+            return dict(await asyncio.shield(self.inflight[key]))
+
+        future = asyncio.get_running_loop().create_future()
+        self.inflight[key] = future
+        try:
+            value = await compute()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception() # mark it retrieved in case nobody else was waiting
+            raise
+        finally:
+            del self.inflight[key]
+
+        if cacheable is None or cacheable(value):
+            self.put(key, value)
+        future.set_result(value)
+        return dict(value)
+
+    def stats(self):
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        disk_entries = 0
+        if self.db is not None:
+            disk_entries = self.db.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.memory_hits + self.disk_hits) / lookups, 3) if lookups else 0.0,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "memory_entries": len(self.memory),
+            "disk_entries": disk_entries,
+        }
+
+    def summary(self):
+        out = "```"
+        for name, value in self.stats().items():
+            out += f"{name:<15} | {value}\n"
+        out += "```"
+        return out
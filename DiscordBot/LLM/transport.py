@@ -0,0 +1,146 @@
+"""
+This file implements the async transport we use to talk to the LLM: retries with exponential
+backoff and jitter for errors that are worth retrying, and a circuit breaker that fails fast
+while the provider is unhealthy instead of stalling every report behind it.
+"""
+import asyncio
+import random
+import time
+import openai
+
+
+class LLMCallError(Exception):
+    # the call failed and retrying won't help (bad request, auth, ...)
+    pass
+
+class LLMUnavailableError(LLMCallError):
+    # the provider kept failing with retryable errors
+    pass
+
+class CircuitOpenError(LLMUnavailableError):
+    # we didn't even try, the provider has been failing recently
+    pass
+
+
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+def is_retryable(error):
+    '''
+    429s, 5xx, timeouts and connection errors are retryable; anything else (400, 401, 403, 404, ...) is fatal.
+    '''
+    if isinstance(error, (openai.APITimeoutError, openai.APIConnectionError, asyncio.TimeoutError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code in RETRYABLE_STATUS_CODES or error.status_code >= 500
+    return False
+
+def backoff_delay(attempt, base_delay=0.5, max_delay=8.0):
+    # "full jitter": a random delay up to the exponential backoff for this attempt
+    return random.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
+
+def retry_after(error):
+    # honour the provider's Retry-After header on 429/503 if it sends one
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    try:
+        return float(response.headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class CircuitBreaker:
+    '''
+    closed: calls go through. After `failure_threshold` consecutive failures it opens.
+    open: calls fail fast with CircuitOpenError for `reset_timeout` seconds.
+    half-open: after that, one trial call goes through. Success closes the breaker, failure opens it again.
+    '''
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trial_in_flight = False
+
+    def allow(self):
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self.state = self.HALF_OPEN
+            self.trial_in_flight = False
+        if self.state == self.HALF_OPEN and not self.trial_in_flight:
+            self.trial_in_flight = True
+            return True
+        return False
+
+    def record_success(self):
+        self.state = self.CLOSED
+        self.failures = 0
+        self.trial_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+        self.trial_in_flight = False
+
+    def is_healthy(self):
+        return self.state == self.CLOSED
+
+
+class AsyncLLMTransport:
+    def __init__(self, client=None, model="gpt-4o-mini", max_attempts=4, base_delay=0.5, max_delay=8.0, timeout=30.0, breaker=None):
+        # the SDK's own retries are turned off, we do them here. the client picks up
+        # OPENAI_BASE_URL, so this can be pointed at a local fake OpenAI-compatible server
+        self.client = client or openai.AsyncOpenAI(max_retries=0)
+        self.model = model
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.timeout = timeout
+        self.breaker = breaker or CircuitBreaker()
+
+    async def complete(self, sys_instruction, content, response_format=None):
+        '''
+        Returns the completion text. Raises CircuitOpenError without calling the provider while
+        the breaker is open, LLMUnavailableError when retries run out and LLMCallError on fatal errors.
+        '''
+        kwargs = {}
+        if response_format is not None:
+            kwargs["response_format"] = response_format
+
+        for attempt in range(self.max_attempts):
+            if not self.breaker.allow():
+                raise CircuitOpenError("LLM provider is unhealthy, not calling it for now")
+            try:
+                completion = await self.client.chat.completions.create(
+                    model=self.model,
+                    messages=[
+                        {"role": "system", "content": sys_instruction},
+                        {"role": "user", "content": content}
+                    ],
+                    timeout=self.timeout,
+                    **kwargs
+                )
+            except Exception as e:
+                if not is_retryable(e):
+                    # our fault, not the provider's, so it doesn't count against the breaker
+                    self.breaker.trial_in_flight = False
+                    raise LLMCallError(f"LLM call failed: {e}") from e
+                self.breaker.record_failure()
+                if attempt == self.max_attempts - 1:
+                    raise LLMUnavailableError(f"LLM call failed after {self.max_attempts} attempts: {e}") from e
+                delay = retry_after(e)
+                if delay is None:
+                    delay = backoff_delay(attempt, self.base_delay, self.max_delay)
+                print(f"LLM error: {e}. Attempt {attempt + 1} of {self.max_attempts}, retrying in {delay:.2f}s.")
+                await asyncio.sleep(min(delay, self.max_delay))
+                continue
+            self.breaker.record_success()
+            return completion.choices[0].message.content
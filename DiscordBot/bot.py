@@ -8,29 +8,26 @@ import os
 import json
 import logging
 import re
-import requests
-from google.oauth2 import service_account
-from google.auth.transport.requests import Request
+from google.auth.exceptions import GoogleAuthError
 from enum import Enum
 from report import Report, get_priority_static
 from report_queue import SubmittedReport, PriorityReportQueue
 import pdb
 from moderate import ModeratorReview
+from classifier_client import ClassifierClient, ClassificationCoalescer, ClassifierError
+from token_provider import IDTokenProvider
+from near_duplicate import NearDuplicateIndex
+from prescreen import PreScreen
+from tracing import tracer
 from LLM import LLM_reports as llm
 
-logger = logging.getLogger('discord')
-logger.setLevel(logging.DEBUG)
-handler = logging.FileHandler(filename='discord.log', encoding='utf-8', mode='w')
-handler.setFormatter(logging.Formatter('%(asctime)s:%(levelname)s:%(name)s: %(message)s'))
-logger.addHandler(handler)
-
-token_path = 'tokens.json'
-if not os.path.isfile(token_path):
-    raise Exception(f"{token_path} not found!")
-with open(token_path) as f:
-    # If you get an error here, it means your token is formatted incorrectly. Did you put it in quotes?
-    tokens = json.load(f)
-    discord_token = tokens['discord']
+def load_discord_token(token_path='tokens.json'):
+    if not os.path.isfile(token_path):
+        raise Exception(f"{token_path} not found!")
+    with open(token_path) as f:
+        # If you get an error here, it means your token is formatted incorrectly. Did you put it in quotes?
+        tokens = json.load(f)
+    return tokens['discord']
 
 
 MOD_TODO_START = "---------------------------\nTODO"
@@ -39,11 +36,24 @@ MODERATE_KEYWORD = "moderate"
 NUM_QUEUE_LEVELS = 3
 
 CLASSIFIER_URL = "https://discord-classifier-432480940956.us-central1.run.app/classify"
+CLASSIFIER_BATCH_URL = "https://discord-classifier-432480940956.us-central1.run.app/classify_batch"
 GCP_SERVICE_ACCOUNT_TOKEN_FILE = "gcp_key.json" # key that allows our discord bot to run the classifier
-credentials = service_account.IDTokenCredentials.from_service_account_file(
-    GCP_SERVICE_ACCOUNT_TOKEN_FILE,
-    target_audience=CLASSIFIER_URL
-)
+CLASSIFIER_MAX_CONCURRENCY = 16 # max classifier requests in flight at once, the rest wait their turn
+CLASSIFIER_TIMEOUT = 10 # seconds, per request
+CLASSIFIER_BATCH_WINDOW = 0.05 # seconds, messages arriving within this window share one /classify_batch call
+CLASSIFIER_BATCH_MAX_SIZE = 32
+
+# local pre-screen, messages it's confident are benign never reach the classifier (retrain with train_prescreen.py)
+PRESCREEN_MODEL_PATH = "prescreen_model.json"
+
+# near-duplicates of a recently classified message reuse its verdict (and report) instead of being classified again
+NEAR_DUPLICATE_THRESHOLD = 0.7 # estimated Jaccard similarity of the messages' character shingles
+NEAR_DUPLICATE_TTL = 6 * 3600 # seconds
+NEAR_DUPLICATE_MAX_ENTRIES = 10000
+
+# every auto-review stage is timed (see tracing.py, `report perf` in the mod channel). set this to also
+# append each span to a JSONL file for offline analysis, e.g. "traces.jsonl"
+TRACE_EXPORT_PATH = None
 
 class ConversationState(Enum):
     NOFLOW = 0
@@ -53,7 +63,12 @@ class ConversationState(Enum):
 
 class ModBot(discord.Client):
     # INITIALIZATION STAGE
-    def __init__(self): 
+    def __init__(self, classifier_url=CLASSIFIER_URL, classifier_batch_url=CLASSIFIER_BATCH_URL, classifier_headers=None):
+        '''
+        classifier_headers is a coroutine function returning the headers for classifier requests. By default
+        it's the Cloud Run ID token from GCP_SERVICE_ACCOUNT_TOKEN_FILE; harness.py points the bot at local
+        stand-ins instead.
+        '''
         intents = discord.Intents.default()
         intents.message_content = True
         super().__init__(command_prefix='.', intents=intents)
@@ -65,6 +80,31 @@ class ModBot(discord.Client):
         # should equal the number of distinct priorities defined in Report.get_priority
         self.report_queue = PriorityReportQueue(NUM_QUEUE_LEVELS, ["Imminent physical/mental harm", "Imminent financial/property harm", "Non-imminent"])
         self.conversationState = 0
+        if classifier_headers is None:
+            # caches the ID token and only refreshes it shortly before it expires
+            self.token_provider = IDTokenProvider.from_service_account_file(GCP_SERVICE_ACCOUNT_TOKEN_FILE, target_audience=classifier_url)
+            classifier_headers = self.token_provider.auth_headers
+
+        async def traced_headers():
+            # mostly the cached ID token, this shows when it has to wait for a refresh
+            with tracer.span("classifier_auth"):
+                return await classifier_headers()
+
+        def record_classifier_batch(batch_size, seconds, error):
+            tracer.record("classifier_http", seconds, batch_size=batch_size, **({"error": type(error).__name__} if error else {}))
+
+        if TRACE_EXPORT_PATH:
+            tracer.export_to(TRACE_EXPORT_PATH)
+        self.classifier = ClassifierClient(classifier_url, batch_url=classifier_batch_url, max_concurrency=CLASSIFIER_MAX_CONCURRENCY, timeout=CLASSIFIER_TIMEOUT)
+        self.prescreen = PreScreen(PRESCREEN_MODEL_PATH)
+        self.near_duplicates = NearDuplicateIndex(threshold=NEAR_DUPLICATE_THRESHOLD, max_entries=NEAR_DUPLICATE_MAX_ENTRIES, ttl=NEAR_DUPLICATE_TTL)
+        self.classifier_batcher = ClassificationCoalescer(self.classifier, traced_headers, window=CLASSIFIER_BATCH_WINDOW, max_batch_size=CLASSIFIER_BATCH_MAX_SIZE, on_batch=record_classifier_batch)
+
+    async def close(self):
+        await self.classifier_batcher.close()
+        await self.classifier.close()
+        tracer.close()
+        await super().close()
 
     async def on_ready(self):
         print(f'{self.user.name} has connected to Discord! It is these guilds:')
@@ -257,7 +297,16 @@ class ModBot(discord.Client):
                     'misinfo_subtype': next_report.subtype,
                     'imminent': next_report.imminent,
                 }
-                review.llm_recommendation = llm.call_recommendation_separate(report_details)
+                try:
+                    with tracer.trace(report_id=next_report.id), tracer.span("llm_recommendation"):
+                        review.llm_recommendation = await llm.LLM_recommendation_async(report_details)
+                except llm.LLMUnavailableError as e:
+                    # the report stays without one, so the next moderator to pick it up tries again
+                    print(e)
+                    review.llm_recommendation = llm.RECOMMENDATION_PENDING + " (the LLM provider is unavailable right now)"
+                except llm.LLMCallError as e:
+                    print(e)
+                    review.llm_recommendation = llm.LLM_FAILED + f" ({e}), check the bot's LLM configuration"
             self.moderations[author_id] = review
             preview = self.report_queue.display_one(next_report, showContent=False)
             if preview:
@@ -272,6 +321,7 @@ class ModBot(discord.Client):
         if review.is_review_complete():
 
             if self.moderations[author_id].action_taken in ["Allowed", "Removed"]:
+                review.original_report.verdict = self.moderations[author_id].action_taken
                 # Put the verdict in the mod channel
                 mod_channel = self.mod_channels[self.moderations[author_id].message_guild_id]
                 # todo are we worried about code injection via author name or content? 
@@ -281,6 +331,9 @@ class ModBot(discord.Client):
                 await mod_channel.send(mod_info_msg)
                 if self.moderations[author_id].action_taken == "Removed":
                     await review.reported_message.add_reaction("❌")
+                    # near-duplicates that were linked to this report get the same verdict
+                    for linked_message in review.original_report.linked_messages:
+                        await linked_message.add_reaction("❌")
 
             elif self.moderations[author_id].action_taken in ["Skipped", "Escalated"]:
                 original_report = self.moderations[author_id].original_report
@@ -300,7 +353,8 @@ class ModBot(discord.Client):
             await self.handle_mod_tools(message)
 
         else:
-            await self.auto_review(message) # classifies and then sends to llm for mod
+            with tracer.trace(message_id=message.id), tracer.span("auto_review"):
+                await self.auto_review(message) # classifies and then sends to llm for mod
     
     # mod channel messages: tools for moderators 
     async def handle_mod_tools(self, message):
@@ -311,13 +365,53 @@ class ModBot(discord.Client):
                 await message.channel.send(self.report_queue.display(showContent=True))
             else:
                 await message.channel.send(self.report_queue.display())
+        elif message.content == "report prescreen":
+            await message.channel.send(self.prescreen.summary())
+        elif message.content == "report cache":
+            await message.channel.send(llm.result_cache.summary())
+        elif message.content == "report perf":
+            await message.channel.send(tracer.summary())
         return
 
     # user channel messages: auto-review / flagging process
     async def auto_review(self, message):
         # ----- teddy: for milestone 3, we send every msg to classifier/llm -----------------------
         mod_channel = self.mod_channels[message.guild.id]
-        classification, confidence = await self.classify_msg(message, mod_channel)
+
+        # "lol", emoji, bot commands, bare links, ... don't need the classifier
+        with tracer.span("prescreen"):
+            skip = self.prescreen.should_skip(message.content)
+        if skip:
+            return
+
+        # lightly mutated copy of something we've already seen: reuse that verdict
+        with tracer.span("near_duplicate"):
+            duplicate_of = self.near_duplicates.find(message.content)
+        matched_report = duplicate_of.report if duplicate_of is not None else None
+        if matched_report is not None:
+            tracer.annotate(report_id=matched_report.id)
+        if duplicate_of is not None and matched_report is None:
+            print("message is a near-duplicate of an already classified message, classification: ", duplicate_of.classification)
+            return
+        if matched_report is not None and matched_report.verdict is None:
+            # still queued or being reviewed: the moderator's verdict covers this copy too
+            matched_report.linked_messages.append(message)
+            with tracer.span("mod_channel_send"):
+                await mod_channel.send("[Auto-Mod] user " + str(message.author.id) + "'s message is a near-duplicate of Report ID: " + str(matched_report.id) + ", linked it to that report.")
+            return
+        if matched_report is not None and matched_report.verdict == "Removed":
+            # already moderated, so apply that verdict now instead of waiting for one that already happened
+            await message.add_reaction("❌")
+            with tracer.span("mod_channel_send"):
+                await mod_channel.send("[Auto-Mod] user " + str(message.author.id) + "'s message is a near-duplicate of Report ID: " + str(matched_report.id) + ", which was already removed. Removed it too.")
+            return
+
+        if matched_report is not None:
+            # the original was allowed. this copy still gets its own report (same classifier verdict),
+            # a moderator should see it rather than it being waved through on someone else's decision
+            classification, confidence = duplicate_of.classification, duplicate_of.confidence
+        else:
+            classification, confidence = await self.classify_msg(message, mod_channel)
         if classification == -1 or confidence == -1:
             return # nothing happens on error
         
@@ -338,12 +432,15 @@ class ModBot(discord.Client):
                 # 'imminent' : str,
                 # 'LLM_recommendation' : str
             }
-            report_details = llm.LLM_report(report_details) # report function is in LLM/ module
+            # report function is in LLM/ module, the async version runs independent LLM steps concurrently
+            with tracer.span("llm_report"):
+                report_details = await llm.LLM_report_async(report_details)
             print("report details: ", report_details)
 
             # make a report
             id = self.report_id_counter
             self.report_id_counter += 1
+            tracer.annotate(report_id=id)
             reported_message = message
             reported_author = message.author.id 
             reported_content = message.content
@@ -365,31 +462,31 @@ class ModBot(discord.Client):
             if imminent not in ["Non-imminent", "No", None]:
                 print(imminent)
                 report_info_msg += "URGENT: Imminent " + imminent + " harm reported."
+            if report_details.get('llm_status') == llm.RECOMMENDATION_PENDING:
+                report_info_msg += "\nLLM recommendation pending, the LLM provider is unavailable right now."
+            elif report_details.get('llm_status') == llm.LLM_FAILED:
+                report_info_msg += "\nLLM report failed (" + str(report_details.get('llm_error')) + "), this is a configuration or request problem, not an outage."
             
             # put the report on the queue itself
             submitted_report = SubmittedReport(id, reported_message, reported_author, reported_content, report_type, misinfo_type, misinfo_subtype, imminent, message_guild_id, priority, llm_recommendation)
-            self.report_queue.enqueue(submitted_report)
+            with tracer.span("enqueue"):
+                self.report_queue.enqueue(submitted_report)
+            self.near_duplicates.add(message.content, classification, confidence, report=submitted_report)
 
-            await mod_channel.send(report_info_msg)
+            with tracer.span("mod_channel_send"):
+                await mod_channel.send(report_info_msg)
             print("LLM done, Report created and sent to mod channel")
         
         else: 
+            self.near_duplicates.add(message.content, classification, confidence)
             print("message classified as not misinformation, no action taken")
 
     # classifier step of auto-review
     async def classify_msg(self, message, mod_channel):
-        credentials.refresh(Request())
-        token = credentials.token
-        headers = {
-            "Authorization": f"Bearer {token}"
-        }
-        payload = {"message": message.content}
         try:
-            response = requests.post(CLASSIFIER_URL, headers=headers, json=payload)
-            result = response.json()
-
-            classification = result.get("classification")
-            confidence = result.get("confidence_score")
+            # batched together with any other messages that arrive around the same time
+            with tracer.span("classify"):
+                classification, confidence = await self.classifier_batcher.classify(message.content)
 
             # lets not spam the mod channel, this can be included in the report itself later if we want to add that
             # await mod_channel.send(
@@ -397,13 +494,29 @@ class ModBot(discord.Client):
             # )
             return classification, confidence
 
-        except Exception as e:
-            await mod_channel.send("Error classifying message: " + message.content)
+        except (ClassifierError, GoogleAuthError) as e:
+            with tracer.span("mod_channel_send"):
+                await mod_channel.send("Error classifying message: " + message.content)
             print(e)
             return -1, -1
+        except Exception:
+            # anything unexpected still mustn't take down auto_review, but it's a bug so log the traceback
+            logging.getLogger(__name__).exception("Unexpected error classifying message %s", message.id)
+            with tracer.span("mod_channel_send"):
+                await mod_channel.send("Error classifying message: " + message.content)
+            return -1, -1
 
     # LLM step of auto-review is an external function so we dont' have  afunction for it here
 
 
-client = ModBot()
-client.run(discord_token)
+if __name__ == "__main__":
+    logger = logging.getLogger('discord')
+    logger.setLevel(logging.DEBUG)
+    handler = logging.FileHandler(filename='discord.log', encoding='utf-8', mode='w')
+    handler.setFormatter(logging.Formatter('%(asctime)s:%(levelname)s:%(name)s: %(message)s'))
+    logger.addHandler(handler)
+
+    llm.open_result_cache()
+    client = ModBot()
+    client.run(load_discord_token())
+
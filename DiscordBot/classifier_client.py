@@ -0,0 +1,173 @@
+"""
+This file implements an asyncio-native client for the Cloud Run classifier, so that
+classifying a message never blocks the discord.py event loop.
+"""
+import asyncio
+import time
+import aiohttp
+
+
+class ClassifierError(Exception):
+    pass
+
+
+def parse_prediction(item):
+    '''
+    (classification, confidence_score) from one prediction in a response, or raises
+    ClassifierError if it doesn't look like one.
+    '''
+    if not isinstance(item, dict) or "classification" not in item:
+        raise ClassifierError(f"classifier returned a malformed prediction: {item!r:.200}")
+    return item["classification"], item.get("confidence_score")
+
+
+class ClassifierClient:
+    '''
+    Wraps one pooled, keep-alive aiohttp session. At most `max_concurrency` requests are
+    in flight at once; everything past that waits on the semaphore instead of opening
+    more sockets. Each request gets its own total timeout.
+    '''
+    def __init__(self, url, batch_url=None, max_concurrency=16, timeout=10.0, keepalive_timeout=60.0):
+        self.url = url
+        self.batch_url = batch_url
+        self.max_concurrency = max_concurrency
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.keepalive_timeout = keepalive_timeout
+        self.session = None
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def start(self):
+        # the session has to be created inside the running event loop
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(limit=self.max_concurrency, keepalive_timeout=self.keepalive_timeout)
+            self.session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+
+    async def close(self):
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+        self.session = None
+
+    async def post(self, url, payload, headers=None):
+        await self.start()
+        async with self.semaphore:
+            try:
+                async with self.session.post(url, json=payload, headers=headers) as response:
+                    if response.status != 200:
+                        text = await response.text()
+                        raise ClassifierError(f"classifier returned {response.status}: {text}")
+                    result = await response.json()
+                    if not isinstance(result, dict):
+                        raise ClassifierError(f"classifier returned a non-object json body: {result!r:.200}")
+                    return result
+            except asyncio.TimeoutError:
+                raise ClassifierError(f"classifier timed out after {self.timeout.total}s")
+            except aiohttp.ClientError as e:
+                raise ClassifierError(f"classifier request failed: {e}")
+            except ValueError as e:
+                raise ClassifierError(f"classifier returned invalid json: {e}")
+
+    async def classify(self, content, headers=None, justification=None):
+        '''
+        Returns (classification, confidence_score) for one message, or raises ClassifierError.
+        '''
+        payload = {"message": content}
+        if justification:
+            payload["justification"] = justification
+        result = await self.post(self.url, payload, headers=headers)
+        return parse_prediction(result)
+
+    async def classify_batch(self, contents, headers=None):
+        '''
+        Classifies many messages in one request. Returns a list with one
+        (classification, confidence_score) tuple per message, or a ClassifierError for
+        messages the service rejected.
+        '''
+        result = await self.post(self.batch_url, {"messages": list(contents)}, headers=headers)
+        items = result.get("results")
+        if not isinstance(items, list) or len(items) != len(contents):
+            raise ClassifierError("classifier returned a malformed batch response")
+        out = []
+        for item in items:
+            if item is None or (isinstance(item, dict) and "error" in item):
+                out.append(ClassifierError(f"classifier rejected message: {(item or {}).get('error')}"))
+                continue
+            try:
+                out.append(parse_prediction(item))
+            except ClassifierError as e:
+                out.append(e)
+        return out
+
+
+class ClassificationCoalescer:
+    '''
+    Groups messages that arrive within `window` seconds of each other into one
+    /classify_batch call. Callers just await classify() as if it were a single request.
+    '''
+    def __init__(self, client, get_headers, window=0.05, max_batch_size=32, on_batch=None):
+        self.client = client
+        self.get_headers = get_headers # coroutine function returning the auth headers
+        # called after every /classify_batch call with its size, how long it took (seconds) and the error if it failed
+        self.on_batch = on_batch
+        self.window = window
+        self.max_batch_size = max_batch_size
+        self.pending = []
+        self.flush_handle = None
+        # the loop only keeps weak references to tasks, so in-flight batches are kept here until they finish
+        self.sending = set()
+        self.num_batches = 0
+        self.num_messages = 0
+
+    async def classify(self, content):
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((content, future))
+        if len(self.pending) >= self.max_batch_size:
+            self._flush()
+        elif self.flush_handle is None:
+            self.flush_handle = asyncio.get_running_loop().call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self):
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        batch, self.pending = self.pending, []
+        if batch:
+            task = asyncio.ensure_future(self._send(batch))
+            self.sending.add(task)
+            task.add_done_callback(self.sending.discard)
+
+    async def close(self):
+        '''
+        Sends whatever is still waiting for the window and waits for every batch in flight, so
+        no caller is left waiting on a future that never resolves.
+        '''
+        self._flush()
+        if self.sending:
+            await asyncio.gather(*self.sending, return_exceptions=True)
+
+    async def _send(self, batch):
+        self.num_batches += 1
+        self.num_messages += len(batch)
+        try:
+            headers = await self.get_headers()
+            start = time.perf_counter()
+            try:
+                results = await self.client.classify_batch([content for content, _ in batch], headers=headers)
+            except Exception as e:
+                if self.on_batch is not None:
+                    self.on_batch(len(batch), time.perf_counter() - start, e)
+                raise
+            if self.on_batch is not None:
+                self.on_batch(len(batch), time.perf_counter() - start, None)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
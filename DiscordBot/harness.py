@@ -0,0 +1,553 @@
+"""
+This file implements an offline harness for the bot's message pipeline. It runs ModBot's real
+handlers (auto_review, handle_report, handle_moderation) against fake Discord objects, a local
+stub of the classifier service and a local fake OpenAI endpoint, so pipeline changes can be
+benchmarked without Discord, Cloud Run or OpenAI.
+
+The stream is a JSONL file of events, one per line, with "t" (seconds from the start) and "kind":
+- channel: {"id", "author", "content"}, a message in the group channel (goes through auto_review)
+- report: {"author", "target"}, a user DMs the bot and walks through the report flow for the
+  channel message with id "target"
+- moderate: {"author", "action"}, a moderator DMs `moderate` and reviews the next report (action
+  1 removes, 2 allows, 3 escalates)
+
+Replay a recorded stream with --replay, or generate one (statements from test2_preds.csv, plus
+chatter the pre-screen should drop and near-duplicate reposts) and save it with --record.
+--speed replays it N times faster than recorded.
+
+Both stand-ins have configurable latency (median and lognormal spread) and error rates. The
+classifier answers with the recorded prediction for statements from test2_preds.csv and a
+seeded coin flip otherwise; the fake OpenAI endpoint returns valid answers for every prompt.
+
+It reports per-message end-to-end latency (from when the message was due to when its handler
+returned) by outcome, how many messages were in flight (the backlog) over time, how many
+classifier and LLM calls were made, and the bot's own per-stage spans (tracing.py).
+
+Usage (from the DiscordBot folder):
+    python harness.py [--messages 500] [--rate 5] [--speed 10] [--llm-latency-ms 800] [--llm-error-rate 0.05]
+    python harness.py --replay stream.jsonl --speed 4 --json results.json
+"""
+import argparse
+import asyncio
+import contextlib
+import contextvars
+import hashlib
+import io
+import json
+import os
+import random
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+from aiohttp import web
+
+# the LLM module reads the key at import, the fake endpoint doesn't check it
+os.environ.setdefault("OPENAI_API_KEY", "harness")
+import openai
+import discord
+from bot import ModBot
+from LLM import LLM_reports as llm
+from LLM.transport import AsyncLLMTransport
+from LLM.result_cache import LLMResultCache
+from tracing import tracer
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+GROUP_NUM = "8"
+GUILD_ID = 1000
+CHANNEL_ID = 2000
+MOD_CHANNEL_ID = 2001
+PERCENTILES = [50, 90, 95, 99]
+
+# messages the pre-screen should drop before they reach the classifier
+CHATTER = ["lol", "gm everyone", "!play lofi beats", "https://youtu.be/dQw4w9WgXcQ", "haha same", "👍👍", "ok", "brb", "nice one", "/help"]
+# what gets added to a message when it's reposted, near_duplicate.py should see through all of these
+REPOST_DECORATIONS = [" 🔥🔥", "!!!", " (share this)", " https://t.co/abc123", "RT: "]
+
+# the handler task each event runs in sets this, so the wrapped pipeline stages can tag its outcome
+current_event = contextvars.ContextVar("current_event")
+
+
+# ================== Fake Discord objects ==================
+
+class FakeUser:
+    def __init__(self, id, name=None):
+        self.id = id
+        self.name = name or f"user{id}"
+
+    def __str__(self):
+        return self.name
+
+class FakeResponse:
+    # the bits of an HTTP response discord.errors.NotFound reads
+    status = 404
+    reason = "Not Found"
+
+class FakeChannel:
+    def __init__(self, id, name, guild=None):
+        self.id = id
+        self.name = name
+        self.guild = guild
+        self.messages = {} # id -> FakeMessage, for fetch_message
+        self.sent = 0
+
+    async def send(self, content):
+        self.sent += 1
+
+    async def fetch_message(self, id):
+        if id not in self.messages:
+            raise discord.errors.NotFound(FakeResponse(), "Unknown Message")
+        return self.messages[id]
+
+class FakeGuild:
+    def __init__(self, id, name, channel_names):
+        self.id = id
+        self.name = name
+        self.text_channels = [FakeChannel(CHANNEL_ID + i, channel_name, self) for i, channel_name in enumerate(channel_names)]
+
+    def get_channel(self, id):
+        return next((channel for channel in self.text_channels if channel.id == id), None)
+
+class FakeMessage:
+    def __init__(self, id, content, author, channel):
+        self.id = id
+        self.content = content
+        self.author = author
+        self.channel = channel
+        self.guild = channel.guild
+        self.reactions = []
+
+    async def add_reaction(self, emoji):
+        self.reactions.append(emoji)
+
+    @property
+    def jump_url(self):
+        return f"https://discord.com/channels/{self.guild.id}/{self.channel.id}/{self.id}"
+
+
+class HarnessBot(ModBot):
+    '''
+    ModBot wired to the fake guild and the local stand-ins, never connected to Discord.
+    '''
+    def __init__(self, guild, classifier_base_url):
+        async def no_auth_headers():
+            return {}
+        super().__init__(classifier_url=classifier_base_url + "/classify", classifier_batch_url=classifier_base_url + "/classify_batch", classifier_headers=no_auth_headers)
+        self.guild = guild
+        self.group_num = GROUP_NUM
+        for channel in guild.text_channels:
+            if channel.name == f"group-{GROUP_NUM}-mod":
+                self.mod_channels[guild.id] = channel
+
+    def get_guild(self, id):
+        return self.guild if id == self.guild.id else None
+
+    async def route(self, message):
+        # what on_message does, minus the check against the bot's own user
+        if message.guild:
+            await self.handle_channel_message(message)
+        else:
+            await self.handle_dm(message)
+
+
+# ================== Local stand-ins for the classifier and OpenAI ==================
+
+class LatencyProfile:
+    '''
+    Latency with a lognormal spread around the median, and errors at the given rates.
+    '''
+    def __init__(self, median_ms, spread, error_rate, rate_429, rng):
+        self.median_ms = median_ms
+        self.spread = spread
+        self.error_rate = error_rate
+        self.rate_429 = rate_429
+        self.rng = rng
+
+    async def wait(self, extra_ms=0.0):
+        await asyncio.sleep((self.median_ms * self.rng.lognormvariate(0, self.spread) + extra_ms) / 1000)
+
+    def error_status(self):
+        roll = self.rng.random()
+        if roll < self.rate_429:
+            return 429
+        if roll < self.rate_429 + self.error_rate:
+            return 500
+        return None
+
+class StubClassifier:
+    '''
+    Answers /classify and /classify_batch like classifier_gcp/main.py.
+    '''
+    def __init__(self, profile, known, misinfo_rate, per_item_ms):
+        self.profile = profile
+        self.known = known # statement -> (classification, confidence) from the preds csv
+        self.misinfo_rate = misinfo_rate
+        self.per_item_ms = per_item_ms
+        self.requests = 0
+        self.batch_requests = 0
+        self.messages = 0
+        self.errors = 0
+
+    def classify_one(self, statement):
+        if statement in self.known:
+            classification, confidence = self.known[statement]
+        else:
+            # same message, same answer
+            roll = int.from_bytes(hashlib.sha256(statement.encode("utf-8")).digest()[:4], "big") / 2 ** 32
+            classification = "Misinformation" if roll < self.misinfo_rate else "Not Misinformation"
+            confidence = 0.5 + roll / 2 if classification == "Misinformation" else 1 - roll / 2
+        return {"classification": classification, "confidence_score": round(confidence, 4)}
+
+    async def classify(self, request):
+        data = await request.json()
+        return await self.respond(request, [data.get("message", "")], lambda results: results[0])
+
+    async def classify_batch(self, request):
+        data = await request.json()
+        self.batch_requests += 1
+        return await self.respond(request, data.get("messages", []), lambda results: {"results": results})
+
+    async def respond(self, request, statements, shape):
+        self.requests += 1
+        self.messages += len(statements)
+        await self.profile.wait(self.per_item_ms * len(statements))
+        status = self.profile.error_status()
+        if status is not None:
+            self.errors += 1
+            return web.json_response({"error": "stand-in error"}, status=status)
+        return web.json_response(shape([self.classify_one(s) for s in statements]))
+
+    def stats(self):
+        return {"requests": self.requests, "batch_requests": self.batch_requests, "messages": self.messages, "errors": self.errors}
+
+class FakeOpenAI:
+    '''
+    An OpenAI-compatible /v1/chat/completions that returns a valid answer for each of our prompts.
+    '''
+    def __init__(self, profile):
+        self.profile = profile
+        self.calls = {}
+        self.errors = 0
+
+    def answer(self, body):
+        content = body["messages"][-1]["content"]
+        is_health = any(word in content.lower() for word in ["vaccine", "covid", "cure", "health"])
+        if body.get("response_format"):
+            return "structured", json.dumps({
+                "misinfo_type": "Health Misinformation" if is_health else "Political Misinformation",
+                "misinfo_subtype": "Vaccines" if is_health else "Election/Campaign Misinformation",
+                "imminent": "Non-imminent",
+                "recommendation": "Remove Content",
+                "justification": "Answer from the harness's fake LLM endpoint.",
+            })
+        if "Respond with ONLY the number" in content:
+            return "numbered step", "2" if is_health and "(1-3)" in content else "1"
+        return "recommendation", "Remove Content. Answer from the harness's fake LLM endpoint."
+
+    async def chat_completions(self, request):
+        body = await request.json()
+        kind, text = self.answer(body)
+        self.calls[kind] = self.calls.get(kind, 0) + 1
+        await self.profile.wait()
+        status = self.profile.error_status()
+        if status is not None:
+            self.errors += 1
+            return web.json_response({"error": {"message": "stand-in error", "type": "server_error"}}, status=status)
+        return web.json_response({
+            "id": f"chatcmpl-harness-{sum(self.calls.values())}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "gpt-4o-mini"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+        })
+
+    def stats(self):
+        return {"calls": sum(self.calls.values()), "by_prompt": dict(self.calls), "errors": self.errors}
+
+async def serve(routes):
+    # on a free localhost port, returns (runner, base url)
+    app = web.Application()
+    app.add_routes(routes)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}"
+
+
+# ================== Message streams ==================
+
+def load_known_predictions(path):
+    df = pd.read_csv(path, usecols=["statement", "prediction", "confidence_score"]).dropna()
+    return {row.statement: ("Misinformation" if row.prediction == "misinfo" else "Not Misinformation", float(row.confidence_score))
+            for row in df.itertuples()}
+
+def synthetic_stream(args, statements, rng):
+    '''
+    Poisson arrivals at args.rate channel messages/sec: statements, chatter and reposts. User
+    reports and moderator reviews are spread over the same time span.
+    '''
+    events = []
+    t = 0.0
+    posted = []
+    for i in range(args.messages):
+        t += rng.expovariate(args.rate)
+        roll = rng.random()
+        if roll < args.chatter_fraction:
+            content = rng.choice(CHATTER)
+        elif roll < args.chatter_fraction + args.duplicate_fraction and posted:
+            decoration = rng.choice(REPOST_DECORATIONS)
+            original = rng.choice(posted)
+            content = decoration + original if decoration.endswith(" ") else original + decoration
+        else:
+            content = rng.choice(statements)
+            posted.append(content)
+        events.append({"t": round(t, 3), "kind": "channel", "id": i + 1, "author": rng.randint(1, args.users), "content": content})
+
+    channel_events = [e for e in events if e["kind"] == "channel"]
+    for i in range(args.user_reports):
+        target = rng.choice(channel_events)
+        events.append({"t": round(target["t"] + rng.uniform(1, 10), 3), "kind": "report", "author": 900 + i, "target": target["id"]})
+    for i in range(args.moderations):
+        events.append({"t": round(rng.uniform(0, t), 3), "kind": "moderate", "author": 800 + i % 3, "action": rng.choice(["1", "1", "2", "3"])})
+    return sorted(events, key=lambda e: e["t"])
+
+def read_stream(path):
+    with open(path) as f:
+        return sorted((json.loads(line) for line in f if line.strip()), key=lambda e: e["t"])
+
+def write_stream(path, events):
+    with open(path, "w") as f:
+        for event in events:
+            f.write(json.dumps(event) + "\n")
+
+
+# ================== Replay ==================
+
+REPORT_FLOW = ["1", "1", "1", "1", "1"] # misinformation > political > election > no imminent harm > don't block
+
+def dm_script(event, channel):
+    if event["kind"] == "report":
+        link = f"https://discord.com/channels/{channel.guild.id}/{channel.id}/{event['target']}"
+        return ["report", link] + REPORT_FLOW
+    return ["moderate", "yes", "continue", event.get("action", "1")]
+
+def instrument(bot):
+    '''
+    Wraps the pipeline stages so each message's handler task records how far the message got.
+    '''
+    def tag(outcome):
+        event = current_event.get(None)
+        if event is not None:
+            event["outcome"] = outcome
+
+    should_skip, find, classify_msg, report = bot.prescreen.should_skip, bot.near_duplicates.find, bot.classify_msg, llm.LLM_report_async
+
+    def wrapped_should_skip(content):
+        skip = should_skip(content)
+        if skip:
+            tag("prescreen skip")
+        return skip
+
+    def wrapped_find(content):
+        match = find(content)
+        if match is not None:
+            tag("near-duplicate")
+        return match
+
+    async def wrapped_classify_msg(message, mod_channel):
+        tag("classified benign")
+        result = await classify_msg(message, mod_channel)
+        if result[0] == -1:
+            tag("classifier error")
+        return result
+
+    async def wrapped_report(report_details, single_call=None):
+        tag("reported (LLM)")
+        details = await report(report_details, single_call)
+        if details.get("llm_status") == llm.RECOMMENDATION_PENDING:
+            tag("reported (LLM unavailable)")
+        return details
+
+    bot.prescreen.should_skip = wrapped_should_skip
+    bot.near_duplicates.find = wrapped_find
+    bot.classify_msg = wrapped_classify_msg
+    llm.LLM_report_async = wrapped_report
+
+async def replay(bot, guild, events, speed, sample_interval):
+    channel = next(c for c in guild.text_channels if c.name == f"group-{GROUP_NUM}")
+    users = {}
+    in_flight = set()
+    records = []
+    backlog = []
+    dm_lock = asyncio.Lock() # the bot keeps one conversation state for all DMs, so DM sessions take turns
+
+    def user(id):
+        return users.setdefault(id, FakeUser(id))
+
+    async def handle(event, due):
+        record = {"kind": event["kind"], "outcome": event["kind"]}
+        current_event.set(record)
+        try:
+            if event["kind"] == "channel":
+                message = FakeMessage(event["id"], event["content"], user(event["author"]), channel)
+                channel.messages[message.id] = message
+                await bot.route(message)
+            else:
+                async with dm_lock:
+                    dm_channel = FakeChannel(0, "dm")
+                    for i, content in enumerate(dm_script(event, channel)):
+                        await bot.route(FakeMessage(-(len(records) * 100 + i), content, user(event["author"]), dm_channel))
+        except Exception as e:
+            record["outcome"] = f"exception: {type(e).__name__}"
+            print(f"harness: {event} raised {e!r}", file=sys.__stderr__)
+        record["latency_ms"] = (time.perf_counter() - due) * 1000
+        records.append(record)
+
+    async def sample_backlog(start):
+        while True:
+            backlog.append((round(time.perf_counter() - start, 3), len(in_flight)))
+            await asyncio.sleep(sample_interval)
+
+    start = time.perf_counter()
+    sampler = asyncio.ensure_future(sample_backlog(start))
+    for event in events:
+        due = start + event["t"] / speed
+        delay = due - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        task = asyncio.ensure_future(handle(event, due))
+        in_flight.add(task)
+        task.add_done_callback(in_flight.discard)
+    while in_flight:
+        await asyncio.gather(*list(in_flight))
+    elapsed = time.perf_counter() - start
+    sampler.cancel()
+    return records, backlog, elapsed
+
+
+def summarize(records, backlog, elapsed, bot, classifier, fake_llm, guild):
+    by_outcome = {}
+    for record in records:
+        by_outcome.setdefault(record["outcome"], []).append(record["latency_ms"])
+    latency = {}
+    for outcome, values in sorted(by_outcome.items()):
+        latency[outcome] = {"count": len(values), **{f"p{p}_ms": round(float(np.percentile(values, p)), 1) for p in PERCENTILES}, "max_ms": round(max(values), 1)}
+    depths = [depth for _, depth in backlog] or [0]
+    channel_messages = sum(1 for r in records if r["kind"] == "channel")
+    mod_channel = guild.get_channel(MOD_CHANNEL_ID)
+    return {
+        "elapsed_sec": round(elapsed, 2),
+        "events": len(records),
+        "channel_messages_per_sec": round(channel_messages / elapsed, 2) if elapsed else 0.0,
+        "latency": latency,
+        "backlog": {"max": max(depths), "mean": round(float(np.mean(depths)), 2), "timeline": backlog},
+        "classifier": dict(classifier.stats(), coalesced_batches=bot.classifier_batcher.num_batches),
+        "llm": dict(fake_llm.stats(), per_channel_message=round(fake_llm.stats()["calls"] / channel_messages, 3) if channel_messages else 0.0),
+        "llm_cache": llm.result_cache.stats(),
+        "reports_created": bot.report_id_counter,
+        "reports_left_in_queue": sum(len(q) for q in bot.report_queue.queues),
+        "mod_channel_messages": mod_channel.sent if mod_channel else 0,
+        "prescreen_skipped": sum(bot.prescreen.skipped.values()),
+        "near_duplicate_matches": bot.near_duplicates.matches,
+        "spans": tracer.stats(),
+    }
+
+def report(summary):
+    print(f"\n{summary['events']} events in {summary['elapsed_sec']}s ({summary['channel_messages_per_sec']} channel messages/sec)")
+    print(f"\n{'outcome':<28}{'count':>7}" + "".join(f"{'p' + str(p) + ' ms':>10}" for p in PERCENTILES) + f"{'max ms':>10}")
+    for outcome, stats in summary["latency"].items():
+        print(f"{outcome:<28}{stats['count']:>7}" + "".join(f"{stats[f'p{p}_ms']:>10}" for p in PERCENTILES) + f"{stats['max_ms']:>10}")
+    print(f"\nbacklog: max {summary['backlog']['max']} messages in flight, mean {summary['backlog']['mean']}")
+    c = summary["classifier"]
+    print(f"classifier: {c['requests']} requests ({c['batch_requests']} batched) for {c['messages']} messages, {c['errors']} errors")
+    l = summary["llm"]
+    print(f"LLM: {l['calls']} calls ({l['per_channel_message']} per channel message), {l['errors']} errors, by prompt {l['by_prompt']}")
+    print(f"reports created {summary['reports_created']}, still queued {summary['reports_left_in_queue']}, "
+          f"pre-screen skipped {summary['prescreen_skipped']}, near-duplicates {summary['near_duplicate_matches']}")
+    print("\nper-stage spans (tracing.py):")
+    print(tracer.summary().strip("`"))
+
+
+async def run(args):
+    rng = random.Random(args.seed)
+    preds_path = os.path.join(HERE, args.data)
+    known = load_known_predictions(preds_path)
+    events = read_stream(args.replay) if args.replay else synthetic_stream(args, list(known), rng)
+    if args.record:
+        write_stream(args.record, events)
+
+    classifier = StubClassifier(LatencyProfile(args.classifier_latency_ms, args.classifier_spread, args.classifier_error_rate, args.classifier_429_rate, random.Random(args.seed + 1)),
+                                known, args.misinfo_rate, args.classifier_per_item_ms)
+    fake_llm = FakeOpenAI(LatencyProfile(args.llm_latency_ms, args.llm_spread, args.llm_error_rate, args.llm_429_rate, random.Random(args.seed + 2)))
+    classifier_runner, classifier_url = await serve([web.post("/classify", classifier.classify), web.post("/classify_batch", classifier.classify_batch)])
+    llm_runner, llm_url = await serve([web.post("/v1/chat/completions", fake_llm.chat_completions)])
+
+    # point the LLM module at the fake endpoint, with a fresh in-memory cache (the SQLite one is only opened by bot.py's main)
+    llm.transport = AsyncLLMTransport(client=openai.AsyncOpenAI(base_url=llm_url + "/v1", api_key="harness", max_retries=0))
+    llm.result_cache = LLMResultCache(None)
+
+    guild = FakeGuild(GUILD_ID, "harness", [f"group-{GROUP_NUM}", f"group-{GROUP_NUM}-mod"])
+    bot = HarnessBot(guild, classifier_url)
+    instrument(bot)
+    if args.trace_export:
+        tracer.export_to(args.trace_export)
+    try:
+        # the bot prints a lot per message, keep it out of the report unless asked for
+        with contextlib.redirect_stdout(sys.stdout if args.verbose else io.StringIO()):
+            records, backlog, elapsed = await replay(bot, guild, events, args.speed, args.sample_interval)
+    finally:
+        await bot.classifier_batcher.close()
+        await bot.classifier.close()
+        tracer.close()
+        await classifier_runner.cleanup()
+        await llm_runner.cleanup()
+    return summarize(records, backlog, elapsed, bot, classifier, fake_llm, guild)
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a message stream through the bot against local stand-ins.")
+    parser.add_argument("--replay", help="JSONL stream to replay (see the top of this file), otherwise a synthetic one is generated")
+    parser.add_argument("--record", help="save the stream that was run to this JSONL file")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay N times faster than the stream's timestamps")
+    parser.add_argument("--data", default="../classifier_gcp/test2_preds.csv", help="statements and the classifier's recorded predictions")
+    parser.add_argument("--seed", type=int, default=152)
+
+    synthetic = parser.add_argument_group("synthetic stream")
+    synthetic.add_argument("--messages", type=int, default=500)
+    synthetic.add_argument("--rate", type=float, default=5.0, help="channel messages per second (before --speed)")
+    synthetic.add_argument("--users", type=int, default=50)
+    synthetic.add_argument("--chatter-fraction", type=float, default=0.3)
+    synthetic.add_argument("--duplicate-fraction", type=float, default=0.1)
+    synthetic.add_argument("--user-reports", type=int, default=5)
+    synthetic.add_argument("--moderations", type=int, default=5)
+
+    stand_ins = parser.add_argument_group("stand-ins")
+    stand_ins.add_argument("--classifier-latency-ms", type=float, default=60.0, help="median per request")
+    stand_ins.add_argument("--classifier-per-item-ms", type=float, default=5.0, help="added per message in a batch")
+    stand_ins.add_argument("--classifier-spread", type=float, default=0.3, help="lognormal sigma of the latency")
+    stand_ins.add_argument("--classifier-error-rate", type=float, default=0.0, help="share of requests that get a 500")
+    stand_ins.add_argument("--classifier-429-rate", type=float, default=0.0)
+    stand_ins.add_argument("--misinfo-rate", type=float, default=0.3, help="for statements without a recorded prediction")
+    stand_ins.add_argument("--llm-latency-ms", type=float, default=800.0, help="median per call")
+    stand_ins.add_argument("--llm-spread", type=float, default=0.5)
+    stand_ins.add_argument("--llm-error-rate", type=float, default=0.0)
+    stand_ins.add_argument("--llm-429-rate", type=float, default=0.0)
+
+    parser.add_argument("--sample-interval", type=float, default=0.1, help="seconds between backlog samples")
+    parser.add_argument("--verbose", action="store_true", help="show the bot's own output")
+    parser.add_argument("--json", help="also write the results (with the backlog timeline) to this file")
+    parser.add_argument("--trace-export", help="append every pipeline span to this JSONL file")
+    args = parser.parse_args()
+
+    summary = asyncio.run(run(args))
+    report(summary)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""
+This file implements a near-duplicate index of recently classified messages, so lightly mutated
+copies of the same claim (different emojis, casing, a URL) reuse the earlier verdict and report
+instead of going through the classifier and the LLM again.
+
+Messages are normalized, split into character shingles and summarized with a MinHash signature.
+The fraction of equal signature values estimates the Jaccard similarity of two messages' shingle
+sets. To find candidates without comparing against every entry, signatures are cut into bands
+(locality-sensitive hashing): messages that share any whole band are compared.
+"""
+import hashlib
+import random
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+
+URL_RE = re.compile(r"https?://\S+|www\.\S+")
+MENTION_RE = re.compile(r"<[@#][!&]?\d+>|@\w+")
+NON_WORD_RE = re.compile(r"[^\w\s]+")
+
+MERSENNE_PRIME = (1 << 61) - 1
+
+
+def normalize(text):
+    # drop what spammers usually change between copies: case, urls, mentions, emojis and punctuation
+    text = unicodedata.normalize("NFKC", text or "").lower()
+    text = URL_RE.sub(" ", text)
+    text = MENTION_RE.sub(" ", text)
+    text = NON_WORD_RE.sub(" ", text)
+    return " ".join(text.split())
+
+def shingles(text, size=4):
+    return {text[i:i + size] for i in range(max(1, len(text) - size + 1))}
+
+
+class MinHasher:
+    def __init__(self, num_perm=64, seed=152):
+        rng = random.Random(seed)
+        # one universal hash function (a * x + b) mod p per signature value
+        self.params = [(rng.randrange(1, MERSENNE_PRIME), rng.randrange(0, MERSENNE_PRIME)) for _ in range(num_perm)]
+
+    def signature(self, shingle_set):
+        hashes = [int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "big") for s in shingle_set]
+        return tuple(min((a * h + b) % MERSENNE_PRIME for h in hashes) for a, b in self.params)
+
+
+def estimated_similarity(sig_a, sig_b):
+    return sum(1 for a, b in zip(sig_a, sig_b) if a == b) / len(sig_a)
+
+
+class IndexedMessage:
+    def __init__(self, signature, classification, confidence, report=None):
+        self.signature = signature
+        self.classification = classification
+        self.confidence = confidence
+        self.report = report # the SubmittedReport created for this message, if any
+        self.added_at = time.monotonic()
+        self.duplicates = 0
+
+
+class NearDuplicateIndex:
+    '''
+    With the defaults (16 bands of 4 values) a pair with similarity 0.7 becomes a candidate
+    about 99% of the time and one with similarity 0.3 about 12% of the time; candidates are
+    then only accepted if their estimated similarity is at least `threshold`.
+    '''
+    def __init__(self, threshold=0.7, num_perm=64, num_bands=16, max_entries=10000, ttl=6 * 3600, min_length=20):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        # very short messages ("lol", "same") don't carry enough signal to compare
+        self.min_length = min_length
+        self.hasher = MinHasher(num_perm)
+        self.num_bands = num_bands
+        self.rows_per_band = num_perm // num_bands
+        self.entries = OrderedDict() # entry id -> IndexedMessage, oldest first
+        self.bands = [dict() for _ in range(num_bands)] # band values -> set of entry ids
+        self.next_id = 0
+
+        self.lookups = 0
+        self.matches = 0
+
+    def signature(self, content):
+        text = normalize(content)
+        if len(text) < self.min_length:
+            return None
+        return self.hasher.signature(shingles(text))
+
+    def _band_keys(self, signature):
+        r = self.rows_per_band
+        return [signature[i * r:(i + 1) * r] for i in range(self.num_bands)]
+
+    def find(self, content):
+        '''
+        Returns the most similar unexpired IndexedMessage at or above the threshold, or None.
+        '''
+        self._expire()
+        self.lookups += 1
+        signature = self.signature(content)
+        if signature is None:
+            return None
+
+        candidates = set()
+        for band, key in zip(self.bands, self._band_keys(signature)):
+            candidates.update(band.get(key, ()))
+
+        best, best_similarity = None, self.threshold
+        for entry_id in candidates:
+            entry = self.entries[entry_id]
+            similarity = estimated_similarity(signature, entry.signature)
+            if similarity >= best_similarity:
+                best, best_similarity = entry, similarity
+        if best is not None:
+            best.duplicates += 1
+            self.matches += 1
+        return best
+
+    def add(self, content, classification, confidence, report=None):
+        signature = self.signature(content)
+        if signature is None:
+            return None
+        entry = IndexedMessage(signature, classification, confidence, report)
+        entry_id = self.next_id
+        self.next_id += 1
+        self.entries[entry_id] = entry
+        for band, key in zip(self.bands, self._band_keys(signature)):
+            band.setdefault(key, set()).add(entry_id)
+        while len(self.entries) > self.max_entries:
+            self._remove_oldest()
+        return entry
+
+    def _remove_oldest(self):
+        entry_id, entry = self.entries.popitem(last=False)
+        for band, key in zip(self.bands, self._band_keys(entry.signature)):
+            ids = band.get(key)
+            if ids is not None:
+                ids.discard(entry_id)
+                if not ids:
+                    del band[key]
+
+    def _expire(self):
+        # entries are in insertion order, so expired ones are always at the front
+        cutoff = time.monotonic() - self.ttl
+        while self.entries and next(iter(self.entries.values())).added_at < cutoff:
+            self._remove_oldest()
+
+    def __len__(self):
+        return len(self.entries)
@@ -0,0 +1,133 @@
+"""
+This file implements a cheap local pre-screen that runs in the bot process before the remote
+classifier. Messages it is confident are benign never reach the classifier:
+
+1. rules: bot commands, bare links, emoji/punctuation-only messages, messages too short to be
+   a claim, and messages with no Latin letters (the classifier is English-only)
+2. a hashed word n-gram logistic regression trained offline on the classifier's own labels
+   (see train_prescreen.py). Messages it scores below its threshold are skipped.
+"""
+import hashlib
+import json
+import math
+import os
+import re
+import unicodedata
+from collections import Counter
+
+URL_RE = re.compile(r"https?://\S+|www\.\S+")
+WORD_RE = re.compile(r"[a-z0-9']+")
+LATIN_RE = re.compile(r"[a-zA-Z]")
+
+# a bot command prefix straight followed by a command name, e.g. !play, /help (but not "!!!").
+# only ! and /: a $ (cashtags, "$TSLA will be delisted"), > (quotes) or ? in front of a word is
+# usually a real message, and financial claims are one of the things we report
+COMMAND_RE = re.compile(r"^[!/][a-zA-Z]\w*")
+MIN_WORDS = 3
+MIN_LETTERS = 12
+
+
+def tokenize(text):
+    text = unicodedata.normalize("NFKC", text or "").lower()
+    return WORD_RE.findall(URL_RE.sub(" ", text))
+
+def hashed_features(tokens, num_buckets, ngram=2):
+    # word unigrams (and bigrams, ...) hashed into a fixed number of buckets
+    counts = Counter()
+    for n in range(1, ngram + 1):
+        for i in range(len(tokens) - n + 1):
+            gram = " ".join(tokens[i:i + n])
+            bucket = int.from_bytes(hashlib.blake2b(gram.encode("utf-8"), digest_size=4).digest(), "big") % num_buckets
+            counts[bucket] += 1
+    return counts
+
+def sigmoid(x):
+    if x < -30:
+        return 0.0
+    return 1.0 / (1.0 + math.exp(-x))
+
+
+class LinearModel:
+    def __init__(self, weights, bias, num_buckets, ngram, threshold):
+        self.weights = weights
+        self.bias = bias
+        self.num_buckets = num_buckets
+        self.ngram = ngram
+        self.threshold = threshold # messages scoring below this are treated as benign
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            data = json.load(f)
+        return cls(data["weights"], data["bias"], data["num_buckets"], data["ngram"], data["threshold"])
+
+    def save(self, path, **info):
+        data = {"num_buckets": self.num_buckets, "ngram": self.ngram, "threshold": self.threshold, "bias": self.bias}
+        data.update(info)
+        data["weights"] = [round(w, 5) for w in self.weights]
+        with open(path, "w") as f:
+            json.dump(data, f)
+
+    def score(self, tokens):
+        features = hashed_features(tokens, self.num_buckets, self.ngram)
+        norm = math.sqrt(sum(v * v for v in features.values())) or 1.0
+        return sigmoid(self.bias + sum(self.weights[b] * v / norm for b, v in features.items()))
+
+
+def rule_skip_reason(content):
+    '''
+    Returns why a message can be skipped without any model, or None.
+    '''
+    stripped = (content or "").strip()
+    if not stripped:
+        return "empty"
+    if COMMAND_RE.match(stripped):
+        return "command"
+    without_links = URL_RE.sub(" ", stripped).strip()
+    if not without_links:
+        return "bare link"
+    if not any(unicodedata.category(c).startswith("L") for c in without_links):
+        return "no letters" # emoji, punctuation, numbers
+    if not LATIN_RE.search(without_links):
+        return "non-latin script"
+    letters = sum(1 for c in without_links if c.isalpha())
+    if letters < MIN_LETTERS or len(tokenize(without_links)) < MIN_WORDS:
+        return "too short"
+    return None
+
+
+class PreScreen:
+    def __init__(self, model_path=None):
+        self.model = None
+        if model_path and os.path.isfile(model_path):
+            self.model = LinearModel.load(model_path)
+        elif model_path:
+            print(f"Pre-screen model {model_path} not found, using rules only")
+        self.seen = 0
+        self.skipped = Counter() # reason -> count
+
+    def should_skip(self, content):
+        '''
+        True if the message is confidently benign and shouldn't be sent to the remote classifier.
+        '''
+        self.seen += 1
+        reason = rule_skip_reason(content)
+        if reason is None and self.model is not None:
+            if self.model.score(tokenize(content)) < self.model.threshold:
+                reason = "linear model"
+        if reason is not None:
+            self.skipped[reason] += 1
+            return True
+        return False
+
+    def skipped_fraction(self):
+        return sum(self.skipped.values()) / self.seen if self.seen else 0.0
+
+    def summary(self):
+        out = "```"
+        out += f"Messages pre-screened: {self.seen}\n"
+        out += f"Skipped (never sent to the classifier): {sum(self.skipped.values())} ({100 * self.skipped_fraction():.1f}%)\n"
+        for reason, count in self.skipped.most_common():
+            out += f"  {reason:<18} {count}\n"
+        out += "```"
+        return out
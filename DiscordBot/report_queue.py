@@ -20,6 +20,10 @@ class SubmittedReport:
             self.llm_recommendation = llm_recommendation
         else:
             self.llm_recommendation = None
+        # near-duplicate messages that were attached to this report instead of getting their own
+        self.linked_messages = []
+        # "Allowed" or "Removed" once a moderator has decided, None while it's queued or being reviewed
+        self.verdict = None
 
 class PriorityReportQueue:
     def __init__(self, num_levels, queue_names):
@@ -66,6 +70,8 @@ class PriorityReportQueue:
             f"       Subtype: {report.subtype}\n"
             f"       Imminent: {report.imminent}\n"
         )
+        if report.linked_messages:
+            output += f"       Near-duplicates linked: {len(report.linked_messages)}\n"
         if showContent:
             output += f"       Content: `{report.content}`\n"
         return output
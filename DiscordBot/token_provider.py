@@ -0,0 +1,87 @@
+"""
+This file implements an expiry-aware cache for the Google ID token we send to the classifier.
+"""
+import asyncio
+import calendar
+import json
+import time
+from google.oauth2 import service_account
+from google.auth.transport.requests import Request
+
+
+class IDTokenProvider:
+    '''
+    Caches the ID token of an IDTokenCredentials object and only goes back to Google's
+    token endpoint when the token is close to expiring.
+
+    - more than `background_margin` seconds left: return the cached token
+    - less than that but more than `refresh_margin`: return the cached token and start a
+      refresh in the background
+    - less than `refresh_margin` (or no token yet): wait for a refresh
+
+    Only one refresh is ever in flight; concurrent callers all await the same one.
+    '''
+    def __init__(self, credentials, refresh_margin=60, background_margin=300, request=None):
+        self.credentials = credentials
+        self.refresh_margin = refresh_margin
+        self.background_margin = background_margin
+        self.request = request or Request()
+        self.token = None
+        self.expires_at = 0.0
+        self.refresh_count = 0
+        self._inflight = None
+
+    @classmethod
+    def from_service_account_file(cls, path, target_audience, token_uri=None, **kwargs):
+        '''
+        `token_uri` overrides the one in the key file, e.g. to point at a local fake token issuer.
+        '''
+        with open(path) as f:
+            info = json.load(f)
+        if token_uri:
+            info["token_uri"] = token_uri
+        credentials = service_account.IDTokenCredentials.from_service_account_info(info, target_audience=target_audience)
+        return cls(credentials, **kwargs)
+
+    def seconds_left(self):
+        if self.token is None:
+            return 0.0
+        return self.expires_at - time.time()
+
+    async def get_token(self):
+        left = self.seconds_left()
+        if left > self.background_margin:
+            return self.token
+        if left > self.refresh_margin:
+            self._start_refresh()
+            return self.token
+        # shield so that one caller being cancelled doesn't cancel everyone else's refresh
+        return await asyncio.shield(self._start_refresh())
+
+    async def auth_headers(self):
+        token = await self.get_token()
+        return {"Authorization": f"Bearer {token}"}
+
+    def _start_refresh(self):
+        if self._inflight is None:
+            self._inflight = asyncio.ensure_future(self._refresh())
+            self._inflight.add_done_callback(self._refresh_done)
+        return self._inflight
+
+    def _refresh_done(self, task):
+        self._inflight = None
+        # a failed background refresh shouldn't be lost silently, the next caller will retry
+        if not task.cancelled() and task.exception() is not None:
+            print(f"ID token refresh failed: {task.exception()}")
+
+    async def _refresh(self):
+        # credentials.refresh is a blocking http call to the token endpoint
+        await asyncio.to_thread(self.credentials.refresh, self.request)
+        self.token = self.credentials.token
+        # google-auth gives us a naive UTC datetime
+        if self.credentials.expiry is not None:
+            self.expires_at = calendar.timegm(self.credentials.expiry.utctimetuple())
+        else:
+            self.expires_at = time.time() + self.background_margin
+        self.refresh_count += 1
+        return self.token
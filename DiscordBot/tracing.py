@@ -0,0 +1,116 @@
+"""
+This file implements lightweight tracing for the auto-review pipeline: a span per stage
+(pre-screen, classifier call, each LLM step, queueing the report, the mod channel message, ...)
+tagged with the message and report it belongs to.
+
+Durations are kept in memory per stage (the last `window` of each) for rolling percentiles,
+which the `report perf` mod channel command prints. Spans can also be appended to a local JSONL
+file (TRACE_EXPORT_PATH in bot.py) for offline analysis.
+
+    with tracer.trace(message_id=message.id):   # everything recorded inside is tagged with it
+        with tracer.span("classify"):
+            ...
+        tracer.annotate(report_id=id)           # tags the spans recorded after this too
+"""
+import contextlib
+import contextvars
+import json
+import time
+from collections import Counter, deque
+
+# attributes of the message being handled. asyncio tasks copy it when they're created, so the
+# LLM steps that run concurrently are tagged with the message that started them
+current_trace = contextvars.ContextVar("current_trace", default=None)
+
+
+class Tracer:
+    def __init__(self, window=1000, export_path=None):
+        self.window = window
+        self.durations = {} # stage -> deque of the last `window` durations in seconds, in the order stages were first seen
+        self.counts = Counter()
+        self.errors = Counter()
+        self.export_file = None
+        if export_path:
+            self.export_to(export_path)
+
+    def export_to(self, path):
+        self.close()
+        # line buffered, so a crash loses at most the span being written
+        self.export_file = open(path, "a", buffering=1, encoding="utf-8")
+
+    def close(self):
+        if self.export_file is not None:
+            self.export_file.close()
+            self.export_file = None
+
+    @contextlib.contextmanager
+    def trace(self, **attrs):
+        token = current_trace.set(dict(attrs))
+        try:
+            yield
+        finally:
+            current_trace.reset(token)
+
+    def annotate(self, **attrs):
+        trace = current_trace.get()
+        if trace is not None:
+            trace.update(attrs)
+
+    @contextlib.contextmanager
+    def span(self, name, **attrs):
+        start = time.perf_counter()
+        error = None
+        try:
+            yield
+        except BaseException as e:
+            error = type(e).__name__
+            raise
+        finally:
+            attrs = dict(current_trace.get() or {}, **attrs)
+            if error is not None:
+                attrs["error"] = error
+            self.record(name, time.perf_counter() - start, **attrs)
+
+    def record(self, name, seconds, **attrs):
+        '''
+        Records a span that was timed elsewhere, tagged with attrs only (not the current trace).
+        '''
+        if name not in self.durations:
+            self.durations[name] = deque(maxlen=self.window)
+        self.durations[name].append(seconds)
+        self.counts[name] += 1
+        if "error" in attrs:
+            self.errors[name] += 1
+        if self.export_file is not None:
+            self.export_file.write(json.dumps(dict(ts=round(time.time(), 3), span=name, ms=round(seconds * 1000, 2), **attrs), default=str) + "\n")
+
+    def stats(self):
+        out = {}
+        for name, durations in self.durations.items():
+            values = sorted(durations)
+            n = len(values)
+            out[name] = {
+                "count": self.counts[name],
+                "errors": self.errors[name],
+                "p50_ms": round(1000 * values[n // 2], 1),
+                "p95_ms": round(1000 * values[min(n - 1, int(n * 0.95))], 1),
+                "p99_ms": round(1000 * values[min(n - 1, int(n * 0.99))], 1),
+                "max_ms": round(1000 * values[-1], 1),
+            }
+        return out
+
+    def summary(self):
+        stats = self.stats()
+        if not stats:
+            return "No spans recorded yet."
+        out = "```"
+        out += f"{'stage':<24}{'count':>7}{'errors':>7}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}\n"
+        for name, s in stats.items():
+            out += f"{name:<24}{s['count']:>7}{s['errors']:>7}{s['p50_ms']:>9}{s['p95_ms']:>9}{s['p99_ms']:>9}{s['max_ms']:>9}\n"
+        out += f"(percentiles over the last {self.window} spans of each stage)\n"
+        out += "```"
+        return out
+
+
+# shared by bot.py and LLM/LLM_reports.py
+tracer = Tracer()
@@ -0,0 +1,126 @@
+"""
+This file trains the pre-screen's hashed n-gram linear model (see prescreen.py) offline, using the
+BERT classifier's own predictions in classifier_gcp/*_preds.csv as labels, and reports how well
+the whole pre-screen (rules + model) keeps the messages BERT would flag.
+
+Usage, from the DiscordBot folder:
+    python train_prescreen.py [--train ../classifier_gcp/val2_preds.csv] [--eval ../classifier_gcp/test2_preds.csv]
+"""
+import argparse
+import csv
+import math
+import random
+
+from prescreen import LinearModel, PreScreen, hashed_features, tokenize, sigmoid
+
+# the eval set is plain statements, which never hit the command rule. these chat-style prefixes
+# check that it doesn't skip real messages that happen to start with punctuation
+CHAT_PREFIXES = ["$TSLA ", "> ", "?", "...", "!!! ", "@everyone "]
+
+
+def load_rows(path):
+    with open(path, newline="") as f:
+        return [(row["statement"], 1 if row["prediction"] == "misinfo" else 0) for row in csv.DictReader(f)]
+
+def featurize(rows, num_buckets, ngram):
+    out = []
+    for text, label in rows:
+        features = hashed_features(tokenize(text), num_buckets, ngram)
+        norm = math.sqrt(sum(v * v for v in features.values())) or 1.0
+        out.append(({b: v / norm for b, v in features.items()}, label))
+    return out
+
+def train(examples, num_buckets, epochs, lr, l2, seed):
+    # plain SGD logistic regression, the data is small enough that this takes seconds
+    rng = random.Random(seed)
+    weights = [0.0] * num_buckets
+    bias = 0.0
+    examples = list(examples)
+    for epoch in range(epochs):
+        rng.shuffle(examples)
+        step = lr / (1 + epoch)
+        for features, label in examples:
+            p = sigmoid(bias + sum(weights[b] * v for b, v in features.items()))
+            g = p - label
+            bias -= step * g
+            for b, v in features.items():
+                weights[b] -= step * (g * v + l2 * weights[b])
+    return weights, bias
+
+def score(weights, bias, features):
+    return sigmoid(bias + sum(weights[b] * v for b, v in features.items()))
+
+def pick_threshold(scores_labels, target_recall):
+    # the highest threshold that still keeps target_recall of the positives above it
+    positives = sorted(s for s, label in scores_labels if label == 1)
+    if not positives:
+        return 0.0
+    allowed_misses = int(math.floor((1 - target_recall) * len(positives)))
+    return positives[allowed_misses]
+
+def evaluate(prescreen, rows):
+    flagged = sum(label for _, label in rows)
+    kept_flagged = 0
+    for text, label in rows:
+        if not prescreen.should_skip(text) and label == 1:
+            kept_flagged += 1
+    recall = kept_flagged / flagged if flagged else 1.0
+    return recall, prescreen.skipped_fraction()
+
+def chat_prefixed(rows):
+    return [(prefix + text, label) for text, label in rows if label == 1 for prefix in CHAT_PREFIXES]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the pre-screen linear model on the classifier's predictions.")
+    parser.add_argument("--train", default="../classifier_gcp/val2_preds.csv")
+    parser.add_argument("--eval", default="../classifier_gcp/test2_preds.csv")
+    parser.add_argument("--output", default="prescreen_model.json")
+    parser.add_argument("--target-recall", type=float, default=0.99, help="fraction of BERT-flagged messages the pre-screen must let through")
+    parser.add_argument("--buckets", type=int, default=4096)
+    parser.add_argument("--ngram", type=int, default=2)
+    parser.add_argument("--epochs", type=int, default=20)
+    parser.add_argument("--lr", type=float, default=0.5)
+    parser.add_argument("--l2", type=float, default=1e-4)
+    parser.add_argument("--folds", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=152)
+    args = parser.parse_args()
+
+    train_rows = load_rows(args.train)
+    eval_rows = load_rows(args.eval)
+    examples = featurize(train_rows, args.buckets, args.ngram)
+
+    # pick the threshold on out-of-fold scores, in-sample scores would make it too aggressive
+    order = list(range(len(examples)))
+    random.Random(args.seed).shuffle(order)
+    oof = []
+    for k in range(args.folds):
+        held_out = set(order[k::args.folds])
+        weights, bias = train([e for i, e in enumerate(examples) if i not in held_out], args.buckets, args.epochs, args.lr, args.l2, args.seed)
+        oof += [(score(weights, bias, examples[i][0]), examples[i][1]) for i in held_out]
+    threshold = pick_threshold(oof, args.target_recall)
+
+    weights, bias = train(examples, args.buckets, args.epochs, args.lr, args.l2, args.seed)
+    model = LinearModel(weights, bias, args.buckets, args.ngram, threshold)
+
+    prescreen = PreScreen()
+    prescreen.model = model
+    recall, skipped = evaluate(prescreen, eval_rows)
+    print(f"threshold: {threshold:.4f} (target recall {args.target_recall})")
+    print(f"{args.eval}: recall vs BERT labels {recall:.4f}, skipped {100 * skipped:.1f}% of messages")
+    for reason, count in prescreen.skipped.most_common():
+        print(f"  {reason:<18} {count}")
+
+    chat_prescreen = PreScreen()
+    chat_prescreen.model = model
+    chat_recall, _ = evaluate(chat_prescreen, chat_prefixed(eval_rows))
+    print(f"same flagged statements with chat prefixes {CHAT_PREFIXES}: recall {chat_recall:.4f}")
+    for reason, count in chat_prescreen.skipped.most_common():
+        print(f"  {reason:<18} {count}")
+
+    model.save(args.output, trained_on=args.train, eval_recall=round(recall, 4), eval_skipped=round(skipped, 4), eval_chat_recall=round(chat_recall, 4))
+    print(f"Saved pre-screen model to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
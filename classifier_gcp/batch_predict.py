@@ -1,108 +1,372 @@
-import torch
-import torch.nn as nn
+"""
+This file runs the classifier over a LIAR tsv and saves the predictions (test2_preds.csv etc).
+
+The whole statement column is tokenized at once with the fast tokenizer, then the rows are sorted
+by token length and run in batches, so each batch is only padded to the longest row in it
+instead of every row being a batch of one. The predictions are put back in the original row order.
+
+With --chunk-size the input is streamed instead: it's read, predicted and written chunk by chunk
+(as CSV, or Parquet if the output ends in .parquet), so memory doesn't grow with the corpus. After
+every chunk a checkpoint (<output>.checkpoint.json) records how far we got, and running the same
+command again after a crash carries on from there. In this mode the input columns are copied
+through as text.
+
+With --workers N the batches are spread over N processes, each with its own copy of the engine
+(the safetensors file is memory-mapped, so the weights are shared through the page cache) and
+--threads torch threads, pinned to their own cores when there are enough of them. The results go
+back to their row, so the output is the same whatever the split.
+
+With --token-cache the tokenized statements come from a memory-mapped cache built by token_cache.py
+(built here on first use), and batches are read straight out of it. With --workers each process
+maps the cache itself, so only the batch boundaries are sent to it.
+
+Usage:
+    python batch_predict.py [--input ../../LIAR-PLUS-master/dataset/tsv/test2.tsv] [--output test2_preds.csv] [--batch-size 32]
+    python batch_predict.py --input big.tsv --output big_preds.parquet --chunk-size 5000
+    python batch_predict.py --workers 4 --threads 2
+    python batch_predict.py --token-cache --batch-size 64
+
+The raw logits and P(misinfo) are also saved next to the output (<output>_probs.npz, not in
+streaming mode), for sweep_thresholds.py.
+"""
+import argparse
+import json
+import multiprocessing
+import queue
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import shutil
+import time
+from collections import deque
 import pandas as pd
 import numpy as np
-from transformers import BertTokenizer, BertConfig
-from transformers.modeling_outputs import SequenceClassifierOutput
-from transformers import BertPreTrainedModel, BertModel
+from transformers import BertTokenizerFast
 from tqdm import tqdm
 import os
-import safetensors.torch as st
-
-# Model definition (copied from main.py)
-class SmallerBERTClassifier(BertPreTrainedModel):
-    def __init__(self, config):
-        super().__init__(config)
-        self.bert = BertModel(config)
-        self.dropout = nn.Dropout(0.4)
-        self.classifier = nn.Sequential(
-            nn.Linear(config.hidden_size, 128),
-            nn.ReLU(),
-            nn.Dropout(0.3),
-            nn.Linear(128, config.num_labels)
-        )
-
-    def forward(self, input_ids=None, attention_mask=None, token_type_ids=None, labels=None):
-        outputs = self.bert(input_ids=input_ids, attention_mask=attention_mask, token_type_ids=token_type_ids)
-        pooled = self.dropout(outputs.pooler_output)
-        logits = self.classifier(pooled)
-        return SequenceClassifierOutput(
-            loss=None,
-            logits=logits,
-            hidden_states=outputs.hidden_states,
-            attentions=outputs.attentions
-        )
+from classifier_model import load_model, MODEL_DIR
+from engines import TorchEngine, OnnxEngine, softmax
+from token_cache import TokenCache, tokenize_all, open_for_batch_predict, CACHE_ROOT
 
 # Paths
-MODEL_DIR = os.path.join(os.path.dirname(__file__), "saved_liar_bert_model")
-WEIGHTS_PATH = os.path.join(MODEL_DIR, "model.safetensors")
 TSV_PATH = "../../LIAR-PLUS-master/dataset/tsv/test2.tsv"
 OUTPUT_CSV = "test2_preds.csv"
+# batches handed to the pool per worker before waiting for one to come back
+IN_FLIGHT_PER_WORKER = 4
+
+
+def as_text(value):
+    # Ensure it's a string and handle NaN
+    if isinstance(value, str):
+        return value
+    return "" if pd.isna(value) else str(value)
+
+def make_batches(tokenizer, encodings, batch_size):
+    input_ids = encodings["input_ids"]
+    lengths = np.array([len(ids) for ids in input_ids])
+    # sorting by length puts rows of similar length in the same batch, so there's little padding
+    order = np.argsort(lengths, kind="stable")
+    for start in range(0, len(order), batch_size):
+        rows = order[start:start + batch_size]
+        batch = tokenizer.pad({key: [encodings[key][i] for i in rows] for key in encodings.keys()}, padding=True, return_tensors="np")
+        yield rows, dict(batch)
+
+def run_batches(engine, batches):
+    for rows, batch in batches:
+        yield rows, engine.logits(batch)
+
+def predict_logits(engine, batches, num_rows, batch_size, progress=True):
+    '''
+    Returns the [not misinfo, misinfo] logits for every row, in the original row order.
+    batches yields (row numbers, padded arrays), engine is an engine from engines.py or a
+    ShardedPredictor.
+    '''
+    logits = np.zeros((num_rows, 2), dtype=np.float32)
+    if isinstance(engine, ShardedPredictor):
+        results = engine.run_batches(batches)
+    else:
+        results = run_batches(engine, batches)
+    for rows, batch_logits in tqdm(results, total=-(-num_rows // batch_size), disable=not progress):
+        logits[rows] = batch_logits
+    return logits
+
+
+def load_engine(args, threads):
+    if args.engine == "onnx":
+        return OnnxEngine(args.onnx_path, num_threads=threads)
+    return TorchEngine(load_model(args.weights_dir), num_threads=threads)
 
-# Load tokenizer and model
-tokenizer = BertTokenizer.from_pretrained(MODEL_DIR)
-config = BertConfig.from_pretrained(MODEL_DIR)
-model = SmallerBERTClassifier(config)
-
-# Load weights from safetensors
-state_dict = st.load_file(WEIGHTS_PATH)
-model.load_state_dict(state_dict)
-model.eval()
-
-# Load dataset
-df = pd.read_csv(TSV_PATH, sep='\t', header=None)
-df.columns = [f"col{i}" for i in range(len(df.columns))]
-# If justification is the last column, rename for clarity
-df = df.rename(columns={"col3": "statement", "col15": "justification"})
-
-predictions = []
-confidences = []
-misinfo_probs = []
-
-for idx, row in tqdm(df.iterrows(), total=len(df)):
-    # if idx >= 1500:
-    #     break
-    statement = row.get("statement", "")
-    # justification = row.get("justification", "")
-    justification = ""
-
-    # Ensure both are strings and handle NaN
-    if not isinstance(statement, str):
-        statement = "" if pd.isna(statement) else str(statement)
-    if not isinstance(justification, str):
-        justification = "" if pd.isna(justification) else str(justification)
-
-    # Tokenize as in main.py
-    inputs = tokenizer(
-        statement,
-        justification,
-        return_tensors="pt",
-        truncation=True,
-        padding=True,
-        max_length=256
-    )
-
-    with torch.no_grad():
-        outputs = model(**inputs)
-        probs = torch.softmax(outputs.logits, dim=1).squeeze()
-        # Lower the threshold for "misinfo" to prioritize recall
-        threshold = 0.35  # adjust this value as needed
-        if probs[1] >= threshold:
-            prediction = 1
+class CachedSlice:
+    # a batch as a range of a token cache, which the worker reads from its own memory map
+    def __init__(self, directory, start, end):
+        self.directory = directory
+        self.start = start
+        self.end = end
+
+# set in each worker process by init_worker
+worker_engine = None
+worker_caches = {} # directory -> TokenCache
+
+def init_worker(args, threads, core_sets):
+    global worker_engine
+    try:
+        cores = core_sets.get(timeout=10)
+    except queue.Empty:
+        # there's one set per worker, so this shouldn't happen, but an unpinned worker beats a hung one
+        cores = None
+    if cores and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+    worker_engine = load_engine(args, threads)
+
+def run_worker_batch(job):
+    if isinstance(job, CachedSlice):
+        if job.directory not in worker_caches:
+            worker_caches[job.directory] = TokenCache(job.directory)
+        rows, batch = worker_caches[job.directory].batch(job.start, job.end)
+    else:
+        rows, batch = job
+    return rows, worker_engine.logits(batch)
+
+
+class ShardedPredictor:
+    def __init__(self, args, workers, threads):
+        self.workers = workers
+        self.threads = threads
+        # spawn, so every worker starts with fresh torch/onnx thread pools
+        ctx = multiprocessing.get_context("spawn")
+        cores = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else []
+        core_sets = ctx.Queue()
+        for i in range(workers):
+            # only pin when every worker can get its own cores, otherwise let the OS place them
+            core_sets.put(cores[i * threads:(i + 1) * threads] if len(cores) >= workers * threads else None)
+        # unlike multiprocessing.Pool, the executor notices a worker dying (OOM kill, a crash in torch)
+        # and fails every pending batch with BrokenProcessPool instead of waiting for it forever
+        self.pool = ProcessPoolExecutor(workers, mp_context=ctx, initializer=init_worker, initargs=(args, threads, core_sets))
+
+    def run_batches(self, batches):
+        # a few batches in flight per worker is enough to keep them all busy. the rest of the
+        # generator isn't read until one comes back (imap would tokenize and queue all of them)
+        pending = deque()
+        try:
+            for job in batches:
+                pending.append(self.pool.submit(run_worker_batch, job))
+                if len(pending) >= self.workers * IN_FLIGHT_PER_WORKER:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        except BrokenProcessPool:
+            raise SystemExit("a worker process died mid-batch (killed for running out of memory?). "
+                             "with --chunk-size, running the same command again resumes from the last checkpoint")
+
+    def close(self):
+        self.pool.shutdown(wait=True, cancel_futures=True)
+
+
+def add_predictions(df, engine, tokenizer, args, progress=True, cache=None):
+    if cache is not None:
+        if len(cache) != len(df):
+            raise SystemExit(f"{cache.directory} has {len(cache)} rows but the input has {len(df)}, delete it to rebuild")
+        bounds = cache.batch_bounds(args.batch_size)
+        if isinstance(engine, ShardedPredictor):
+            batches = (CachedSlice(cache.directory, start, end) for start, end in bounds)
         else:
-            prediction = 0
-        confidence = probs[prediction].item()
-        misinfo_prob = probs[1].item() # equals confidence if prediction == 1 otherwise equals 1 - confidence
+            batches = (cache.batch(start, end) for start, end in bounds)
+    else:
+        statements = [as_text(s) for s in df["statement"]]
+        # justifications = [as_text(j) for j in df["justification"]]
+        justifications = [""] * len(statements)
+
+        encodings = tokenize_all(tokenizer, statements, justifications, args.max_length)
+        batches = make_batches(tokenizer, encodings, args.batch_size)
+    logits = predict_logits(engine, batches, len(df), args.batch_size, progress)
+    probs = softmax(logits)
+
+    predictions = (probs[:, 1] >= args.threshold).astype(int)
+    confidences = probs[np.arange(len(probs)), predictions] # probability of the predicted class
+    misinfo_probs = probs[:, 1] # equals confidence if prediction == 1 otherwise equals 1 - confidence
+
+    df["prediction"] = ["misinfo" if p == 1 else "not misinfo" for p in predictions]
+    df["confidence_score"] = [round(float(c), 4) for c in confidences]
+    df["misinfo_prob"] = [round(float(m), 4) for m in misinfo_probs]
+    return df, logits
+
+def name_columns(df):
+    df.columns = [f"col{i}" for i in range(len(df.columns))]
+    # If justification is the last column, rename for clarity
+    return df.rename(columns={"col3": "statement", "col15": "justification"})
+
+
+class CsvOutput:
+    def __init__(self, path, resume_bytes=None):
+        self.path = path
+        if resume_bytes is None:
+            self.file = open(path, "w", newline="")
+        else:
+            if not os.path.isfile(path) or os.path.getsize(path) < resume_bytes:
+                raise SystemExit(f"{path} is missing or shorter than its checkpoint ({resume_bytes} bytes), use --restart to start over")
+            # drop anything written after the last checkpoint, that chunk gets predicted again
+            self.file = open(path, "r+", newline="")
+            self.file.truncate(resume_bytes)
+            self.file.seek(resume_bytes)
+
+    def write(self, df, chunk_index):
+        df.to_csv(self.file, header=self.file.tell() == 0, index=False)
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def state(self):
+        return {"output_bytes": self.file.tell()}
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetOutput:
+    '''
+    Parquet files can't be appended to, so each chunk is written as its own part file and the
+    parts are merged into the output (one row group each) once every chunk is done.
+    '''
+    def __init__(self, path, resume_bytes=None):
+        self.path = path
+        self.parts_dir = path + ".parts"
+        if resume_bytes is None:
+            shutil.rmtree(self.parts_dir, ignore_errors=True)
+        elif not os.path.isdir(self.parts_dir):
+            raise SystemExit(f"{self.parts_dir} is missing but there's a checkpoint for it, use --restart to start over")
+        os.makedirs(self.parts_dir, exist_ok=True)
+
+    def write(self, df, chunk_index):
+        part = os.path.join(self.parts_dir, f"part-{chunk_index:06d}.parquet")
+        df.to_parquet(part + ".tmp", index=False)
+        os.replace(part + ".tmp", part)
+
+    def state(self):
+        return {}
+
+    def close(self):
+        import pyarrow.parquet as pq
+
+        parts = sorted(p for p in os.listdir(self.parts_dir) if p.endswith(".parquet"))
+        writer = None
+        for part in parts:
+            table = pq.read_table(os.path.join(self.parts_dir, part))
+            if writer is None:
+                writer = pq.ParquetWriter(self.path, table.schema)
+            writer.write_table(table)
+        if writer is not None:
+            writer.close()
+        shutil.rmtree(self.parts_dir)
+
+
+def run_settings(args):
+    # a checkpoint is only resumed by a run that would produce the same output
+    stat = os.stat(args.input)
+    return {"input": os.path.abspath(args.input), "input_size": stat.st_size, "input_mtime": stat.st_mtime,
+            "chunk_size": args.chunk_size, "engine": args.engine, "max_length": args.max_length, "threshold": args.threshold}
+
+def load_checkpoint(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def save_checkpoint(path, checkpoint):
+    with open(path + ".tmp", "w") as f:
+        json.dump(checkpoint, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + ".tmp", path)
+
+def stream(engine, tokenizer, args):
+    checkpoint_path = args.output + ".checkpoint.json"
+    settings = run_settings(args)
+    checkpoint = None if args.restart else load_checkpoint(checkpoint_path)
+    if checkpoint is not None and checkpoint["settings"] != settings:
+        raise SystemExit(f"{checkpoint_path} is from a run with different input or settings, use --restart to start over")
+
+    chunks_done = checkpoint["chunks_done"] if checkpoint else 0
+    rows_done = checkpoint["rows_done"] if checkpoint else 0
+    output_class = ParquetOutput if args.output.endswith(".parquet") else CsvOutput
+    output = output_class(args.output, checkpoint.get("output_bytes", 0) if checkpoint else None)
+    if checkpoint:
+        print(f"Resuming after {rows_done} rows ({chunks_done} chunks)")
+
+    reader = pd.read_csv(args.input, sep='\t', header=None, dtype=str, keep_default_na=False, chunksize=args.chunk_size)
+    start = time.perf_counter()
+    rows_this_run = 0
+    for chunk_index, chunk in enumerate(reader):
+        if chunk_index < chunks_done:
+            continue # already written before the restart
+        df, _ = add_predictions(name_columns(chunk), engine, tokenizer, args, progress=False)
+        output.write(df, chunk_index)
+        rows_done += len(df)
+        rows_this_run += len(df)
+        save_checkpoint(checkpoint_path, {"settings": settings, "chunks_done": chunk_index + 1, "rows_done": rows_done, **output.state()})
+        print(f"chunk {chunk_index}: {rows_done} rows done ({rows_this_run / (time.perf_counter() - start):.1f} rows/sec)")
+
+    output.close()
+    os.remove(checkpoint_path)
+    print(f"Saved predictions for {rows_done} rows to {args.output}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the classifier over a LIAR tsv and save the predictions.")
+    parser.add_argument("--input", default=TSV_PATH)
+    parser.add_argument("--output", default=OUTPUT_CSV, help="a .csv or .parquet file")
+    parser.add_argument("--engine", choices=["torch", "onnx"], default="torch")
+    parser.add_argument("--weights-dir", default=MODEL_DIR, help="folder with model.safetensors")
+    parser.add_argument("--onnx-path", default=os.path.join(os.path.dirname(__file__), "classifier.onnx"), help="model exported with export_onnx.py")
+    parser.add_argument("--workers", type=int, default=1, help="processes to spread the batches over")
+    parser.add_argument("--threads", type=int, default=0, help="intra-op threads per process, 0 = library default (cores / workers with --workers)")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--max-length", type=int, default=256)
+    # Lower the threshold for "misinfo" to prioritize recall
+    parser.add_argument("--threshold", type=float, default=0.35)
+    parser.add_argument("--chunk-size", type=int, default=0, help="stream the input this many rows at a time, with checkpoints (0 = load it all at once)")
+    parser.add_argument("--restart", action="store_true", help="ignore an existing checkpoint and start from the first row")
+    parser.add_argument("--probs-output", help="where to save the raw logits/probabilities for sweep_thresholds.py (default: <output>_probs.npz)")
+    parser.add_argument("--token-cache", action="store_true", help="read pre-tokenized batches from a token cache (built on first use)")
+    parser.add_argument("--cache-root", default=CACHE_ROOT)
+    args = parser.parse_args()
+
+    # Load tokenizer and model
+    tokenizer = BertTokenizerFast.from_pretrained(MODEL_DIR)
+    if args.workers > 1:
+        threads = args.threads or max(1, (os.cpu_count() or 1) // args.workers)
+        engine = ShardedPredictor(args, args.workers, threads)
+        print(f"Running {args.workers} workers x {threads} threads")
+    else:
+        engine = load_engine(args, args.threads)
+
+    try:
+        if args.chunk_size:
+            if args.token_cache:
+                raise SystemExit("--token-cache is for repeated runs over the whole input, it can't be combined with --chunk-size")
+            stream(engine, tokenizer, args)
+            return
+
+        # Load dataset
+        df = name_columns(pd.read_csv(args.input, sep='\t', header=None))
+        cache = open_for_batch_predict(args.input, tokenizer, args.max_length, args.cache_root) if args.token_cache else None
+        start = time.perf_counter()
+        df, logits = add_predictions(df, engine, tokenizer, args, cache=cache)
+        elapsed = time.perf_counter() - start
+        print(f"Predicted {len(df)} rows in {elapsed:.1f}s ({len(df) / elapsed:.1f} rows/sec)")
+    finally:
+        if isinstance(engine, ShardedPredictor):
+            engine.close()
 
-    predictions.append("misinfo" if prediction == 1 else "not misinfo")
-    confidences.append(round(confidence, 4))
-    misinfo_probs.append(round(misinfo_prob, 4))
+    if args.output.endswith(".parquet"):
+        df.to_parquet(args.output, index=False)
+    else:
+        df.to_csv(args.output, index=False)
+    print(f"Saved predictions to {args.output}")
 
-# df = df.iloc[:1500].copy()
+    # full precision, so other thresholds can be evaluated without running the model again
+    probs_output = args.probs_output or os.path.splitext(args.output)[0] + "_probs.npz"
+    np.savez(probs_output, logits=logits, misinfo_prob=softmax(logits)[:, 1], label=df["col2"].astype(str).to_numpy(dtype=str))
+    print(f"Saved logits and probabilities to {probs_output}")
 
-df["prediction"] = predictions
-df["confidence_score"] = confidences
-df["misinfo_prob"] = misinfo_probs
 
-df.to_csv(OUTPUT_CSV, index=False)
-print(f"Saved predictions to {OUTPUT_CSV}")
\ No newline at end of file
+if __name__ == "__main__":
+    main()
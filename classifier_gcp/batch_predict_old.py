@@ -1,9 +1,13 @@
 import torch
 import torch.nn.functional as F
 import pandas as pd
+import numpy as np
 from pytorch_pretrained_bert import BertTokenizer, BertConfig
 from model import BertForSequenceClassification
 from tqdm import tqdm
+from token_cache import TokenCache, cache_dir_for
+
+TSV_PATH = "../../LIAR-PLUS-master/dataset/tsv/train2.tsv"
 
 # Load tokenizer and model config
 tokenizer = BertTokenizer.from_pretrained('bert-base-uncased')
@@ -15,47 +19,60 @@ model = BertForSequenceClassification(num_labels=2)
 model.load_state_dict(torch.load("bert_model_finetuned.pth", map_location=torch.device('cpu')))
 model.eval()
 
-def preprocess(text, max_len):
+def token_ids(text, max_len):
     if not isinstance(text, str):
         text = "" if pd.isna(text) else str(text)
     tokens = tokenizer.tokenize(text if text else "None")
     tokens = tokens[:max_len]
-    token_ids = tokenizer.convert_tokens_to_ids(tokens)
-    padded = token_ids + [0] * (max_len - len(token_ids))
+    return tokenizer.convert_tokens_to_ids(tokens)
+
+def preprocess(text, max_len):
+    ids = token_ids(text, max_len)
+    padded = ids + [0] * (max_len - len(ids))
     return torch.tensor(padded).unsqueeze(0)  # shape: (1, max_len)
 
 # Load dataset
-df = pd.read_csv("../../LIAR-PLUS-master/dataset/tsv/train2.tsv", sep='\t')
+df = pd.read_csv(TSV_PATH, sep='\t')
 
 df.columns = [f"col{i}" for i in range(len(df.columns))]
 df = df.rename(columns={"col3": "statement", "col15": "justification"})
 df = df.iloc[:1000].reset_index(drop=True)
 
-predictions = []
-confidences = []
+BATCH_SIZE = 32
+STATEMENT_LEN = 64
+
+# the statements are tokenized once into a memory-mapped cache (see token_cache.py), zero padded
+# to STATEMENT_LEN like preprocess() does, and later runs read the batches straight from it
+cache = TokenCache.open_or_build(
+    cache_dir_for(TSV_PATH, tokenizer, STATEMENT_LEN, f"old-statement-first{len(df)}"),
+    lambda: list(df["statement"]),
+    lambda statements: {"input_ids": [token_ids(s, STATEMENT_LEN) for s in statements]},
+    STATEMENT_LEN,
+    {"scheme": "old-statement", "vocab_size": len(tokenizer.vocab)},
+)
 
-for idx, row in tqdm(df.iterrows(), total=len(df)):
-    if idx >= 1000:
-        break
-    statement = row.get("statement", "")
-    # justification = row.get("justification", "")
-    justification = ""
-    metadata = ""
-    credit = 0.5
+# justification = row.get("justification", "")
+justification = ""
+metadata = ""
+credit = 0.5
+# these are the same for every row, so they're built once and repeated for each batch
+input_ids2 = preprocess(justification, max_len=256)
+input_ids3 = preprocess(metadata, max_len=32)
+credit_tensor = torch.tensor([credit] * 2304).unsqueeze(0)  # shape (1, 2304)
 
-    input_ids1 = preprocess(statement, max_len=64)
-    input_ids2 = preprocess(justification, max_len=256)
-    input_ids3 = preprocess(metadata, max_len=32)
-    credit_tensor = torch.tensor([credit] * 2304).unsqueeze(0)  # shape (1, 2304)
+misinfo_probs = np.zeros(len(df))
+for start, end in tqdm(cache.batch_bounds(BATCH_SIZE)):
+    rows, batch = cache.batch(start, end, trim=False)
+    n = len(rows)
+    input_ids1 = torch.from_numpy(batch["input_ids"].astype(np.int64))
 
     with torch.no_grad():
-        logits = model(input_ids1, input_ids2, input_ids3, credit_tensor)
+        logits = model(input_ids1, input_ids2.expand(n, -1), input_ids3.expand(n, -1), credit_tensor.expand(n, -1))
         probs = F.softmax(logits, dim=1)
-        confidence = probs[0][1].item()
-        prediction = "misinfo" if confidence > 0.5 else "not misinfo"
+    misinfo_probs[rows] = probs[:, 1].numpy()
 
-    predictions.append(prediction)
-    confidences.append(round(confidence, 4))
+predictions = ["misinfo" if confidence > 0.5 else "not misinfo" for confidence in misinfo_probs]
+confidences = [round(float(confidence), 4) for confidence in misinfo_probs]
 
 df["prediction"] = predictions
 df["confidence_score"] = confidences
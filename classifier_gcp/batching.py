@@ -0,0 +1,129 @@
+"""
+This file implements a dynamic micro-batching scheduler for the classifier.
+Concurrent requests are collected for up to max_wait_ms (or until max_batch_size
+items are waiting), run through the model in one forward pass, and the results
+are handed back to each waiting request.
+"""
+import os
+import queue
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import Future
+
+
+class MicroBatcher:
+    def __init__(self, run_batch, max_batch_size=16, max_wait_ms=10.0, stats_window=1000, on_batch=None):
+        # run_batch takes a list of items and returns a list of results in the same order
+        self.run_batch = run_batch
+        # called after every batch with its size and how long each item waited in the queue (seconds)
+        self.on_batch = on_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.worker = None
+        self.worker_pid = None
+
+        # stats
+        self.batch_sizes = Counter()
+        self.num_batches = 0
+        self.num_items = 0
+        self.queue_delays = deque(maxlen=stats_window)
+        self.batch_times = deque(maxlen=stats_window)
+
+    def _ensure_worker(self):
+        # started lazily (and restarted after a fork) since threads don't survive fork()
+        if self.worker is not None and self.worker_pid == os.getpid() and self.worker.is_alive():
+            return
+        with self.lock:
+            if self.worker is None or self.worker_pid != os.getpid() or not self.worker.is_alive():
+                if self.worker_pid != os.getpid():
+                    self.queue = queue.Queue()
+                self.worker = threading.Thread(target=self._loop, name="micro-batcher", daemon=True)
+                self.worker_pid = os.getpid()
+                self.worker.start()
+
+    def submit_many(self, items, timeout=None):
+        '''
+        Queue items for the next batches and block until all of their results are ready.
+        '''
+        self._ensure_worker()
+        futures = []
+        now = time.perf_counter()
+        for item in items:
+            future = Future()
+            self.queue.put((item, future, now))
+            futures.append(future)
+        return [f.result(timeout=timeout) for f in futures]
+
+    def submit(self, item, timeout=None):
+        return self.submit_many([item], timeout=timeout)[0]
+
+    def _collect(self):
+        # block for the first item, then keep collecting until the batch is full or the wait is over
+        batch = [self.queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _loop(self):
+        while True:
+            batch = self._collect()
+            start = time.perf_counter()
+            items = [item for item, _, _ in batch]
+            try:
+                results = self.run_batch(items)
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+            end = time.perf_counter()
+
+            for (_, future, _), result in zip(batch, results):
+                future.set_result(result)
+
+            with self.lock:
+                self.num_batches += 1
+                self.num_items += len(batch)
+                self.batch_sizes[len(batch)] += 1
+                self.batch_times.append(end - start)
+                for _, _, enqueued in batch:
+                    self.queue_delays.append(start - enqueued)
+            if self.on_batch is not None:
+                self.on_batch(len(batch), [start - enqueued for _, _, enqueued in batch])
+
+    def stats(self):
+        with self.lock:
+            delays = sorted(self.queue_delays)
+            times = sorted(self.batch_times)
+            return {
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000.0,
+                "num_batches": self.num_batches,
+                "num_items": self.num_items,
+                "mean_batch_size": round(self.num_items / self.num_batches, 3) if self.num_batches else 0.0,
+                "batch_size_histogram": {str(k): v for k, v in sorted(self.batch_sizes.items())},
+                "queue_delay_ms": _summary_ms(delays),
+                "batch_time_ms": _summary_ms(times),
+                "queue_depth": self.queue.qsize(),
+            }
+
+
+def _summary_ms(sorted_values):
+    if not sorted_values:
+        return {"mean": 0.0, "p50": 0.0, "p95": 0.0, "max": 0.0}
+    n = len(sorted_values)
+    return {
+        "mean": round(1000.0 * sum(sorted_values) / n, 3),
+        "p50": round(1000.0 * sorted_values[n // 2], 3),
+        "p95": round(1000.0 * sorted_values[min(n - 1, int(n * 0.95))], 3),
+        "max": round(1000.0 * sorted_values[-1], 3),
+    }
@@ -0,0 +1,117 @@
+"""
+This file benchmarks the gunicorn setup (gunicorn.conf.py) with different worker/thread splits,
+so we can pick the one that fits the machine. For each config it starts gunicorn, waits for
+/readyz, sends --requests distinct statements from test2_preds.csv to /classify from --concurrency
+client threads, and reports throughput and latency percentiles. The prediction cache is turned
+off so every request runs the model.
+
+Usage:
+    python bench_workers.py --configs 1x4 2x2 4x1 [--requests 400] [--concurrency 16] [--json out.json]
+where each config is WORKERSxTHREADS (torch threads per worker).
+"""
+import argparse
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def wait_until_ready(url, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(url + "/readyz", timeout=2) as response:
+                if response.status == 200:
+                    return True
+        except (urllib.error.URLError, OSError):
+            pass
+        time.sleep(0.5)
+    return False
+
+def post(url, statement):
+    body = json.dumps({"message": statement}).encode("utf-8")
+    request = urllib.request.Request(url + "/classify", data=body, headers={"Content-Type": "application/json"})
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=60) as response:
+            response.read()
+            ok = response.status == 200
+    except (urllib.error.URLError, OSError):
+        ok = False
+    return (time.perf_counter() - start) * 1000, ok
+
+def run_load(url, statements, concurrency):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        results = list(pool.map(lambda s: post(url, s), statements))
+    elapsed = time.perf_counter() - start
+    latencies = np.array([ms for ms, ok in results if ok])
+    errors = sum(1 for _, ok in results if not ok)
+    return {
+        "requests_per_sec": round(len(statements) / elapsed, 2),
+        "p50_ms": round(float(np.percentile(latencies, 50)), 1) if len(latencies) else None,
+        "p95_ms": round(float(np.percentile(latencies, 95)), 1) if len(latencies) else None,
+        "p99_ms": round(float(np.percentile(latencies, 99)), 1) if len(latencies) else None,
+        "errors": errors,
+    }
+
+def bench_config(config, args, statements):
+    workers, threads = (int(x) for x in config.lower().split("x"))
+    env = dict(os.environ, WORKERS=str(workers), CLASSIFIER_THREADS=str(threads), PORT=str(args.port), PREDICTION_CACHE_SIZE="0")
+    url = f"http://127.0.0.1:{args.port}"
+    server = subprocess.Popen(["gunicorn", "-c", "gunicorn.conf.py", "main:app"], cwd=HERE, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        if not wait_until_ready(url, args.startup_timeout):
+            print(f"{config}: server didn't become ready in {args.startup_timeout}s")
+            return None
+        run_load(url, statements[:args.concurrency * 2], args.concurrency) # warm every worker's threads
+        result = run_load(url, statements[:args.requests], args.concurrency)
+        result.update({"config": config, "workers": workers, "threads_per_worker": threads, "concurrency": args.concurrency})
+        return result
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait(timeout=60)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare gunicorn worker/thread splits for the classifier.")
+    parser.add_argument("--configs", nargs="+", default=["1x4", "2x2", "4x1"], help="WORKERSxTHREADS per run")
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--startup-timeout", type=float, default=300)
+    parser.add_argument("--data", default=os.path.join(HERE, "test2_preds.csv"))
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    statements = [s for s in pd.read_csv(args.data)["statement"].drop_duplicates() if isinstance(s, str)]
+
+    results = []
+    print(f"{'config':<8}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'errors':>8}")
+    for config in args.configs:
+        result = bench_config(config, args, statements)
+        if result is None:
+            continue
+        results.append(result)
+        print(f"{config:<8}{result['requests_per_sec']:>9}{result['p50_ms']:>9}{result['p95_ms']:>9}{result['p99_ms']:>9}{result['errors']:>8}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    if len(results) < len(args.configs):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
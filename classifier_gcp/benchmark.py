@@ -0,0 +1,246 @@
+"""
+This file benchmarks the classifier's latency and throughput and writes the results to a JSON
+file, so a model or serving change can be compared against the last run (--compare).
+
+It sweeps batch size, sequence length, torch/onnx thread count and engine:
+- torch: eager PyTorch, fp32
+- int8: eager PyTorch with the dynamically quantized model (see eval_quantized.py)
+- onnx: the graph exported by export_onnx.py, in ONNX Runtime (skipped if the file isn't there)
+
+in two modes:
+- inprocess: engine.logits() on pre-tokenized inputs, so it's the model alone
+- http: starts the service on localhost (gunicorn, one worker per run so the thread count is the
+  one being measured) and times /classify for batch size 1 and /classify_batch for the others,
+  so it includes tokenization, batching, JSON and HTTP
+
+Inputs are synthetic statements of exactly the given number of tokens, all different within a
+batch (the service would run identical ones once). The prediction cache is turned off for the http
+runs.
+
+Usage:
+    python benchmark.py [--modes inprocess http] [--engines torch int8 onnx] [--batch-sizes 1 8 32]
+                        [--seq-lens 16 64 256] [--threads 1 4] [--output bench.json] [--compare old.json]
+"""
+import argparse
+import json
+import os
+import platform
+import signal
+import subprocess
+import sys
+import time
+import urllib.request
+
+import numpy as np
+import torch
+from transformers import BertTokenizerFast
+
+from classifier_model import load_model, MODEL_DIR
+from engines import TorchEngine, OnnxEngine, quantize_int8
+from bench_workers import wait_until_ready
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+# the metrics where a bigger number is worse, checked by --compare
+LATENCY_METRICS = ["p50_ms", "p95_ms", "p99_ms"]
+
+
+# each of these is a single token
+WORDS = "claim vote tax law state city war job bill plan court jobs health school money police rate price fund trade".split()
+
+def statements_of_length(seq_len, count):
+    '''
+    count different statements of exactly seq_len tokens ([CLS] and [SEP] included). They have to
+    differ: the service answers identical messages in one request with a single prediction.
+    '''
+    words = max(1, seq_len - 2)
+    statements = []
+    for i in range(count):
+        # the first few words spell out i in base len(WORDS), the rest is filler
+        prefix = []
+        n = i
+        while len(prefix) < words:
+            prefix.append(WORDS[n % len(WORDS)])
+            n //= len(WORDS)
+            if n == 0:
+                break
+        statements.append(" ".join(prefix + ["claim"] * (words - len(prefix))))
+    if len(set(statements)) < count:
+        raise ValueError(f"can't make {count} different statements of {seq_len} tokens")
+    return statements
+
+def summarize(latencies_ms, rows_per_call, elapsed):
+    latencies_ms = np.array(latencies_ms)
+    return {
+        "iterations": len(latencies_ms),
+        "mean_ms": round(float(latencies_ms.mean()), 2),
+        "p50_ms": round(float(np.percentile(latencies_ms, 50)), 2),
+        "p95_ms": round(float(np.percentile(latencies_ms, 95)), 2),
+        "p99_ms": round(float(np.percentile(latencies_ms, 99)), 2),
+        "rows_per_sec": round(len(latencies_ms) * rows_per_call / elapsed, 2),
+    }
+
+def time_calls(call, iterations, max_seconds, warmup):
+    for _ in range(warmup):
+        call()
+    latencies = []
+    start = time.perf_counter()
+    # at least 3 calls, then stop at whichever limit comes first
+    while len(latencies) < iterations and (len(latencies) < 3 or time.perf_counter() - start < max_seconds):
+        t0 = time.perf_counter()
+        call()
+        latencies.append((time.perf_counter() - t0) * 1000)
+    return latencies, time.perf_counter() - start
+
+
+def build_engine(name, args):
+    if name == "onnx":
+        return OnnxEngine(args.onnx_path)
+    model = load_model(args.weights_dir)
+    if name == "int8":
+        model = quantize_int8(model)
+    return TorchEngine(model)
+
+def bench_inprocess(args, tokenizer, engines):
+    results = []
+    for engine_name in engines:
+        engine = build_engine(engine_name, args)
+        for threads in args.threads:
+            engine.set_num_threads(threads)
+            for seq_len in args.seq_lens:
+                for batch_size in args.batch_sizes:
+                    inputs = tokenizer(statements_of_length(seq_len, batch_size), truncation=True, max_length=seq_len, return_tensors="np")
+                    latencies, elapsed = time_calls(lambda: engine.logits(inputs), args.iterations, args.max_seconds, args.warmup)
+                    result = {"mode": "inprocess", "engine": engine_name, "threads": threads, "seq_len": seq_len, "batch_size": batch_size}
+                    result.update(summarize(latencies, batch_size, elapsed))
+                    report(result)
+                    results.append(result)
+    return results
+
+def post_json(url, payload):
+    request = urllib.request.Request(url, data=json.dumps(payload).encode("utf-8"), headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(request, timeout=120) as response:
+        response.read()
+
+def bench_http(args, engines):
+    results = []
+    url = f"http://127.0.0.1:{args.port}"
+    for engine_name in engines:
+        for threads in args.threads:
+            env = dict(os.environ, WORKERS="1", CLASSIFIER_THREADS=str(threads), PORT=str(args.port), PREDICTION_CACHE_SIZE="0",
+                       CLASSIFIER_ENGINE="onnx" if engine_name == "onnx" else "torch",
+                       CLASSIFIER_PRECISION="int8" if engine_name == "int8" else "fp32", INT8_EVAL_GATE="0")
+            if engine_name == "onnx":
+                env["ONNX_MODEL_PATH"] = args.onnx_path
+            server = subprocess.Popen(["gunicorn", "-c", "gunicorn.conf.py", "main:app"], cwd=HERE, env=env,
+                                      stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            try:
+                if not wait_until_ready(url, args.startup_timeout):
+                    print(f"http {engine_name}: server didn't become ready in {args.startup_timeout}s, skipping")
+                    continue
+                for seq_len in args.seq_lens:
+                    for batch_size in args.batch_sizes:
+                        statements = statements_of_length(seq_len, batch_size)
+                        if batch_size == 1:
+                            call = lambda: post_json(url + "/classify", {"message": statements[0]})
+                        else:
+                            call = lambda: post_json(url + "/classify_batch", {"messages": statements})
+                        latencies, elapsed = time_calls(call, args.iterations, args.max_seconds, args.warmup)
+                        result = {"mode": "http", "engine": engine_name, "threads": threads, "seq_len": seq_len, "batch_size": batch_size}
+                        result.update(summarize(latencies, batch_size, elapsed))
+                        report(result)
+                        results.append(result)
+            finally:
+                server.send_signal(signal.SIGTERM)
+                server.wait(timeout=60)
+    return results
+
+
+def report(result):
+    print(f"{result['mode']:<10}{result['engine']:<6}{result['threads']:>8}{result['seq_len']:>8}{result['batch_size']:>7}"
+          f"{result['p50_ms']:>10}{result['p95_ms']:>10}{result['p99_ms']:>10}{result['rows_per_sec']:>11}")
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=HERE, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+    try:
+        import onnxruntime
+        ort_version = onnxruntime.__version__
+    except ImportError:
+        ort_version = None
+    return {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+        "onnxruntime": ort_version,
+        "cpus": os.cpu_count(),
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+    }
+
+def key(result):
+    return (result["mode"], result["engine"], result["threads"], result["seq_len"], result["batch_size"])
+
+def compare(results, baseline_path, tolerance):
+    '''
+    Prints every config whose latency got more than tolerance worse than in the baseline file.
+    Returns the number of regressions.
+    '''
+    with open(baseline_path) as f:
+        baseline = {key(r): r for r in json.load(f)["results"]}
+    regressions = 0
+    for result in results:
+        old = baseline.get(key(result))
+        if old is None:
+            continue
+        for metric in LATENCY_METRICS:
+            if old[metric] and result[metric] > old[metric] * (1 + tolerance):
+                regressions += 1
+                print(f"REGRESSION {key(result)} {metric}: {old[metric]} -> {result[metric]} ms")
+    print(f"{regressions} regressions against {baseline_path} (tolerance {tolerance:.0%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark classifier latency and throughput.")
+    parser.add_argument("--modes", nargs="+", choices=["inprocess", "http"], default=["inprocess", "http"])
+    parser.add_argument("--engines", nargs="+", choices=["torch", "int8", "onnx"], default=["torch", "int8", "onnx"])
+    parser.add_argument("--batch-sizes", nargs="+", type=int, default=[1, 8, 32])
+    parser.add_argument("--seq-lens", nargs="+", type=int, default=[16, 64, 256])
+    parser.add_argument("--threads", nargs="+", type=int, default=sorted({1, os.cpu_count() or 1}))
+    parser.add_argument("--iterations", type=int, default=30, help="timed calls per config")
+    parser.add_argument("--max-seconds", type=float, default=10, help="stop timing a config after this long (after at least 3 calls)")
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--weights-dir", default=MODEL_DIR, help="folder with model.safetensors (in-process runs)")
+    parser.add_argument("--onnx-path", default=os.path.join(HERE, "classifier.onnx"))
+    parser.add_argument("--port", type=int, default=8098)
+    parser.add_argument("--startup-timeout", type=float, default=300)
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--compare", help="an earlier --output file to check for latency regressions")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="how much slower counts as a regression")
+    args = parser.parse_args()
+
+    engines = list(args.engines)
+    if "onnx" in engines and not os.path.isfile(args.onnx_path):
+        print(f"{args.onnx_path} not found, skipping the onnx engine (run export_onnx.py first)")
+        engines.remove("onnx")
+
+    print(f"{'mode':<10}{'engine':<6}{'threads':>8}{'seq':>8}{'batch':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'rows/sec':>11}")
+    results = []
+    if "inprocess" in args.modes:
+        results += bench_inprocess(args, BertTokenizerFast.from_pretrained(MODEL_DIR), engines)
+    if "http" in args.modes:
+        results += bench_http(args, engines)
+
+    with open(args.output, "w") as f:
+        json.dump({"environment": environment(), "config": vars(args), "results": results}, f, indent=2)
+    print(f"Saved {len(results)} results to {args.output}")
+
+    if args.compare and compare(results, args.compare, args.tolerance):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""
+This file holds the model definition shared by the Flask server (main.py), the batch predictor
+and the export/evaluation scripts, so there is only one copy of it.
+"""
+from transformers.modeling_outputs import SequenceClassifierOutput
+from transformers import BertPreTrainedModel, BertModel, BertConfig
+import torch.nn as nn
+import os
+
+MODEL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "saved_liar_bert_model")
+
+class SmallerBERTClassifier(BertPreTrainedModel):
+    def __init__(self, config):
+        super().__init__(config)
+        self.bert = BertModel(config)
+        self.dropout = nn.Dropout(0.4)
+        self.classifier = nn.Sequential(
+            nn.Linear(config.hidden_size, 128),
+            nn.ReLU(),
+            nn.Dropout(0.3),
+            nn.Linear(128, config.num_labels)
+        )
+        # lets from_pretrained build the model without initializing weights it's about to overwrite
+        self.post_init()
+
+    def forward(self, input_ids=None, attention_mask=None, token_type_ids=None, labels=None):
+        outputs = self.bert(input_ids=input_ids, attention_mask=attention_mask, token_type_ids=token_type_ids)
+        pooled = self.dropout(outputs.pooler_output)
+        logits = self.classifier(pooled)
+
+        return SequenceClassifierOutput(
+            loss=None,
+            logits=logits,
+            hidden_states=outputs.hidden_states,
+            attentions=outputs.attentions
+        )
+
+
+def load_model(weights_dir, config=None):
+    '''
+    Loads model.safetensors from weights_dir. from_pretrained memory-maps the file rather than
+    reading it all into a bytes object first. Whether the parameters then point into the mapping or
+    are copied out of it tensor by tensor depends on the transformers version (recent ones don't
+    copy), either way the peak is well below the old load-bytes-then-load_state_dict path.
+
+    Unlike load_state_dict, from_pretrained only warns about missing or unexpected keys and leaves
+    those layers randomly initialized, so that's checked here and raised as an error.
+    '''
+    config = config or BertConfig.from_pretrained(MODEL_DIR)
+    model, info = SmallerBERTClassifier.from_pretrained(weights_dir, config=config, local_files_only=True, output_loading_info=True)
+    bad = {kind: sorted(info[kind]) for kind in ["missing_keys", "unexpected_keys", "mismatched_keys"] if info.get(kind)}
+    if bad:
+        raise ValueError(f"{weights_dir}/model.safetensors doesn't match SmallerBERTClassifier: {bad}")
+    return model.eval()
@@ -0,0 +1,91 @@
+"""
+This file implements the inference engines the classifier can run on. Both take a padded batch
+(numpy arrays from the tokenizer) and return the logits as a numpy array, so the server and the
+batch predictor don't care which one they're using:
+
+1. TorchEngine runs the SmallerBERTClassifier in eager PyTorch
+2. OnnxEngine runs the graph exported by export_onnx.py in ONNX Runtime, which fuses the
+   attention/layernorm/gelu ops and skips the Python overhead of eager mode
+
+quantize_int8 turns the PyTorch model into a dynamically quantized one for TorchEngine
+(see eval_quantized.py for how far its predictions drift from the fp32 model).
+"""
+import os
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+INPUT_NAMES = ["input_ids", "attention_mask", "token_type_ids"]
+
+
+class TorchEngine:
+    name = "torch"
+
+    def __init__(self, model, num_threads=0):
+        self.set_num_threads(num_threads)
+        self.model = model.eval()
+
+    def set_num_threads(self, num_threads):
+        self.num_threads = num_threads
+        if num_threads:
+            torch.set_num_threads(num_threads)
+
+    def logits(self, inputs):
+        # the tokenizer's arrays are already int64 and shared with torch as they are. the token cache
+        # stores narrower ints (uint16/uint8), those are widened in one copy the size of the batch
+        tensors = {name: torch.from_numpy(np.asarray(inputs[name], dtype=np.int64)) for name in INPUT_NAMES if name in inputs}
+        with torch.inference_mode():
+            return self.model(**tensors).logits.numpy()
+
+
+class OnnxEngine:
+    name = "onnx"
+
+    def __init__(self, path, num_threads=0):
+        self.path = path
+        self.num_threads = num_threads
+        self.session = None
+        self.pid = None
+        self._session() # fail early if the file is bad
+
+    def _session(self):
+        # ONNX Runtime's thread pool doesn't survive a fork, so a forked worker (gunicorn preload) opens its own session
+        if self.session is None or self.pid != os.getpid():
+            # only needed for this engine, so the torch engine still works without it installed
+            import onnxruntime as ort
+
+            options = ort.SessionOptions()
+            options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+            if self.num_threads:
+                options.intra_op_num_threads = self.num_threads
+                options.inter_op_num_threads = 1
+            self.session = ort.InferenceSession(self.path, options, providers=["CPUExecutionProvider"])
+            self.input_names = [i.name for i in self.session.get_inputs()]
+            self.pid = os.getpid()
+        return self.session
+
+    def set_num_threads(self, num_threads):
+        if num_threads != self.num_threads:
+            self.num_threads = num_threads
+            self.session = None
+
+    def logits(self, inputs):
+        session = self._session()
+        feed = {name: np.asarray(inputs[name], dtype=np.int64) for name in self.input_names}
+        return session.run(["logits"], feed)[0]
+
+
+def quantize_int8(model):
+    '''
+    Stores the weights of every nn.Linear (the attention, feed-forward, pooler and classifier
+    layers) as int8 and quantizes their activations on the fly per batch. The embeddings and
+    layernorms stay fp32. Runs on CPU only.
+    '''
+    return torch.ao.quantization.quantize_dynamic(model.eval(), {nn.Linear}, dtype=torch.qint8)
+
+
+def softmax(logits):
+    logits = logits - logits.max(axis=1, keepdims=True)
+    exp = np.exp(logits)
+    return exp / exp.sum(axis=1, keepdims=True)
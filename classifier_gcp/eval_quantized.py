@@ -0,0 +1,166 @@
+"""
+This file checks the int8 quantized model (CLASSIFIER_PRECISION=int8 in main.py) against the fp32
+one before we serve it. It replays the statements stored in val2_preds.csv and test2_preds.csv
+through both models and reports:
+
+- label agreement at the serving threshold, per file
+- confidence drift (how much the misinfo probability moves)
+- latency, single-message (what /classify mostly sees) and batched throughput
+- resident memory of each model
+
+Each model runs in its own process so the memory numbers don't include the other one. Exits with
+status 1 if agreement on any file is below --min-agreement, so it can gate a deploy.
+
+The result is also written to int8_eval.json (--marker) with the sha256 of the weights it was run
+on. main.py only serves int8 when that file says these exact weights passed, so new weights need a
+new eval before CLASSIFIER_PRECISION=int8 does anything.
+
+Usage:
+    python eval_quantized.py [--weights saved_liar_bert_model/model.safetensors] [--min-agreement 0.99]
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from classifier_model import MODEL_DIR
+from weight_store import sha256_file
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_FILES = ["val2_preds.csv", "test2_preds.csv"]
+
+
+def rss_mb():
+    # current resident memory; /proc is linux only, elsewhere fall back to the peak
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except OSError:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+def percentile(values, q):
+    return float(np.percentile(values, q)) if len(values) else 0.0
+
+def run_model(precision, weights, statements, batch_size, latency_samples, max_length, threads):
+    '''
+    Runs in a child process. Returns the misinfo probabilities for every statement plus the
+    timings and memory of this model.
+    '''
+    import safetensors.torch as st
+    from transformers import BertTokenizer, BertConfig
+    from classifier_model import SmallerBERTClassifier
+    from engines import TorchEngine, quantize_int8, softmax
+
+    tokenizer = BertTokenizer.from_pretrained(MODEL_DIR)
+    rss_before = rss_mb()
+    model = SmallerBERTClassifier(BertConfig.from_pretrained(MODEL_DIR))
+    model.load_state_dict(st.load_file(weights))
+    model.eval()
+    if precision == "int8":
+        model = quantize_int8(model)
+    engine = TorchEngine(model, num_threads=threads)
+
+    def probs_for(batch):
+        inputs = tokenizer(batch, truncation=True, padding=True, max_length=max_length, return_tensors="np")
+        return softmax(engine.logits(inputs))[:, 1]
+
+    probs_for(statements[:batch_size]) # warm up
+
+    single_ms = []
+    for statement in statements[:latency_samples]:
+        start = time.perf_counter()
+        probs_for([statement])
+        single_ms.append((time.perf_counter() - start) * 1000)
+
+    probs = []
+    start = time.perf_counter()
+    for i in range(0, len(statements), batch_size):
+        probs.append(probs_for(statements[i:i + batch_size]))
+    elapsed = time.perf_counter() - start
+
+    return {
+        "probs": np.concatenate(probs),
+        "single_ms": single_ms,
+        "rows_per_sec": len(statements) / elapsed,
+        "rss_mb": rss_mb(),
+        "model_rss_mb": rss_mb() - rss_before,
+    }
+
+def load_statements(path):
+    statements = pd.read_csv(path)["statement"]
+    return [s if isinstance(s, str) else "" for s in statements]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the int8 quantized classifier against fp32.")
+    parser.add_argument("--weights", default=os.path.join(MODEL_DIR, "model.safetensors"))
+    parser.add_argument("--files", nargs="+", default=[os.path.join(HERE, f) for f in DEFAULT_FILES])
+    parser.add_argument("--threshold", type=float, default=0.5, help="misinfo probability at which a message is flagged (THRESHOLD in main.py)")
+    parser.add_argument("--min-agreement", type=float, default=0.99, help="fail if the two models agree on fewer labels than this")
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--latency-samples", type=int, default=200, help="messages timed one at a time")
+    parser.add_argument("--max-length", type=int, default=256)
+    parser.add_argument("--threads", type=int, default=0, help="intra-op threads, 0 = library default")
+    parser.add_argument("--marker", default=os.path.join(HERE, "int8_eval.json"), help="where to record the result for main.py (INT8_EVAL_MARKER)")
+    args = parser.parse_args()
+
+    files = {os.path.basename(path): load_statements(path) for path in args.files}
+    statements = [s for rows in files.values() for s in rows]
+    print(f"Replaying {len(statements)} statements from {', '.join(files)}")
+
+    results = {}
+    # spawn, so each model gets a fresh process and its own memory numbers
+    ctx = multiprocessing.get_context("spawn")
+    for precision in ["fp32", "int8"]:
+        with ctx.Pool(1) as pool:
+            results[precision] = pool.apply(run_model, (precision, args.weights, statements, args.batch_size, args.latency_samples, args.max_length, args.threads))
+
+    fp32, int8 = results["fp32"]["probs"], results["int8"]["probs"]
+    drift = np.abs(fp32 - int8)
+
+    print(f"\n{'':<18}{'fp32':>10}{'int8':>10}")
+    for name, key, fmt in [("single p50 (ms)", 50, ".1f"), ("single p95 (ms)", 95, ".1f")]:
+        print(f"{name:<18}" + "".join(f"{percentile(results[p]['single_ms'], key):>10{fmt}}" for p in ["fp32", "int8"]))
+    for name, key in [("batched rows/sec", "rows_per_sec"), ("process RSS (MB)", "rss_mb"), ("model RSS (MB)", "model_rss_mb")]:
+        print(f"{name:<18}" + "".join(f"{results[p][key]:>10.1f}" for p in ["fp32", "int8"]))
+
+    print(f"\nconfidence drift: mean {drift.mean():.4f}, p99 {percentile(drift, 99):.4f}, max {drift.max():.4f}")
+
+    passed = True
+    agreements = {}
+    offset = 0
+    for name, rows in files.items():
+        a = fp32[offset:offset + len(rows)] >= args.threshold
+        b = int8[offset:offset + len(rows)] >= args.threshold
+        offset += len(rows)
+        agreement = float((a == b).mean()) if len(rows) else 1.0
+        print(f"{name}: label agreement {agreement:.4f} ({int((a != b).sum())} of {len(rows)} flipped)")
+        agreements[name] = round(agreement, 4)
+        passed = passed and agreement >= args.min_agreement
+
+    worst = np.argsort(-drift)[:5]
+    print("\nlargest drift:")
+    for i in worst:
+        print(f"  {fp32[i]:.3f} -> {int8[i]:.3f}  {statements[i][:80]}")
+
+    # written on a fail too, so a pass recorded for older weights doesn't linger
+    with open(args.marker, "w") as f:
+        json.dump({"weights_sha256": sha256_file(args.weights), "passed": passed, "min_agreement": args.min_agreement,
+                   "agreement": agreements, "threshold": args.threshold, "time": time.strftime("%Y-%m-%dT%H:%M:%S")}, f, indent=2)
+    print(f"\nRecorded the result for these weights in {args.marker}")
+
+    if not passed:
+        print(f"\nFAIL: label agreement below {args.min_agreement}, don't serve the int8 model")
+        sys.exit(1)
+    print(f"\nPASS: label agreement at least {args.min_agreement} on every file")
+
+
+if __name__ == "__main__":
+    main()
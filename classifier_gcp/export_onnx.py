@@ -0,0 +1,95 @@
+"""
+This file exports the classifier to ONNX so it can be served with ONNX Runtime
+(CLASSIFIER_ENGINE=onnx in main.py, --engine onnx in batch_predict.py), then checks that
+ONNX Runtime gives the same logits as PyTorch on inputs of different batch sizes and lengths.
+
+Usage:
+    python export_onnx.py [--weights saved_liar_bert_model/model.safetensors] [--output classifier.onnx]
+    gsutil cp classifier.onnx gs://pol-disinfo-classifier/classifier.onnx
+"""
+import argparse
+import os
+import sys
+
+import numpy as np
+import safetensors.torch as st
+import torch
+import torch.nn as nn
+from transformers import BertTokenizer, BertConfig
+
+from classifier_model import SmallerBERTClassifier, MODEL_DIR
+from engines import TorchEngine, OnnxEngine, INPUT_NAMES
+
+SAMPLE_STATEMENTS = [
+    "Says the Annies List political group supports third-trimester abortions on demand.",
+    "Hillary Clinton agrees with John McCain by voting to give George Bush the benefit of the doubt on Iran.",
+    "Health care reform legislation is likely to mandate free sex change surgeries.",
+    "The economic turnaround started at the end of my term.",
+    "lol",
+    "When did the decline of coal start? It started when natural gas took off that started to begin in "
+    "(President George W.) Bushs administration. " * 8,
+]
+
+
+class LogitsOnly(nn.Module):
+    # the exported graph should have plain tensor outputs, not a SequenceClassifierOutput
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids, attention_mask, token_type_ids):
+        return self.model(input_ids=input_ids, attention_mask=attention_mask, token_type_ids=token_type_ids).logits
+
+
+def export(model, tokenizer, output, opset):
+    sample = tokenizer(SAMPLE_STATEMENTS[:2], padding=True, truncation=True, max_length=256, return_tensors="pt")
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in INPUT_NAMES}
+    dynamic_axes["logits"] = {0: "batch"}
+    # eval() matters here, the exporter traces in whatever mode the module is in and dropout would end up in the graph
+    torch.onnx.export(
+        LogitsOnly(model).eval(),
+        tuple(sample[name] for name in INPUT_NAMES),
+        output,
+        input_names=INPUT_NAMES,
+        output_names=["logits"],
+        dynamic_axes=dynamic_axes,
+        opset_version=opset,
+        dynamo=False,
+    )
+
+def verify(model, tokenizer, output, atol):
+    torch_engine = TorchEngine(model)
+    onnx_engine = OnnxEngine(output)
+    worst = 0.0
+    for batch in [SAMPLE_STATEMENTS[:1], SAMPLE_STATEMENTS[4:], SAMPLE_STATEMENTS]:
+        inputs = tokenizer(batch, padding=True, truncation=True, max_length=256, return_tensors="np")
+        diff = float(np.abs(torch_engine.logits(inputs) - onnx_engine.logits(inputs)).max())
+        print(f"batch {len(batch)} x {inputs['input_ids'].shape[1]} tokens: max abs logit diff {diff:.2e}")
+        worst = max(worst, diff)
+    return worst <= atol
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the classifier to ONNX and check it against PyTorch.")
+    parser.add_argument("--weights", default=os.path.join(MODEL_DIR, "model.safetensors"))
+    parser.add_argument("--output", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "classifier.onnx"))
+    parser.add_argument("--opset", type=int, default=17)
+    parser.add_argument("--atol", type=float, default=1e-4, help="max allowed difference between the PyTorch and ONNX logits")
+    args = parser.parse_args()
+
+    tokenizer = BertTokenizer.from_pretrained(MODEL_DIR)
+    model = SmallerBERTClassifier(BertConfig.from_pretrained(MODEL_DIR))
+    model.load_state_dict(st.load_file(args.weights))
+    model.eval()
+
+    export(model, tokenizer, args.output, args.opset)
+    print(f"Exported {args.output} ({os.path.getsize(args.output) / 1e6:.0f} MB)")
+
+    if not verify(model, tokenizer, args.output, args.atol):
+        print(f"ONNX output doesn't match PyTorch within {args.atol}, don't deploy this file")
+        sys.exit(1)
+    print("ONNX output matches PyTorch")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+This file is the gunicorn config for serving the classifier in production (the Dockerfile uses it):
+    gunicorn -c gunicorn.conf.py main:app
+
+The model is loaded once in the master before the workers are forked (preload_app), so the
+weights are shared between workers instead of loaded once per worker. Each worker then sets its
+own torch thread count and runs the warmup passes.
+
+Sizing: WORKERS x CLASSIFIER_THREADS should equal the number of vCPUs. More workers with one
+thread each gives the most throughput, fewer workers with more threads each gives lower latency
+per request when traffic is light. bench_workers.py compares the options on a given machine.
+
+Each worker writes its Prometheus metrics to PROMETHEUS_MULTIPROC_DIR (a temp folder unless it's
+set) and /metrics adds up all the workers, see metrics.py.
+"""
+import os
+import tempfile
+
+
+def available_cpus():
+    # the cgroup quota is what cloud run / docker actually gives us, os.cpu_count() is the host's
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            return max(1, int(int(quota) / int(period)))
+    except (OSError, ValueError):
+        pass
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+cpus = available_cpus()
+threads_per_worker = int(os.environ.get("CLASSIFIER_THREADS") or 1) # torch intra-op threads per worker
+workers = int(os.environ.get("WORKERS") or max(1, cpus // threads_per_worker))
+
+# gthread workers handle several requests at once, which is what lets the micro-batcher in main.py fill batches
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", 8))
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 8080)}"
+preload_app = True
+timeout = 120
+graceful_timeout = 30
+
+# recycle workers now and then so slow leaks (tokenizer caches, fragmentation) can't build up.
+# with preload a new worker is forked from the master that already has the model, so this is cheap
+max_requests = int(os.environ.get("MAX_REQUESTS", 5000))
+max_requests_jitter = int(os.environ.get("MAX_REQUESTS_JITTER", 500))
+
+# read by main.py when the master imports it
+os.environ["CLASSIFIER_THREADS"] = str(threads_per_worker)
+os.environ["BACKGROUND_LOAD"] = "0" # the model has to be loaded before the fork
+os.environ["WARMUP_ON_LOAD"] = "0" # no forward passes in the master, see post_fork
+
+# has to be set before main.py (and prometheus_client) is imported. old files would add a previous run's counts
+if not os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+    os.environ["PROMETHEUS_MULTIPROC_DIR"] = tempfile.mkdtemp(prefix="classifier-metrics-")
+os.makedirs(os.environ["PROMETHEUS_MULTIPROC_DIR"], exist_ok=True)
+for name in os.listdir(os.environ["PROMETHEUS_MULTIPROC_DIR"]):
+    if name.endswith(".db"):
+        os.remove(os.path.join(os.environ["PROMETHEUS_MULTIPROC_DIR"], name))
+
+
+def post_fork(server, worker):
+    import main # already imported by the master
+
+    main.engine.set_num_threads(threads_per_worker)
+    main.warm_up()
+    server.log.info(f"worker {worker.pid}: {threads_per_worker} torch threads, warmed up in {main.startup['warmup_seconds']}s")
+
+
+def child_exit(server, worker):
+    # drop the gauges of a worker that's gone (recycled or crashed), its counters still count
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
+
+
+def when_ready(server):
+    server.log.info(f"{workers} workers x {threads_per_worker} torch threads on {cpus} vCPUs")
@@ -0,0 +1,255 @@
+"""
+This file implements an open-loop load generator for the classifier service. Unlike
+test_classifier.py (one request at a time, so it can never push the service past what it can
+handle), requests are sent on a fixed Poisson arrival schedule at the target rate whether or not
+earlier ones have come back, the way traffic from many discord servers arrives.
+
+Messages are sampled from the statements in test2_preds.csv, so request sizes follow a real
+length distribution, and each one gets a unique suffix so the service's prediction cache can't
+answer it (--allow-repeats sends the statements as they are, to measure the cache instead). Each
+request is either a /classify call or (with --batch-fraction) a /classify_batch call with
+--batch-size messages. The prediction cache hit rate over each run is read from /stats and shown
+next to the latencies.
+
+For every rate it reports status counts (errors, 429s, 503s), achieved throughput, a latency
+histogram and percentiles two ways:
+- service: from when the request actually went out on a connection
+- corrected: from when the schedule said it should have been sent. if the generator or the
+  connection pool falls behind, requests go out late, and timing from the send hides the time
+  they spent waiting (coordinated omission). the corrected numbers are what a user would see
+
+Usage:
+    python load_test.py --url http://127.0.0.1:8080 --rates 50 200 500 [--duration 30] [--batch-fraction 0.1]
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+import aiohttp
+import numpy as np
+import pandas as pd
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+# histogram bucket upper bounds in ms, roughly log spaced
+HISTOGRAM_BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, float("inf")]
+PERCENTILES = [50, 90, 95, 99, 99.9]
+
+
+def load_statements(path):
+    statements = pd.read_csv(path, usecols=["statement"])["statement"].dropna().astype(str)
+    return statements[statements.str.strip() != ""].tolist()
+
+def arrival_schedule(rate, duration, rng):
+    '''
+    Send times (seconds from the start) of a Poisson process at `rate` requests/sec.
+    '''
+    gaps = rng.exponential(1 / rate, size=int(rate * duration * 1.5) + 10)
+    times = np.cumsum(gaps)
+    return times[times < duration]
+
+def make_requests(count, statements, args, rng, run_id):
+    '''
+    (endpoint, payload, rows) for every scheduled request, drawn up front so building payloads
+    doesn't slow the send loop down.
+    '''
+    requests = []
+    messages = 0
+
+    def message():
+        nonlocal messages
+        statement = statements[rng.integers(len(statements))]
+        messages += 1
+        if args.allow_repeats:
+            return statement
+        # a few extra tokens, but never the same text twice (across rates too). in front, so
+        # truncating a long statement can't cut it off
+        return f"(ref {run_id}-{messages}) {statement}"
+
+    is_batch = rng.random(count) < args.batch_fraction
+    for batch in is_batch:
+        if batch:
+            requests.append(("/classify_batch", {"messages": [message() for _ in range(args.batch_size)]}, args.batch_size))
+        else:
+            requests.append(("/classify", {"message": message()}, 1))
+    return requests
+
+
+async def send(session, url, payload, intended, start_time, timeout):
+    '''
+    Returns (status, service ms, corrected ms). status is the HTTP status, or "timeout"/"error".
+    '''
+    sent = time.perf_counter()
+    queued = {"sec": 0.0}
+    try:
+        async with session.post(url, json=payload, timeout=timeout, trace_request_ctx=queued) as response:
+            await response.read()
+            status = response.status
+    except asyncio.TimeoutError:
+        status = "timeout"
+    except aiohttp.ClientError:
+        status = "error"
+    done = time.perf_counter()
+    # the service number leaves out time spent waiting for a free connection, the corrected one doesn't
+    return status, (done - sent - queued["sec"]) * 1000, (done - (start_time + intended)) * 1000
+
+def pool_wait_tracer():
+    '''
+    Adds the time each request waits for a connection from the pool (past --connections) to its
+    trace_request_ctx["sec"].
+    '''
+    async def queued_start(session, ctx, params):
+        ctx.queued_at = time.perf_counter()
+
+    async def queued_end(session, ctx, params):
+        ctx.trace_request_ctx["sec"] += time.perf_counter() - ctx.queued_at
+
+    tracer = aiohttp.TraceConfig()
+    tracer.on_connection_queued_start.append(queued_start)
+    tracer.on_connection_queued_end.append(queued_end)
+    return tracer
+
+async def cache_stats(session, base_url):
+    '''
+    The service's prediction cache counters from /stats, or None if it can't be read. Under gunicorn
+    each worker has its own cache and whichever one answers reports only its own.
+    '''
+    try:
+        async with session.get(base_url + "/stats", timeout=aiohttp.ClientTimeout(total=10)) as response:
+            return (await response.json())["cache"]
+    except (aiohttp.ClientError, asyncio.TimeoutError, ValueError, KeyError, TypeError):
+        return None
+
+def cache_delta(before, after):
+    if before is None or after is None:
+        return None
+    delta = {key: after[key] - before[key] for key in ["hits", "misses", "coalesced"]}
+    lookups = sum(delta.values())
+    # a worker restarted in between, the counters went back to zero
+    if lookups < 0 or any(v < 0 for v in delta.values()):
+        return None
+    delta["hit_rate"] = round((delta["hits"] + delta["coalesced"]) / lookups, 4) if lookups else 0.0
+    return delta
+
+async def run_rate(base_url, rate, args, statements, rng):
+    schedule = arrival_schedule(rate, args.duration, rng)
+    requests = make_requests(len(schedule), statements, args, rng, f"{int(time.time()) % 100000}-{rate:g}")
+    timeout = aiohttp.ClientTimeout(total=args.timeout)
+    connector = aiohttp.TCPConnector(limit=args.connections)
+    async with aiohttp.ClientSession(connector=connector, trace_configs=[pool_wait_tracer()]) as session:
+        cache_before = await cache_stats(session, base_url)
+        tasks = []
+        max_lag = 0.0
+        start_time = time.perf_counter()
+        for intended, (endpoint, payload, _) in zip(schedule, requests):
+            delay = start_time + intended - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            else:
+                max_lag = max(max_lag, -delay)
+            tasks.append(asyncio.create_task(send(session, base_url + endpoint, payload, intended, start_time, timeout)))
+        results = await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - start_time
+        cache = cache_delta(cache_before, await cache_stats(session, base_url))
+    return summarize(rate, results, [rows for _, _, rows in requests], elapsed, max_lag, cache)
+
+
+def percentiles(latencies):
+    if not len(latencies):
+        return {f"p{p:g}_ms": None for p in PERCENTILES}
+    return {f"p{p:g}_ms": round(float(np.percentile(latencies, p)), 1) for p in PERCENTILES}
+
+def histogram(latencies):
+    counts = np.histogram(latencies, bins=[0] + HISTOGRAM_BUCKETS_MS)[0] if len(latencies) else np.zeros(len(HISTOGRAM_BUCKETS_MS), dtype=int)
+    return {("inf" if bound == float("inf") else f"{bound:g}"): int(count) for bound, count in zip(HISTOGRAM_BUCKETS_MS, counts)}
+
+def summarize(rate, results, rows, elapsed, max_lag, cache=None):
+    statuses = [status for status, _, _ in results]
+    ok = np.array([status == 200 for status in statuses])
+    service = np.array([ms for _, ms, _ in results])
+    corrected = np.array([ms for _, _, ms in results])
+    total = len(results)
+    status_counts = {}
+    for status in statuses:
+        status_counts[str(status)] = status_counts.get(str(status), 0) + 1
+    return {
+        "target_rate": rate,
+        "requests": total,
+        "elapsed_sec": round(elapsed, 2),
+        "ok_per_sec": round(ok.sum() / elapsed, 2),
+        "rows_per_sec": round(sum(r for r, good in zip(rows, ok) if good) / elapsed, 2),
+        "error_rate": round(1 - ok.mean(), 4) if total else 0.0,
+        "rate_429": round(status_counts.get("429", 0) / total, 4) if total else 0.0,
+        "status_counts": status_counts,
+        "max_send_lag_ms": round(max_lag * 1000, 1),
+        "service": dict(percentiles(service[ok]), max_ms=round(float(service[ok].max()), 1) if ok.any() else None),
+        "corrected": dict(percentiles(corrected[ok]), max_ms=round(float(corrected[ok].max()), 1) if ok.any() else None),
+        "histogram_ms": histogram(corrected[ok]),
+        "prediction_cache": cache,
+    }
+
+def report(result):
+    print(f"\n=== {result['target_rate']} req/s for {result['elapsed_sec']}s: {result['requests']} requests, "
+          f"{result['ok_per_sec']} ok/s ({result['rows_per_sec']} rows/s) ===")
+    print(f"errors {result['error_rate']:.2%}  429s {result['rate_429']:.2%}  statuses {result['status_counts']}")
+    cache = result["prediction_cache"]
+    if cache is None:
+        print("prediction cache: couldn't read /stats")
+    else:
+        print(f"prediction cache hit rate {cache['hit_rate']:.2%} ({cache['hits']} hits, {cache['coalesced']} coalesced, {cache['misses']} misses"
+              " on the worker that answered /stats)")
+        if cache["hit_rate"] > 0.05:
+            print("warning: a lot of these requests were answered from the cache, the latencies aren't model latency")
+    if result["max_send_lag_ms"] > 10:
+        print(f"warning: the generator fell up to {result['max_send_lag_ms']} ms behind schedule, the corrected numbers account for it")
+    print(f"{'':<11}" + "".join(f"{'p' + format(p, 'g'):>9}" for p in PERCENTILES) + f"{'max':>9}")
+    for kind in ["service", "corrected"]:
+        values = [result[kind][f"p{p:g}_ms"] for p in PERCENTILES] + [result[kind]["max_ms"]]
+        print(f"{kind:<11}" + "".join(f"{'-' if v is None else v:>9}" for v in values))
+    total = sum(result["histogram_ms"].values()) or 1
+    previous = "0"
+    for bound, count in result["histogram_ms"].items():
+        if count:
+            label = f"{previous}-{bound} ms" if bound != "inf" else f">{previous} ms"
+            print(f"  {label:>14} {count:>7} {'#' * int(round(40 * count / total))}")
+        previous = bound
+
+
+async def run(args):
+    statements = load_statements(args.data)
+    rng = np.random.default_rng(args.seed)
+    results = []
+    for rate in args.rates:
+        result = await run_rate(args.url.rstrip("/"), rate, args, statements, rng)
+        report(result)
+        results.append(result)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Open-loop load test for the classifier service.")
+    parser.add_argument("--url", default=os.environ.get("CLASSIFIER_URL", "http://127.0.0.1:8080"), help="base url of the service")
+    parser.add_argument("--rates", nargs="+", type=float, default=[50], help="target requests/sec, one run each")
+    parser.add_argument("--duration", type=float, default=30, help="seconds per rate")
+    parser.add_argument("--batch-fraction", type=float, default=0.0, help="share of requests sent to /classify_batch")
+    parser.add_argument("--batch-size", type=int, default=8, help="messages per /classify_batch request")
+    parser.add_argument("--connections", type=int, default=1000, help="max open connections, requests past it wait (and count against corrected latency)")
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--data", default=os.path.join(HERE, "test2_preds.csv"), help="csv with a statement column to sample messages from")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--allow-repeats", action="store_true", help="send statements as they are, so repeats can be cache hits (default: every message is unique)")
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--max-error-rate", type=float, default=None, help="exit nonzero if any rate had more errors than this")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.max_error_rate is not None and any(r["error_rate"] > args.max_error_rate for r in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,67 +2,182 @@
 This file implements a simple Flask API that uses a BERT-based model 
 to classify statements as misinformation or not.
 """
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, g, Response
 from transformers import BertTokenizer, BertConfig
-from transformers.modeling_outputs import SequenceClassifierOutput
-from transformers import BertPreTrainedModel, BertModel
-import torch.nn as nn
-import torch
+import json
 import os
-from google.cloud import storage
-import safetensors.torch as st
-import io
-import numpy as np
+import threading
+import time
+from batching import MicroBatcher
+from prediction_cache import PredictionCache
+from classifier_model import load_model, MODEL_DIR
+from weight_store import WeightStore
+from engines import TorchEngine, OnnxEngine, quantize_int8, softmax
+import metrics
 
 
 app = Flask(__name__)
 
-class SmallerBERTClassifier(BertPreTrainedModel):
-    def __init__(self, config):
-        super().__init__(config)
-        self.bert = BertModel(config)
-        self.dropout = nn.Dropout(0.4)
-        self.classifier = nn.Sequential(
-            nn.Linear(config.hidden_size, 128),
-            nn.ReLU(),
-            nn.Dropout(0.3),
-            nn.Linear(128, config.num_labels)
-        )
-
-    def forward(self, input_ids=None, attention_mask=None, token_type_ids=None, labels=None):
-        outputs = self.bert(input_ids=input_ids, attention_mask=attention_mask, token_type_ids=token_type_ids)
-        pooled = self.dropout(outputs.pooler_output)
-        logits = self.classifier(pooled)
-
-        return SequenceClassifierOutput(
-            loss=None,
-            logits=logits,
-            hidden_states=outputs.hidden_states,
-            attentions=outputs.attentions
-        )
-
-MODEL_DIR = os.path.join(os.path.dirname(__file__), "saved_liar_bert_model")
+# "torch" runs the model in eager PyTorch, "onnx" runs an exported graph (see export_onnx.py) in ONNX Runtime
+CLASSIFIER_ENGINE = os.environ.get("CLASSIFIER_ENGINE", "torch")
+# "int8" serves a dynamically quantized copy of the model (torch engine only). only if eval_quantized.py passed
+# on these exact weights (it writes INT8_EVAL_MARKER), otherwise fp32 is served with a warning
+CLASSIFIER_PRECISION = os.environ.get("CLASSIFIER_PRECISION", "fp32")
+INT8_EVAL_MARKER = os.environ.get("INT8_EVAL_MARKER", os.path.join(os.path.dirname(os.path.abspath(__file__)), "int8_eval.json"))
+INT8_EVAL_GATE = os.environ.get("INT8_EVAL_GATE", "1") == "1" # benchmark.py turns it off, it only measures speed
+CLASSIFIER_THREADS = int(os.environ.get("CLASSIFIER_THREADS", 0)) # intra-op threads, 0 = library default
+ONNX_MODEL_PATH = os.environ.get("ONNX_MODEL_PATH", "") # use this file instead of fetching classifier.onnx
+
+# model files are cached on local disk and only downloaded from the bucket when they aren't there
+MODEL_BUCKET = os.environ.get("MODEL_BUCKET", "pol-disinfo-classifier") # "" to never download
+WEIGHTS_CACHE_DIR = os.environ.get("WEIGHTS_CACHE_DIR", os.path.expanduser("~/.cache/pol-disinfo-classifier"))
+WEIGHTS_SOURCE_DIR = os.environ.get("WEIGHTS_SOURCE_DIR", "") # a local dir with the model files, works offline
+MODEL_SHA256 = os.environ.get("MODEL_SHA256", "") # optional, refuse any model.safetensors that doesn't match
+# load in a background thread so the port opens right away, requests that arrive first wait for it
+BACKGROUND_LOAD = os.environ.get("BACKGROUND_LOAD", "1") == "1"
+# gunicorn.conf.py turns this off and warms up each worker after the fork instead,
+# torch's OpenMP thread pool hangs in a child if the parent already used it
+WARMUP_ON_LOAD = os.environ.get("WARMUP_ON_LOAD", "1") == "1"
+READY_TIMEOUT = float(os.environ.get("READY_TIMEOUT", 120)) # seconds a request waits for the model
 
 tokenizer = BertTokenizer.from_pretrained(MODEL_DIR)
 config = BertConfig.from_pretrained(MODEL_DIR)
-model = SmallerBERTClassifier(config)
+weight_store = WeightStore(WEIGHTS_CACHE_DIR, bucket_name=MODEL_BUCKET or None, source_dir=WEIGHTS_SOURCE_DIR or None)
+
+engine = None
+load_error = None
+startup = {}
+loaded = threading.Event() # set once loading finished, whether it worked or not
+warmed_up = threading.Event() # set once this process ran the warmup passes (each gunicorn worker does its own)
+
+MAX_LENGTH = 256
+# we also tried other values like .35 for higher recall, but it was a ltitle too high, .5 gave us a good balance
+THRESHOLD = 0.5  # <-- we can change this
+
+# requests that arrive close together share one forward pass
+BATCH_MAX_SIZE = int(os.environ.get("BATCH_MAX_SIZE", 16))
+BATCH_MAX_WAIT_MS = float(os.environ.get("BATCH_MAX_WAIT_MS", 10))
+# max number of messages in one /classify_batch request
+MAX_BATCH_REQUEST_ITEMS = int(os.environ.get("MAX_BATCH_REQUEST_ITEMS", 64))
+
+def encode(statement, justification):
+    # no padding here, each batch is padded to its own longest input
+    return tokenizer(statement, justification, truncation=True, max_length=MAX_LENGTH)
+
+def run_batch(encodings, observe=True):
+    t0 = time.perf_counter()
+    inputs = tokenizer.pad(encodings, padding=True, return_tensors="np")
+    t1 = time.perf_counter()
+    probs = softmax(engine.logits(inputs)).tolist()
+    if observe:
+        metrics.STAGE_LATENCY.labels("pad").observe(t1 - t0)
+        metrics.STAGE_LATENCY.labels("forward").observe(time.perf_counter() - t1)
+    return probs
+
+batcher = MicroBatcher(run_batch, max_batch_size=BATCH_MAX_SIZE, max_wait_ms=BATCH_MAX_WAIT_MS, on_batch=metrics.observe_batch)
 
-def load_weights_from_gcs(bucket_name, blob_name):
-    client = storage.Client()
-    bucket = client.bucket(bucket_name)
-    blob = bucket.blob(blob_name)
+# repeated messages (spam/raid waves) are answered from here instead of running the model again
+PREDICTION_CACHE_SIZE = int(os.environ.get("PREDICTION_CACHE_SIZE", 10000))
+prediction_cache = PredictionCache(max_entries=PREDICTION_CACHE_SIZE)
 
-    # Get raw bytes instead of using BytesIO
-    weight_bytes = blob.download_as_bytes()
+def predict(encodings):
+    return prediction_cache.get_or_compute_many(encodings, batcher.submit_many)
 
-    # Load weights directly from bytes
-    state_dict = st.load(weight_bytes)
+def load_engine():
+    if CLASSIFIER_ENGINE == "onnx":
+        path = ONNX_MODEL_PATH or weight_store.fetch("classifier.onnx")
+        return OnnxEngine(path, num_threads=CLASSIFIER_THREADS)
+    path = weight_store.fetch("model.safetensors", expected_sha256=MODEL_SHA256 or None)
+    model = load_model(os.path.dirname(path), config)
+    if CLASSIFIER_PRECISION == "int8":
+        if not INT8_EVAL_GATE or int8_eval_passed(weight_store.sha256("model.safetensors")):
+            model = quantize_int8(model)
+            startup["precision"] = "int8"
+            print("Serving the int8 quantized model")
+        else:
+            print(f"WARNING: CLASSIFIER_PRECISION=int8 but {INT8_EVAL_MARKER} has no passing eval for these weights, "
+                  "serving fp32. run eval_quantized.py on them first")
+    return TorchEngine(model, num_threads=CLASSIFIER_THREADS)
+
+def int8_eval_passed(weights_sha256):
+    try:
+        with open(INT8_EVAL_MARKER) as f:
+            marker = json.load(f)
+    except (OSError, ValueError):
+        return False
+    return marker.get("passed") is True and marker.get("weights_sha256") == weights_sha256
+
+WARMUP_STATEMENTS = [
+    "Says the Annies List political group supports third-trimester abortions on demand.",
+    "When did the decline of coal start? It started when natural gas took off that started to begin in (President George W.) Bushs administration. " * 4,
+]
+
+def warm_up():
+    # the first forward passes pay for page faults on the weights and lazy allocations, so do them before taking traffic
+    t0 = time.perf_counter()
+    for statement in WARMUP_STATEMENTS:
+        run_batch([encode(statement, "")], observe=False)
+    startup["warmup_seconds"] = round(time.perf_counter() - t0, 2)
+    warmed_up.set()
+    metrics.MODEL_READY.set(1)
+    metrics.MODEL_INFO.labels(engine.name, startup["precision"]).set(1)
+    metrics.update_process_metrics(engine)
 
-    model.load_state_dict(state_dict)
-    print("Model weights loaded from GCS")
+def start():
+    global engine, load_error
+    try:
+        t0 = time.perf_counter()
+        startup["precision"] = "fp32" # load_engine changes it if it serves int8
+        engine = load_engine()
+        startup.update({"engine": engine.name, "load_seconds": round(time.perf_counter() - t0, 2), "files": weight_store.last_fetch})
+        metrics.RSS.set(metrics.rss_bytes()) # only the memory here, the thread counts would start torch's thread pool before the fork
+        if WARMUP_ON_LOAD:
+            warm_up()
+        print(f"Using the {engine.name} engine, ready after {time.perf_counter() - t0:.1f}s")
+    except Exception as e:
+        load_error = repr(e)
+        print(f"Loading the model failed: {load_error}")
+        if not BACKGROUND_LOAD:
+            raise
+    finally:
+        loaded.set()
+
+def model_ready(timeout=0):
+    loaded.wait(timeout)
+    return loaded.is_set() and load_error is None
+
+def to_response(probs):
+    if probs[1] >= THRESHOLD:
+        prediction = 1
+    else:
+        prediction = 0
+    confidence = probs[prediction]
+    label = "Misinformation" if prediction == 1 else "Not Misinformation"
+    metrics.observe_prediction(label, confidence)
+    return {
+        "classification": label,
+        "confidence_score": round(confidence, 4)
+    }
 
-load_weights_from_gcs("pol-disinfo-classifier", "model.safetensors")
-model.eval()
+@app.before_request
+def start_request_metrics():
+    g.request_start = time.perf_counter()
+    metrics.IN_FLIGHT.inc()
+
+@app.after_request
+def record_status(response):
+    g.status = response.status_code
+    return response
+
+@app.teardown_request
+def finish_request_metrics(error=None):
+    if "request_start" not in g:
+        return
+    endpoint = request.endpoint or "unknown"
+    metrics.IN_FLIGHT.dec()
+    metrics.REQUEST_LATENCY.labels(endpoint).observe(time.perf_counter() - g.request_start)
+    metrics.REQUESTS.labels(endpoint, str(g.get("status", 500))).inc()
+    metrics.update_process_metrics(engine)
 
 @app.route("/classify", methods=["POST"])
 def classify():
@@ -73,24 +188,77 @@ def classify():
 
     if not statement.strip():
         return jsonify({"error": "The 'message' field (statement) is required."}), 400
+    if not model_ready(READY_TIMEOUT):
+        return jsonify({"error": "The model isn't loaded."}), 503
+
+    with metrics.STAGE_LATENCY.labels("tokenize").time():
+        encoding = encode(statement, justification)
+    probs = predict([encoding])[0]
+
+    with metrics.STAGE_LATENCY.labels("serialize").time():
+        return jsonify(to_response(probs))
 
-    inputs = tokenizer(statement, justification, return_tensors="pt", truncation=True, padding=True, max_length=256)
+@app.route("/classify_batch", methods=["POST"])
+def classify_batch():
+    data = request.json or {}
 
-    with torch.no_grad():
-        outputs = model(**inputs)
-        probs = torch.softmax(outputs.logits, dim=1).squeeze()
-        # we also tried other values like .35 for higher recall, but it was a ltitle too high, .5 gave us a good balance
-        threshold = 0.5  # <-- we can change this
-        if probs[1] >= threshold:
-            prediction = 1
+    messages = data.get("messages")
+    justifications = data.get("justifications") or []  # also optional, one per message if given
+
+    if not isinstance(messages, list) or not messages:
+        return jsonify({"error": "The 'messages' field must be a non-empty list."}), 400
+    if len(messages) > MAX_BATCH_REQUEST_ITEMS:
+        return jsonify({"error": f"At most {MAX_BATCH_REQUEST_ITEMS} messages per request."}), 400
+    if justifications and len(justifications) != len(messages):
+        return jsonify({"error": "'justifications' must be the same length as 'messages'."}), 400
+
+    # empty messages get a per-item error instead of failing the whole batch
+    results = [None] * len(messages)
+    valid = []
+    for i, statement in enumerate(messages):
+        if not isinstance(statement, str) or not statement.strip():
+            results[i] = {"error": "The message (statement) is required."}
         else:
-            prediction = 0
-        confidence = probs[prediction].item()
+            valid.append(i)
 
-    return jsonify({
-        "classification": "Misinformation" if prediction == 1 else "Not Misinformation",
-        "confidence_score": round(confidence, 4)
-    })
+    with metrics.STAGE_LATENCY.labels("tokenize").time():
+        encodings = [encode(messages[i], (justifications[i] if justifications else "") or "") for i in valid]
+    if encodings and not model_ready(READY_TIMEOUT):
+        return jsonify({"error": "The model isn't loaded."}), 503
+    all_probs = predict(encodings) if encodings else []
+
+    with metrics.STAGE_LATENCY.labels("serialize").time():
+        for i, probs in zip(valid, all_probs):
+            results[i] = to_response(probs)
+        return jsonify({"results": results})
+
+@app.route("/stats", methods=["GET"])
+def stats():
+    return jsonify({"batching": batcher.stats(), "cache": prediction_cache.stats(), "startup": startup})
+
+@app.route("/readyz", methods=["GET"])
+def readyz():
+    # only ready once the weights are loaded and the warmup passes ran
+    if model_ready() and warmed_up.is_set():
+        return jsonify({"ready": True, "engine": engine.name})
+    return jsonify({"ready": False, "loaded": loaded.is_set(), "warmed_up": warmed_up.is_set(), "error": load_error}), 503
+
+@app.route("/healthz", methods=["GET"])
+def healthz():
+    # the process is up. still loading is fine, a failed load isn't going to fix itself, so restart us
+    status = {"alive": True, "loaded": model_ready(), "warmed_up": warmed_up.is_set(), "error": load_error}
+    return jsonify(status), 500 if load_error else 200
+
+@app.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    metrics.update_process_metrics(engine)
+    body, content_type = metrics.render()
+    return Response(body, content_type=content_type)
+
+if BACKGROUND_LOAD:
+    threading.Thread(target=start, name="model-loader", daemon=True).start()
+else:
+    start()
 
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=int(os.environ.get("PORT", 8080)))
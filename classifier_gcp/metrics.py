@@ -0,0 +1,75 @@
+"""
+This file implements the Prometheus metrics the classifier service exposes on /metrics:
+request rate and latency per endpoint, time spent in each stage of a request (tokenization,
+waiting for a batch, padding, the forward pass, building the response), the label and confidence
+distribution of what we serve, in-flight requests, process memory and thread settings.
+
+Under gunicorn every worker keeps its own numbers. When PROMETHEUS_MULTIPROC_DIR is set
+(gunicorn.conf.py sets it) they're written to files in that folder and /metrics adds up all the
+workers, so a scrape doesn't depend on which worker answers it.
+"""
+import os
+
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, CONTENT_TYPE_LATEST, REGISTRY, generate_latest
+from prometheus_client import multiprocess
+
+# request latencies go from a cache hit (well under 1ms) to a long batch on a busy cpu
+LATENCY_BUCKETS = [0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+# confidence is the probability of the label we returned, so it's never below 0.5
+CONFIDENCE_BUCKETS = [0.5, 0.55, 0.6, 0.65, 0.7, 0.75, 0.8, 0.85, 0.9, 0.95, 0.99, 1.0]
+
+REQUESTS = Counter("classifier_requests_total", "HTTP requests by endpoint and status code", ["endpoint", "status"])
+REQUEST_LATENCY = Histogram("classifier_request_seconds", "Time to answer a request, by endpoint", ["endpoint"], buckets=LATENCY_BUCKETS)
+# tokenize and serialize are per request, queue per message, pad and forward per batch
+STAGE_LATENCY = Histogram("classifier_stage_seconds", "Time spent in each stage of a request", ["stage"], buckets=LATENCY_BUCKETS)
+BATCH_SIZE = Histogram("classifier_batch_size", "Messages per forward pass", buckets=[1, 2, 4, 8, 16, 32, 64])
+IN_FLIGHT = Gauge("classifier_in_flight_requests", "Requests being handled right now", multiprocess_mode="livesum")
+
+PREDICTIONS = Counter("classifier_predictions_total", "Messages classified, by label", ["label"])
+CONFIDENCE = Histogram("classifier_confidence", "Confidence score of the returned label", ["label"], buckets=CONFIDENCE_BUCKETS)
+
+# summed over the workers, so it's the number of workers that loaded and warmed up the model
+MODEL_READY = Gauge("classifier_model_ready", "Processes with the model loaded and warmed up", multiprocess_mode="livesum")
+MODEL_INFO = Gauge("classifier_model_info", "The engine and precision being served", ["engine", "precision"], multiprocess_mode="liveall")
+RSS = Gauge("classifier_resident_memory_bytes", "Resident memory of the process", multiprocess_mode="liveall")
+THREADS = Gauge("classifier_threads", "Thread settings: what the engine was configured with, and torch intra-op and inter-op threads (torch engine)", ["kind"], multiprocess_mode="liveall")
+
+
+def rss_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return 0
+
+def update_process_metrics(engine):
+    # cheap, so it's done at the end of each request and on every scrape
+    RSS.set(rss_bytes())
+    if engine is None:
+        return
+    THREADS.labels("engine_configured").set(getattr(engine, "num_threads", 0) or 0)
+    # torch's own thread pools only matter when it's running the model
+    if engine.name == "torch":
+        import torch
+
+        THREADS.labels("torch_intra_op").set(torch.get_num_threads())
+        THREADS.labels("torch_inter_op").set(torch.get_num_interop_threads())
+
+def observe_prediction(label, confidence):
+    PREDICTIONS.labels(label).inc()
+    CONFIDENCE.labels(label).observe(confidence)
+
+def observe_batch(size, queue_delays):
+    BATCH_SIZE.observe(size)
+    for delay in queue_delays:
+        STAGE_LATENCY.labels("queue").observe(delay)
+
+def render():
+    '''
+    Returns (body, content type) for /metrics.
+    '''
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
@@ -0,0 +1,100 @@
+"""
+This file implements an in-process cache for classifier predictions, keyed on the tokenized
+input, so a message we've already classified costs a dictionary lookup instead of a forward
+pass. Identical requests that arrive while the first one is still running wait for its
+result instead of being computed again.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import numpy as np
+
+
+def encoding_key(encoding):
+    # the model only sees the token ids and segment ids, so that's all the key needs
+    h = hashlib.blake2b(digest_size=16)
+    h.update(np.asarray(encoding["input_ids"], dtype=np.int32).tobytes())
+    if "token_type_ids" in encoding:
+        h.update(b"|")
+        h.update(np.asarray(encoding["token_type_ids"], dtype=np.int8).tobytes())
+    return h.digest()
+
+
+class PredictionCache:
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self.entries = OrderedDict() # key -> result, least recently used first
+        self.inflight = {} # key -> Future
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    def get_or_compute_many(self, encodings, compute_many):
+        '''
+        Returns one result per encoding. Only the encodings that are neither cached nor already
+        being computed are passed to compute_many (as one list).
+        '''
+        results = [None] * len(encodings)
+        waiting = [] # (index, future) for results someone else is computing
+        to_compute = [] # (index, key, encoding, future) for results we compute here
+
+        with self.lock:
+            for i, encoding in enumerate(encodings):
+                key = encoding_key(encoding)
+                if key in self.entries:
+                    self.entries.move_to_end(key)
+                    results[i] = self.entries[key]
+                    self.hits += 1
+                elif key in self.inflight:
+                    waiting.append((i, self.inflight[key]))
+                    self.coalesced += 1
+                else:
+                    future = Future()
+                    self.inflight[key] = future
+                    to_compute.append((i, key, encoding, future))
+                    self.misses += 1
+
+        if to_compute:
+            try:
+                computed = compute_many([encoding for _, _, encoding, _ in to_compute])
+            except Exception as e:
+                with self.lock:
+                    for _, key, _, future in to_compute:
+                        self.inflight.pop(key, None)
+                for _, _, _, future in to_compute:
+                    future.set_exception(e)
+                raise
+
+            with self.lock:
+                for (i, key, _, future), result in zip(to_compute, computed):
+                    results[i] = result
+                    self.entries[key] = result
+                    self.inflight.pop(key, None)
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+                    self.evictions += 1
+            for (_, _, _, future), result in zip(to_compute, computed):
+                future.set_result(result)
+
+        for i, future in waiting:
+            results[i] = future.result()
+        return results
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses + self.coalesced
+            return {
+                "max_entries": self.max_entries,
+                "entries": len(self.entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "evictions": self.evictions,
+                "hit_rate": round((self.hits + self.coalesced) / lookups, 3) if lookups else 0.0,
+                "inflight": len(self.inflight),
+            }
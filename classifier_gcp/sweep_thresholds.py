@@ -0,0 +1,109 @@
+"""
+This file evaluates a whole grid of classification thresholds at once from stored predictions,
+without running the model again. For every threshold it reports precision, recall and F1 against
+the LIAR labels, the share of messages that would be flagged, and how many LLM calls that flag
+rate means for the bot (every flagged message goes through the LLM report), compared with the
+threshold main.py serves with.
+
+Inputs are the <output>_probs.npz files batch_predict.py saves (full precision), or prediction
+CSV/Parquet files with misinfo_prob and col2 columns (test2_preds.csv, val2_preds.csv).
+
+Usage:
+    python sweep_thresholds.py val2_preds.csv test2_preds.csv [--step 0.01] [--messages-per-day 20000]
+"""
+import argparse
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+# same split as the training notebook, other labels are left out
+MISINFO_LABELS = ["pants-fire", "false", "barely-true"]
+NOT_MISINFO_LABELS = ["half-true", "mostly-true", "true"]
+
+
+def load_predictions(path):
+    '''
+    Returns (P(misinfo), LIAR label) arrays.
+    '''
+    if path.endswith(".npz"):
+        data = np.load(path)
+        return data["misinfo_prob"].astype(np.float64), data["label"].astype(str)
+    df = pd.read_parquet(path) if path.endswith(".parquet") else pd.read_csv(path)
+    return df["misinfo_prob"].to_numpy(np.float64), df["col2"].astype(str).to_numpy()
+
+def sweep(probs, is_misinfo, thresholds):
+    '''
+    Metrics for every threshold in one pass: after sorting the scores once, the number of rows at
+    or above a threshold is a binary search, and how many of them are misinfo is a prefix sum.
+    '''
+    order = np.argsort(-probs, kind="stable")
+    sorted_probs = probs[order]
+    true_positives_prefix = np.concatenate([[0], np.cumsum(is_misinfo[order])])
+
+    # rows with prob >= t are the first k of the descending order
+    flagged = np.searchsorted(-sorted_probs, -thresholds, side="right")
+    tp = true_positives_prefix[flagged]
+    positives = is_misinfo.sum()
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        precision = np.where(flagged > 0, tp / flagged, 1.0)
+        recall = tp / positives if positives else np.ones_like(thresholds)
+        f1 = np.where(precision + recall > 0, 2 * precision * recall / (precision + recall), 0.0)
+    return {
+        "threshold": thresholds,
+        "precision": precision,
+        "recall": recall,
+        "f1": f1,
+        "flag_rate": flagged / len(probs),
+        "flagged": flagged,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep classification thresholds over stored predictions.")
+    parser.add_argument("files", nargs="+", help="_probs.npz from batch_predict.py, or *_preds.csv/.parquet")
+    parser.add_argument("--step", type=float, default=0.01)
+    parser.add_argument("--baseline", type=float, default=0.5, help="the threshold we serve with now (THRESHOLD in main.py)")
+    parser.add_argument("--messages-per-day", type=int, default=0, help="classified messages per day, to turn flag rates into LLM calls per day")
+    parser.add_argument("--llm-calls-per-flag", type=float, default=1.0, help="LLM calls per flagged message (1 with SINGLE_CALL_REPORTS, up to 4 with the step-by-step prompts)")
+    parser.add_argument("--print-every", type=float, default=0.05, help="only print thresholds on this grid (the best ones are always shown)")
+    parser.add_argument("--json", help="write the full grid for every file to this file")
+    args = parser.parse_args()
+
+    thresholds = np.round(np.arange(0, 1 + args.step / 2, args.step), 6)
+    out = {}
+    for path in args.files:
+        probs, labels = load_predictions(path)
+        known = np.isin(labels, MISINFO_LABELS + NOT_MISINFO_LABELS)
+        probs, is_misinfo = probs[known], np.isin(labels[known], MISINFO_LABELS).astype(np.int64)
+        metrics = sweep(probs, is_misinfo, np.append(thresholds, args.baseline))
+        baseline_rate = metrics["flag_rate"][-1]
+        metrics = {name: values[:-1] for name, values in metrics.items()}
+        llm_calls = metrics["flag_rate"] * args.llm_calls_per_flag
+        llm_change = (metrics["flag_rate"] / baseline_rate - 1) if baseline_rate else np.zeros_like(thresholds)
+
+        best = int(np.argmax(metrics["f1"]))
+        print(f"\n=== {os.path.basename(path)}: {len(probs)} labeled rows, {is_misinfo.mean():.1%} misinfo ===")
+        calls_header = "LLM/day" if args.messages_per_day else "LLM/1k msgs"
+        print(f"{'thresh':>7}{'prec':>8}{'recall':>8}{'f1':>8}{'flagged':>9}{calls_header:>13}{'vs ' + str(args.baseline):>10}")
+        on_grid = np.isclose(np.round(thresholds / args.print_every) * args.print_every, thresholds)
+        for i in range(len(thresholds)):
+            if not (on_grid[i] or i == best):
+                continue
+            calls = llm_calls[i] * (args.messages_per_day or 1000)
+            marker = "  <- best f1" if i == best else ""
+            print(f"{thresholds[i]:>7.2f}{metrics['precision'][i]:>8.3f}{metrics['recall'][i]:>8.3f}{metrics['f1'][i]:>8.3f}"
+                  f"{metrics['flag_rate'][i]:>9.1%}{calls:>13.0f}{llm_change[i]:>+10.0%}{marker}")
+
+        out[path] = {name: values.tolist() for name, values in metrics.items()}
+        out[path]["llm_calls_vs_baseline"] = llm_change.tolist()
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(out, f)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+"""
+This file implements an on-disk cache of tokenized datasets, so offline runs (threshold sweeps,
+comparing models) tokenize a TSV once instead of on every run.
+
+A cache is a folder of fixed-width .npy arrays (token ids, attention mask, token type ids, one row
+per statement, zero padded to max_length) plus the length of each row and its row number in the
+TSV. The rows are stored sorted by length, so a batch of similar-length rows is a plain slice of
+the memory-mapped arrays, cut down to the longest row in it, and only the pages it touches are read.
+Ids are stored as uint16 (uint8 for the mask and token types) to keep the files small, so the
+engine makes one int64 copy of each batch; that's batch sized, never the whole dataset.
+
+The folder name is keyed on the input file, the tokenizer (its vocab and settings), max_length and
+the tokenization scheme, so changing any of them builds a new cache instead of reusing a stale one.
+
+Build the cache for batch_predict.py ahead of time (it's also built on first use):
+    python token_cache.py --input ../../LIAR-PLUS-master/dataset/tsv/test2.tsv [--max-length 256]
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+CACHE_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "token_cache")
+ARRAYS = ["input_ids", "attention_mask", "token_type_ids"]
+BUILD_CHUNK_ROWS = 10000
+
+
+def tokenize_all(tokenizer, statements, justifications, max_length):
+    '''
+    Tokenizes the whole column in one call (the fast tokenizer does it in parallel in rust).
+    Rows without a justification are tokenized without a text pair: in a batched call an empty
+    string pair still adds a second [SEP], which tokenizing one row at a time never did.
+    '''
+    paired = [i for i, j in enumerate(justifications) if j]
+    single = [i for i, j in enumerate(justifications) if not j]
+    encodings = {}
+    for rows, pairs in [(single, None), (paired, [justifications[i] for i in paired])]:
+        if not rows:
+            continue
+        part = tokenizer([statements[i] for i in rows], pairs, truncation=True, max_length=max_length)
+        for key in part.keys():
+            column = encodings.setdefault(key, [None] * len(statements))
+            for i, value in zip(rows, part[key]):
+                column[i] = value
+    return encodings
+
+def tokenizer_fingerprint(tokenizer):
+    vocab = tokenizer.get_vocab() if hasattr(tokenizer, "get_vocab") else tokenizer.vocab
+    h = hashlib.sha256(json.dumps(sorted(vocab.items())).encode("utf-8"))
+    h.update(type(tokenizer).__name__.encode("utf-8"))
+    h.update(str(getattr(tokenizer, "do_lower_case", getattr(tokenizer, "init_kwargs", {}).get("do_lower_case"))).encode("utf-8"))
+    return h.hexdigest()
+
+def cache_dir_for(input_path, tokenizer, max_length, scheme, cache_root=CACHE_ROOT):
+    stat = os.stat(input_path)
+    key = json.dumps({
+        "input": os.path.abspath(input_path), "size": stat.st_size, "mtime": stat.st_mtime,
+        "tokenizer": tokenizer_fingerprint(tokenizer), "max_length": max_length, "scheme": scheme,
+    }, sort_keys=True)
+    name = os.path.splitext(os.path.basename(input_path))[0]
+    return os.path.join(cache_root, f"{name}-{scheme}-{max_length}-{hashlib.sha256(key.encode('utf-8')).hexdigest()[:12]}")
+
+
+class TokenCache:
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, "meta.json")) as f:
+            self.meta = json.load(f)
+        # read-only memory maps, pages are only read from disk when a batch touches them
+        self.arrays = {name: np.load(os.path.join(directory, name + ".npy"), mmap_mode="r") for name in ARRAYS}
+        self.lengths = np.load(os.path.join(directory, "lengths.npy"), mmap_mode="r")
+        self.rows = np.load(os.path.join(directory, "rows.npy"), mmap_mode="r") # TSV row of each stored row
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def batch_bounds(self, batch_size):
+        return [(start, min(start + batch_size, len(self))) for start in range(0, len(self), batch_size)]
+
+    def batch(self, start, end, trim=True):
+        '''
+        Returns (TSV row numbers, arrays) for stored rows start..end. The arrays are views into
+        the memory maps; with trim they're cut to the longest row in the batch (the last one,
+        since rows are sorted by length).
+        '''
+        width = int(self.lengths[end - 1]) if trim and end > start else self.meta["max_length"]
+        return self.rows[start:end], {name: array[start:end, :width] for name, array in self.arrays.items()}
+
+    @classmethod
+    def build(cls, directory, statements, encode_batch, max_length, meta=None):
+        '''
+        encode_batch(list of statements) returns a dict with "input_ids" (list of id lists, at
+        most max_length long) and optionally "attention_mask" and "token_type_ids".
+        Built in a temp folder and renamed into place, so a half-built cache is never used.
+        '''
+        tmp_dir = directory + ".tmp"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        n = len(statements)
+        vocab_dtype = np.uint16 if (meta or {}).get("vocab_size", 0) <= np.iinfo(np.uint16).max + 1 else np.int32
+        dtypes = {"input_ids": vocab_dtype, "attention_mask": np.uint8, "token_type_ids": np.uint8}
+
+        # tokenize in chunks into unsorted scratch arrays, so memory doesn't grow with the input
+        scratch = {name: np.lib.format.open_memmap(os.path.join(tmp_dir, name + ".unsorted.npy"), mode="w+", dtype=dtypes[name], shape=(n, max_length)) for name in ARRAYS}
+        lengths = np.zeros(n, dtype=np.int32)
+        for start in range(0, n, BUILD_CHUNK_ROWS):
+            encoded = encode_batch(statements[start:start + BUILD_CHUNK_ROWS])
+            for i, ids in enumerate(encoded["input_ids"]):
+                row = start + i
+                lengths[row] = len(ids)
+                scratch["input_ids"][row, :len(ids)] = ids
+                scratch["attention_mask"][row, :len(ids)] = encoded["attention_mask"][i] if "attention_mask" in encoded else 1
+                if "token_type_ids" in encoded:
+                    scratch["token_type_ids"][row, :len(ids)] = encoded["token_type_ids"][i]
+
+        # then write them out again sorted by length
+        order = np.argsort(lengths, kind="stable")
+        for name in ARRAYS:
+            out = np.lib.format.open_memmap(os.path.join(tmp_dir, name + ".npy"), mode="w+", dtype=dtypes[name], shape=(n, max_length))
+            for start in range(0, n, BUILD_CHUNK_ROWS):
+                out[start:start + BUILD_CHUNK_ROWS] = scratch[name][order[start:start + BUILD_CHUNK_ROWS]]
+            out.flush()
+            del out
+        scratch = None
+        for name in ARRAYS:
+            os.remove(os.path.join(tmp_dir, name + ".unsorted.npy"))
+        np.save(os.path.join(tmp_dir, "lengths.npy"), lengths[order])
+        np.save(os.path.join(tmp_dir, "rows.npy"), order.astype(np.int64))
+        with open(os.path.join(tmp_dir, "meta.json"), "w") as f:
+            json.dump(dict(meta or {}, rows=n, max_length=max_length), f)
+        shutil.rmtree(directory, ignore_errors=True)
+        os.replace(tmp_dir, directory)
+        return cls(directory)
+
+    @classmethod
+    def open_or_build(cls, directory, load_statements, encode_batch, max_length, meta=None):
+        if os.path.isfile(os.path.join(directory, "meta.json")):
+            return cls(directory)
+        print(f"Building token cache {directory}")
+        return cls.build(directory, load_statements(), encode_batch, max_length, meta)
+
+
+def read_statements(input_path, header=None):
+    # only the statement column, the rest of the TSV isn't needed to build the cache
+    column = pd.read_csv(input_path, sep="\t", header=header, usecols=[3])
+    return ["" if pd.isna(s) else str(s) for s in column.iloc[:, 0]]
+
+def open_for_batch_predict(input_path, tokenizer, max_length, cache_root=CACHE_ROOT):
+    '''
+    The cache batch_predict.py uses: statement only (no justification), the model's tokenizer.
+    '''
+    directory = cache_dir_for(input_path, tokenizer, max_length, "statement", cache_root)
+    encode_batch = lambda statements: tokenize_all(tokenizer, statements, [""] * len(statements), max_length)
+    meta = {"input": os.path.abspath(input_path), "scheme": "statement", "vocab_size": len(tokenizer.get_vocab())}
+    return TokenCache.open_or_build(directory, lambda: read_statements(input_path), encode_batch, max_length, meta)
+
+
+def main():
+    from transformers import BertTokenizerFast
+    from classifier_model import MODEL_DIR
+
+    parser = argparse.ArgumentParser(description="Tokenize a LIAR tsv once into memory-mapped arrays for batch_predict.py.")
+    parser.add_argument("--input", required=True)
+    parser.add_argument("--max-length", type=int, default=256)
+    parser.add_argument("--cache-root", default=CACHE_ROOT)
+    args = parser.parse_args()
+
+    cache = open_for_batch_predict(args.input, BertTokenizerFast.from_pretrained(MODEL_DIR), args.max_length, args.cache_root)
+    size = sum(os.path.getsize(os.path.join(cache.directory, f)) for f in os.listdir(cache.directory))
+    print(f"{cache.directory}: {len(cache)} rows, {size / 1e6:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
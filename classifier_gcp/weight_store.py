@@ -0,0 +1,113 @@
+"""
+This file implements the local cache for model files (model.safetensors, classifier.onnx) so a
+cold start reads them from disk instead of downloading them from GCS every time.
+
+fetch() looks in this order and returns a local path:
+1. the cache directory, if the file there still matches the sha256 recorded when it was cached
+2. a local source directory (e.g. weights baked into the image or a mounted volume). The file is
+   used in place, which also makes it work offline
+3. the GCS bucket. The file is downloaded to a temp name, hashed, and renamed into the cache,
+   so a crash halfway never leaves a truncated file behind
+"""
+import hashlib
+import os
+import time
+
+
+def sha256_file(path, chunk_size=8 * 2**20):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class WeightStore:
+    def __init__(self, cache_dir, bucket_name=None, source_dir=None):
+        self.cache_dir = cache_dir
+        self.bucket_name = bucket_name
+        self.source_dir = source_dir
+        self.last_fetch = {} # filename -> where it came from, how long it took and its sha256 if known, for /stats
+        self.checksums = {} # path -> sha256, for every file hashed on the way
+
+    def fetch(self, filename, expected_sha256=None):
+        '''
+        Returns a local path to filename. If expected_sha256 is given, a file that doesn't match
+        it is never returned.
+        '''
+        start = time.perf_counter()
+        path, source = self._cached(filename, expected_sha256), "cache"
+        if path is None:
+            path, source = self._from_source_dir(filename, expected_sha256), "source_dir"
+        if path is None:
+            path, source = self._download(filename, expected_sha256), "gcs"
+        self.last_fetch[filename] = {"source": source, "path": path, "seconds": round(time.perf_counter() - start, 2), "sha256": self.checksums.get(path)}
+        print(f"Using {path} (from {source})")
+        return path
+
+    def sha256(self, filename):
+        '''
+        sha256 of the file the last fetch(filename) returned. Already known unless it came from the
+        source dir without an expected checksum, then it's hashed now.
+        '''
+        fetched = self.last_fetch[filename]
+        if fetched["sha256"] is None:
+            fetched["sha256"] = self.checksums[fetched["path"]] = sha256_file(fetched["path"])
+        return fetched["sha256"]
+
+    def _checksum_path(self, filename):
+        return os.path.join(self.cache_dir, filename + ".sha256")
+
+    def _cached(self, filename, expected_sha256):
+        path = os.path.join(self.cache_dir, filename)
+        try:
+            with open(self._checksum_path(filename)) as f:
+                recorded = f.read().strip()
+        except OSError:
+            return None
+        if not os.path.isfile(path):
+            return None
+        # hashing reads the whole file, which also pulls it into the page cache for the mmap that follows
+        actual = sha256_file(path)
+        if actual != recorded or (expected_sha256 and actual != expected_sha256):
+            print(f"Cached {path} doesn't match its checksum, fetching it again")
+            os.remove(path)
+            return None
+        self.checksums[path] = actual
+        return path
+
+    def _from_source_dir(self, filename, expected_sha256):
+        if not self.source_dir:
+            return None
+        path = os.path.join(self.source_dir, filename)
+        if not os.path.isfile(path):
+            return None
+        if expected_sha256:
+            if sha256_file(path) != expected_sha256:
+                raise ValueError(f"{path} doesn't match the expected sha256 {expected_sha256}")
+            self.checksums[path] = expected_sha256
+        return path
+
+    def _download(self, filename, expected_sha256):
+        if not self.bucket_name:
+            raise FileNotFoundError(f"{filename} isn't cached in {self.cache_dir} or in the source dir, and no bucket is configured")
+        from google.cloud import storage
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = os.path.join(self.cache_dir, filename)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            # download_to_filename checks the md5 GCS has for the blob
+            storage.Client().bucket(self.bucket_name).blob(filename).download_to_filename(tmp_path)
+            actual = sha256_file(tmp_path)
+            if expected_sha256 and actual != expected_sha256:
+                raise ValueError(f"gs://{self.bucket_name}/{filename} doesn't match the expected sha256 {expected_sha256}")
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        with open(self._checksum_path(filename), "w") as f:
+            f.write(actual + "\n")
+        self.checksums[path] = actual
+        print(f"Downloaded gs://{self.bucket_name}/{filename} to {path}")
+        return path